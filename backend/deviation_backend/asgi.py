@@ -2,6 +2,10 @@
 ASGI config for deviation_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides the Django app it serves the /api/events/ Server-Sent Events stream
+(see deviations/sse.py), which needs an ASGI server, e.g.:
+
+    uvicorn deviation_backend.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +17,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'deviation_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from deviations.sse import EventStreamRouter # noqa: E402 (needs the app registry loaded above)
+
+application = EventStreamRouter(django_application)
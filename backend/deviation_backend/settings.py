@@ -33,11 +33,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'deviations.middleware.RequestInstrumentationMiddleware', # Server-Timing, request log line, /api/_metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'deviations.middleware.SQLiteConcurrencyMiddleware', # Read connection for GETs, write queue for the rest
+    'deviations.middleware.ProfilingMiddleware', # Opt-in (staff) and sampled request profiles
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,9 +72,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            'timeout': 20, # Seconds to wait on a locked database (same as busy_timeout below)
+            'transaction_mode': 'IMMEDIATE', # Take the write lock at BEGIN, never upgrade mid-transaction
+        },
+    },
+    # Same file, opened query_only. Used for reads of GET/HEAD/OPTIONS requests (see deviations/db.py).
+    'read': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['deviations.db.ReadWriteRouter']
+
+# Every new SQLite connection gets deviations.db.DEFAULT_SQLITE_PRAGMAS (WAL, busy timeout, ...);
+# define SQLITE_PRAGMAS here to replace them.
+
+# Seconds a write request may wait for its turn in the write queue (None = wait forever)
+SQLITE_WRITE_QUEUE_TIMEOUT = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,17 +147,84 @@ MEDIA_ROOT = BASE_DIR.parent / 'media' # Go up one level to access the main medi
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication', # Use JWT for authentication
+        'deviations.authentication.CachedJWTAuthentication', # JWT, with the user resolved from a short-TTL cache
         'rest_framework.authentication.SessionAuthentication', # Keep session for Django Admin
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated', # Default to requiring authentication
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'deviations.renderers.InstrumentedJSONRenderer', # Same as JSONRenderer, but timed for Server-Timing
+        'deviations.renderers.InstrumentedBrowsableAPIRenderer',
+    ),
+    # Token buckets per user and scope (deviations/throttling.py); 429 + Retry-After when empty
+    'DEFAULT_THROTTLE_CLASSES': (
+        'deviations.throttling.ScopedTokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('THROTTLE_RATE_READ', '1200/min'),
+        'write': os.environ.get('THROTTLE_RATE_WRITE', '300/min'), # Every write waits for the one SQLite writer
+        'heavy': os.environ.get('THROTTLE_RATE_HEAVY', '20/min'), # Queued imports/exports, result downloads
+    },
     # Optional: Add filters or pagination defaults here if needed later
 }
 
 from datetime import timedelta
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Live progress of background jobs, shared between the run_jobs workers and the web processes
+    'jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'job_progress',
+    },
+}
+
+# Cache of JWT-authenticated users (deviations.authentication.CachedJWTAuthentication).
+# Invalidated on user save/delete; the TTL bounds staleness across worker processes.
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TTL = 60 # Seconds
+
+# Background jobs (deviations/jobs.py, `python manage.py run_jobs`)
+JOBS_CACHE_ALIAS = 'jobs'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = 1.0 # Seconds between queue polls when idle
+JOB_STALE_SECONDS = 300 # A running job without heartbeat for this long is failed
+REMINDER_DAYS_AHEAD = 3 # send_reminders covers open actions due within this many days
+
+# Online database snapshots (deviations/snapshots.py, `manage.py snapshot_db` / `restore_db`)
+SNAPSHOT_DIR = Path(os.environ.get('SNAPSHOT_DIR', BASE_DIR / 'snapshots'))
+SNAPSHOT_RETENTION = 7 # Newest snapshots kept
+SNAPSHOT_PAGES_PER_STEP = 512 # Pages copied per backup step (2 MB with 4 KB pages)
+SNAPSHOT_STEP_SLEEP = 0.01 # Seconds paused between steps
+
+# Parquet copy for reporting (deviations/analytics.py, `manage.py snapshot_analytics`, /api/analytics/)
+ANALYTICS_DIR = Path(os.environ.get('ANALYTICS_DIR', BASE_DIR / 'analytics'))
+ANALYTICS_CHUNK_SIZE = 2000 # Deviations read and written per step
+ANALYTICS_MAX_RUNS = 100 # Incremental runs before the next run rewrites (compacts) everything
+
+# Near-duplicate deviations (deviations/similarity.py, /api/deviations/<dev_number>/similar)
+SIMILARITY_THRESHOLD = 0.5 # Default minimum estimated Jaccard similarity of two deviations' shingles
+
+# Request coalescing of identical concurrent GETs (deviations/coalescing.py)
+SINGLE_FLIGHT_TIMEOUT = 10.0 # Seconds a request waits for the shared result before computing its own
+
+# POST /api/deviations/bulk_upsert (deviations/bulk.py)
+BULK_UPSERT_BATCH_SIZE = 500 # Items validated and written per step
+BULK_UPSERT_MAX_ITEMS = 20000 # Per request
+
+# Attachment previews (deviations/previews.py, /api/deviations/<dev_number>/attachment/preview)
+THUMBNAIL_WIDTH = 320 # Pixels; the height follows the first page's aspect ratio
+
+# Archive of closed deviations (deviations/archive.py, `manage.py archive_deviations`)
+ARCHIVE_AFTER_DAYS = 3 * 365 # Done deviations that expired longer ago than this are archived
+ARCHIVE_BATCH_SIZE = 500 # Deviations moved per transaction
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'deviation-tracker@localhost')
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=2), # How long access token is valid
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),    # How long refresh token is valid
@@ -165,5 +258,35 @@ SIMPLE_JWT = {
 
 X_FRAME_OPTIONS = 'ALLOWALL'
 
-
-
+# Shared secret that lets a Prometheus scraper read /api/_metrics via the X-Metrics-Token header
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Push channel (/api/events/, see deviations/events.py). InProcessBackend only reaches clients connected
+# to the same process; with several ASGI workers use ChangeLogBackend, which tails the change log table.
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'deviations.events.InProcessBackend')
+EVENTS_POLL_INTERVAL = 0.5 # Seconds, ChangeLogBackend only
+
+# Request profiler (deviations.middleware.ProfilingMiddleware). Staff can profile a request with an
+# `X-Profile: 1` header or `?_profile=1`; PROFILER_SAMPLE_RATE also profiles that fraction of all requests.
+PROFILER_DIR = BASE_DIR / 'profiles'
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', '0'))
+PROFILER_INTERVAL_MS = 5
+PROFILER_MAX_PROFILES = 200
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One JSON line per request (see deviations.middleware.RequestInstrumentationMiddleware)
+        'deviations.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -9,8 +9,12 @@ from rest_framework_simplejwt.views import ( # <--- IMPORT THESE JWT VIEWS
     TokenRefreshView,
 )
 from deviations.views import UserListAPIView, CurrentUserAPIView # <--- IMPORT NEW USER VIEWS
+from deviations.admin import profile_list_view, profile_download_view
 
 urlpatterns = [
+    # Request profiles (staff only, listed before admin.site.urls so they are not swallowed by it)
+    path('admin/profiles/', admin.site.admin_view(profile_list_view), name='admin-profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(profile_download_view), name='admin-profile-download'),
     path('admin/', admin.site.urls),
     path('api/', include('deviations.urls')),
 
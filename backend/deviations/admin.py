@@ -1,3 +1,203 @@
-from django.contrib import admin
+from datetime import date, datetime
 
-# Register your models here.
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+
+from .bulk import set_actions_status
+from .changes import record_changes
+from .db import serialized_write
+from .archive import restore_deviations
+from .models import Action, ArchivedDeviation, ChangeLogEntry, Deviation, bump_versions
+from .profiling import list_profiles, profile_path
+from .reports import annotate_deviation_status
+
+
+# --- Shared bulk updates ---
+# Bulk admin actions are set-based (one UPDATE / one bulk_create) and log what they
+# touched themselves, since update() and bulk_create() bypass the change log signals.
+
+def mark_actions_done(actions):
+    """Sets every open action in `actions` to Done. Returns how many changed."""
+    return len(set_actions_status(actions, 'Done'))
+
+
+def reassign_actions(actions, user):
+    """Replaces the responsible users of every action in `actions` with `user`."""
+    Responsible = Action.action_responsible_users.through
+    with serialized_write(), transaction.atomic():
+        pairs = list(Action.objects.filter(pk__in=actions.values('pk')).values_list('id', 'deviation_id'))
+        Responsible.objects.filter(action_id__in=[action_id for action_id, _ in pairs]).delete()
+        Responsible.objects.bulk_create([Responsible(action_id=action_id, user=user) for action_id, _ in pairs],
+                                        batch_size=5000)
+        bump_versions(Action, [action_id for action_id, _ in pairs])
+        record_changes(ChangeLogEntry.ACTION, pairs, ChangeLogEntry.UPDATE)
+    return len(pairs)
+
+
+class ReassignActionForm(ActionForm):
+    # A username box instead of a <select> with every user in it
+    username = forms.CharField(required=False, label='Reassign to (username)')
+
+
+# --- Deviations ---
+class DeviationStatusFilter(admin.SimpleListFilter):
+    title = 'status'
+    parameter_name = 'deviation_status'
+
+    def lookups(self, request, model_admin):
+        return [(status, status) for status in ('Not Started', 'In Progress', 'Delayed', 'Done')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(deviation_status=self.value())
+        return queryset
+
+
+class HasOpenActionsFilter(admin.SimpleListFilter):
+    title = 'open actions'
+    parameter_name = 'open_actions'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            has_open = Exists(Action.objects.filter(deviation=OuterRef('pk'), status__in=Action.OPEN_STATUSES))
+            return queryset.filter(has_open if self.value() == 'yes' else ~has_open)
+        return queryset
+
+
+class ActionInline(admin.TabularInline):
+    model = Action
+    fields = ['order', 'action_description', 'action_responsible', 'action_responsible_users',
+              'action_expiration_date', 'status', 'reminder_sent']
+    autocomplete_fields = ['action_responsible_users']
+    extra = 0
+
+
+@admin.register(Deviation)
+class DeviationAdmin(admin.ModelAdmin):
+    list_display = ['dev_number', 'year', 'owner_plant', 'sbu', 'created_by_user', 'expiration_date',
+                    'action_count', 'completion', 'status']
+    list_select_related = ['created_by_user']
+    list_filter = [DeviationStatusFilter, HasOpenActionsFilter, 'owner_plant', 'sbu', 'year']
+    search_fields = ['^dev_number', 'drawing_number']
+    ordering = Deviation.NATURAL_ORDERING # DEV24-9 before DEV24-10
+    autocomplete_fields = ['created_by_user']
+    inlines = [ActionInline]
+    actions = ['mark_all_actions_done']
+    show_full_result_count = False # Skip the unfiltered COUNT(*) on filtered pages
+
+    def get_queryset(self, request):
+        return annotate_deviation_status(super().get_queryset(request))
+
+    @admin.display(ordering='action_count', description='Actions')
+    def action_count(self, obj):
+        return obj.action_count
+
+    @admin.display(ordering='completion_percentage', description='Complete')
+    def completion(self, obj):
+        return f'{obj.completion_percentage}%'
+
+    @admin.display(ordering='deviation_status', description='Status')
+    def status(self, obj):
+        return obj.deviation_status
+
+    @admin.action(description='Mark all actions of the selected deviations as Done')
+    def mark_all_actions_done(self, request, queryset):
+        count = mark_actions_done(Action.objects.filter(deviation__in=queryset.values('pk')))
+        self.message_user(request, f'Marked {count} action(s) as Done.')
+
+
+# --- Actions ---
+@admin.register(Action)
+class ActionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'deviation', 'short_description', 'responsibles', 'action_expiration_date', 'status', 'overdue']
+    list_select_related = ['deviation']
+    list_filter = ['status', 'deviation__owner_plant', 'deviation__sbu', 'deviation__year', 'action_expiration_date']
+    search_fields = ['^deviation__dev_number', 'action_description', 'action_responsible']
+    ordering = ['-id']
+    autocomplete_fields = ['deviation', 'action_responsible_users']
+    action_form = ReassignActionForm
+    actions = ['mark_done', 'reassign']
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('action_responsible_users')
+
+    @admin.display(description='Description')
+    def short_description(self, obj):
+        return obj.action_description[:80]
+
+    @admin.display(description='Responsible')
+    def responsibles(self, obj):
+        users = obj.action_responsible_users.all() # Prefetched
+        return ', '.join(user.get_full_name() or user.username for user in users) or obj.action_responsible or '-'
+
+    @admin.display(boolean=True, ordering='action_expiration_date')
+    def overdue(self, obj):
+        return obj.status != 'Done' and obj.action_expiration_date is not None and obj.action_expiration_date < date.today()
+
+    @admin.action(description='Mark selected actions as Done')
+    def mark_done(self, request, queryset):
+        count = mark_actions_done(queryset)
+        self.message_user(request, f'Marked {count} action(s) as Done.')
+
+    @admin.action(description='Reassign selected actions to the user below')
+    def reassign(self, request, queryset):
+        username = request.POST.get('username', '').strip()
+        user = User.objects.filter(username=username).first() if username else None
+        if user is None:
+            self.message_user(request, f'No user "{username}".' if username else 'Enter a username to reassign to.',
+                              messages.ERROR)
+            return
+        count = reassign_actions(queryset, user)
+        self.message_user(request, f'Reassigned {count} action(s) to {user.username}.')
+
+
+# --- Archive (see deviations/archive.py) ---
+@admin.register(ArchivedDeviation)
+class ArchivedDeviationAdmin(admin.ModelAdmin):
+    """Read-only: archived deviations are edited after restoring them."""
+    list_display = ['dev_number', 'year', 'owner_plant', 'sbu', 'expiration_date', 'archived_at']
+    list_filter = ['owner_plant', 'sbu', 'year']
+    search_fields = ['^dev_number', 'drawing_number']
+    ordering = ArchivedDeviation.NATURAL_ORDERING
+    actions = ['restore']
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Restore the selected deviations', permissions=['delete'])
+    def restore(self, request, queryset):
+        counts = restore_deviations(list(queryset.values_list('dev_number', flat=True)))
+        self.message_user(request, f'Restored {counts["deviations"]} deviation(s) and {counts["actions"]} action(s).')
+        if counts['conflicting']:
+            self.message_user(request, f'Not restored, their numbers are in use: {", ".join(counts["conflicting"])}.',
+                              messages.WARNING)
+
+
+# --- Request profiles (see deviations/profiling.py) ---
+def profile_list_view(request):
+    profiles = list_profiles()
+    for profile in profiles:
+        profile['recorded'] = datetime.fromtimestamp(profile['created']) if profile.get('created') else None
+    context = {**admin.site.each_context(request), 'title': 'Request profiles', 'profiles': profiles}
+    return TemplateResponse(request, 'admin/deviations/profiles.html', context)
+
+
+def profile_download_view(request, profile_id):
+    path = profile_path(profile_id)
+    if path is None:
+        raise Http404('Profile not found.')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.folded', content_type='text/plain')
@@ -0,0 +1,268 @@
+# deviation_tracker_app/deviation_backend/deviations/analytics.py
+#
+# Columnar copy of the data for reporting (`manage.py snapshot_analytics`, or a
+# `snapshot_analytics` job), so BI tools read Parquet files instead of paging
+# through /api/deviations/.
+#
+# ANALYTICS_DIR holds three Parquet datasets, hive-partitioned by the deviation's
+# year and owner plant (deviations/year=2024/owner_plant=Arimex/part-....parquet):
+#   deviations    one row per deviation, with action counts, completion and status
+#   actions       one row per action, with is_open/is_overdue as of snapshot_date
+#   responsibles  one row per action <-> user link
+#
+# Runs are incremental: only deviations with change-log entries after the cursor
+# of the last run are written again, as new part files. Every row carries the
+# `snapshot_cursor` it was written at, so a deviation's current rows are those at
+# the highest cursor written for it (older copies, possibly in another partition
+# if its year or plant changed, are superseded); deleted deviations get a row
+# with deleted=True, archived ones (archive.py) keep being written from the
+# archive tables. load_table() applies these rules. The first run, a run after
+# the change log was pruned past the cursor, and every ANALYTICS_MAX_RUNS-th run
+# rewrite everything, which also drops the superseded files.
+
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from django.conf import settings
+
+from .changes import latest_cursor, oldest_cursor
+from .models import Action, ArchivedAction, ArchivedDeviation, ChangeLogEntry, Deviation
+from .reports import annotate_deviation_status
+
+STATE_FILE = '_state.json' # Leading underscore: ignored by Parquet dataset readers
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int32()), ('owner_plant', pa.string())]), flavor='hive')
+
+DEVIATION_FIELDS = [
+    'id', 'dev_number', 'dev_prefix', 'dev_year', 'dev_sequence', 'primary_column', 'created_by', 'created_by_user_id',
+    'affected_plant', 'sbu', 'release_date', 'effectivity_date', 'expiration_date', 'drawing_number',
+    'back_to_back_deviation', 'defect_category', 'assembly_defect_type', 'molding_defect_type', 'version',
+]
+ACTION_FIELDS = [
+    'id', 'deviation_id', 'order', 'action_description', 'action_responsible', 'action_expiration_date', 'status',
+    'reminder_sent', 'version',
+]
+
+SCHEMAS = {
+    'deviations': pa.schema([
+        ('id', pa.int64()), ('dev_number', pa.string()), ('dev_prefix', pa.string()), ('dev_year', pa.int32()),
+        ('dev_sequence', pa.int64()), ('primary_column', pa.string()), ('created_by', pa.string()),
+        ('created_by_user_id', pa.int64()), ('affected_plant', pa.string()), ('sbu', pa.string()),
+        ('release_date', pa.date32()), ('effectivity_date', pa.date32()), ('expiration_date', pa.date32()),
+        ('drawing_number', pa.string()), ('back_to_back_deviation', pa.bool_()), ('defect_category', pa.string()),
+        ('assembly_defect_type', pa.string()), ('molding_defect_type', pa.string()), ('version', pa.int64()),
+        ('action_count', pa.int32()), ('done_count', pa.int32()), ('completion_percentage', pa.int32()),
+        ('deviation_status', pa.string()), ('deleted', pa.bool_()),
+        ('snapshot_cursor', pa.int64()), ('snapshot_date', pa.date32()),
+        ('year', pa.int32()), ('owner_plant', pa.string()),
+    ]),
+    'actions': pa.schema([
+        ('id', pa.int64()), ('deviation_id', pa.int64()), ('dev_number', pa.string()), ('order', pa.int64()),
+        ('action_description', pa.string()), ('action_responsible', pa.string()),
+        ('action_expiration_date', pa.date32()), ('status', pa.string()), ('reminder_sent', pa.bool_()),
+        ('version', pa.int64()), ('is_open', pa.bool_()), ('is_overdue', pa.bool_()),
+        ('snapshot_cursor', pa.int64()), ('snapshot_date', pa.date32()),
+        ('year', pa.int32()), ('owner_plant', pa.string()),
+    ]),
+    'responsibles': pa.schema([
+        ('action_id', pa.int64()), ('deviation_id', pa.int64()), ('user_id', pa.int64()), ('username', pa.string()),
+        ('snapshot_cursor', pa.int64()), ('snapshot_date', pa.date32()),
+        ('year', pa.int32()), ('owner_plant', pa.string()),
+    ]),
+}
+TABLES = list(SCHEMAS)
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+def analytics_dir():
+    return Path(getattr(settings, 'ANALYTICS_DIR', settings.BASE_DIR / 'analytics'))
+
+
+def read_state(directory=None):
+    path = Path(directory or analytics_dir()) / STATE_FILE
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def list_files(directory=None):
+    """Relative paths and sizes of the Parquet files, for the download endpoint."""
+    directory = Path(directory or analytics_dir())
+    files = []
+    for table in TABLES:
+        for path in sorted((directory / table).rglob('*.parquet')):
+            files.append({'path': path.relative_to(directory).as_posix(), 'bytes': path.stat().st_size})
+    return files
+
+
+def _table_rows(deviations, actions, deviation_ids, today):
+    """Deviation, action and responsible rows of the `deviations` model (hot or archived) for the given ids."""
+    found = {row['id']: row for row in annotate_deviation_status(
+        deviations.objects.filter(pk__in=deviation_ids), today=today).values(
+        *DEVIATION_FIELDS, 'year', 'owner_plant', 'action_count', 'done_count', 'completion_percentage',
+        'deviation_status')}
+
+    action_rows = []
+    for row in actions.objects.filter(deviation_id__in=list(found)).order_by().values(*ACTION_FIELDS):
+        deviation = found[row['deviation_id']]
+        is_open = row['status'] in Action.OPEN_STATUSES
+        action_rows.append({
+            **row, 'dev_number': deviation['dev_number'], 'is_open': is_open,
+            'is_overdue': is_open and row['action_expiration_date'] is not None and row['action_expiration_date'] < today,
+            'year': deviation['year'], 'owner_plant': deviation['owner_plant'],
+        })
+
+    links = actions.action_responsible_users.through
+    action = actions._meta.get_field('action_responsible_users').m2m_field_name() # 'action' / 'archivedaction'
+    responsible_rows = [
+        {'action_id': action_id, 'user_id': user_id, 'deviation_id': deviation_id, 'username': username,
+         'year': found[deviation_id]['year'], 'owner_plant': found[deviation_id]['owner_plant']}
+        for action_id, user_id, deviation_id, username in links.objects.filter(
+            **{f'{action}__deviation_id__in': list(found)}).order_by().values_list(
+            f'{action}_id', 'user_id', f'{action}__deviation_id', 'user__username')
+    ]
+    return found, action_rows, responsible_rows
+
+
+def _rows(deviation_ids, cursor, today):
+    """Rows of the three tables for the given deviations, as of now."""
+    stamp = {'snapshot_cursor': cursor, 'snapshot_date': today}
+    rows = {table: [] for table in TABLES}
+    missing = deviation_ids
+    # Archived deviations are written like hot ones: archiving does not change the data
+    for deviations, actions in ((Deviation, Action), (ArchivedDeviation, ArchivedAction)):
+        if not missing:
+            break
+        found, action_rows, responsible_rows = _table_rows(deviations, actions, missing, today)
+        rows['deviations'].extend({**row, 'deleted': False, **stamp} for row in found.values())
+        rows['actions'].extend({**row, **stamp} for row in action_rows)
+        rows['responsibles'].extend({**row, **stamp} for row in responsible_rows)
+        missing = [pk for pk in missing if pk not in found]
+    rows['deviations'].extend({'id': pk, 'deleted': True, **stamp} for pk in missing)
+    return rows
+
+
+def _write(rows, target, name):
+    """Writes each table's rows under target/<table>/ as files named part-<name>-<n>.parquet."""
+    for table, schema in SCHEMAS.items():
+        if not rows[table]:
+            continue
+        ds.write_dataset(
+            pa.Table.from_pylist(rows[table], schema=schema), str(target / table), format='parquet',
+            partitioning=PARTITIONING, basename_template=f'part-{name}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+        )
+
+
+def _move_files(source, target):
+    for path in source.rglob('*.parquet'):
+        destination = target / path.relative_to(source)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, destination)
+
+
+def snapshot_analytics(directory=None, full=False, chunk_size=None, progress=None, today=None):
+    """
+    Brings the Parquet datasets in `directory` up to date with the database and returns
+    a summary: mode ('full' or 'incremental'), cursor, deviations written, rows per table.
+    """
+    directory = Path(directory or analytics_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    chunk_size = chunk_size or getattr(settings, 'ANALYTICS_CHUNK_SIZE', 2000)
+    today = today or date.today()
+    start = time.perf_counter()
+
+    state = read_state(directory)
+    cursor = latest_cursor() # Changes after this are picked up by the next run (rows may already be newer)
+    oldest = oldest_cursor()
+    if (full or state is None or cursor < state['cursor']
+            or (oldest is not None and oldest > state['cursor'] + 1) # Pruned entries we never saw
+            or state.get('runs', 0) >= getattr(settings, 'ANALYTICS_MAX_RUNS', 100)):
+        mode = 'full'
+        deviation_ids = sorted([*Deviation.objects.values_list('pk', flat=True),
+                                *ArchivedDeviation.objects.values_list('pk', flat=True)])
+    else:
+        mode = 'incremental'
+        deviation_ids = sorted({
+            pk for pk in ChangeLogEntry.objects.filter(id__gt=state['cursor'], id__lte=cursor)
+            .values_list('deviation_id', flat=True).distinct() if pk is not None
+        })
+
+    counts = {table: 0 for table in TABLES}
+    staging = directory / f'_staging-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        for done in range(0, len(deviation_ids), chunk_size):
+            rows = _rows(deviation_ids[done:done + chunk_size], cursor, today)
+            _write(rows, staging, f'{cursor:012d}-{done // chunk_size:05d}')
+            for table in TABLES:
+                counts[table] += len(rows[table])
+            if progress is not None:
+                progress(min(done + chunk_size, len(deviation_ids)), len(deviation_ids))
+
+        if mode == 'full':
+            # Swap whole tables in, so the superseded files of earlier runs disappear.
+            for table in TABLES:
+                old = directory / f'_old-{table}'
+                shutil.rmtree(old, ignore_errors=True)
+                if (directory / table).exists():
+                    os.replace(directory / table, old)
+                if (staging / table).exists():
+                    os.replace(staging / table, directory / table)
+                shutil.rmtree(old, ignore_errors=True)
+        else:
+            _move_files(staging, directory)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    summary = {
+        'mode': mode,
+        'cursor': cursor,
+        'deviations_written': len(deviation_ids),
+        'rows': counts,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    new_state = {
+        'cursor': cursor,
+        'runs': 0 if mode == 'full' else state.get('runs', 0) + 1,
+        'rebuilt': datetime.now().isoformat(timespec='seconds') if mode == 'full' else state['rebuilt'],
+        'updated': datetime.now().isoformat(timespec='seconds'),
+        'last_run': summary,
+    }
+    partial = directory / f'{STATE_FILE}.partial'
+    partial.write_text(json.dumps(new_state, indent=2))
+    os.replace(partial, directory / STATE_FILE)
+    return summary
+
+
+def load_table(table, directory=None):
+    """
+    A pandas DataFrame of the current rows of `table` ('deviations', 'actions' or
+    'responsibles'): superseded copies and deleted deviations removed. Reads only the files.
+    """
+    if table not in SCHEMAS:
+        raise AnalyticsError(f'Unknown table "{table}", expected one of {", ".join(TABLES)}.')
+    directory = Path(directory or analytics_dir())
+    if not (directory / 'deviations').exists():
+        raise AnalyticsError(f'No analytics snapshot in {directory}.')
+
+    def read(name, columns=None):
+        path = directory / name
+        if not path.exists():
+            return pa.Table.from_pylist([], schema=SCHEMAS[name]).to_pandas()
+        return ds.dataset(str(path), format='parquet', partitioning=PARTITIONING).to_table(columns=columns).to_pandas()
+
+    versions = read('deviations', ['id', 'snapshot_cursor', 'deleted'])
+    latest = versions.sort_values('snapshot_cursor').drop_duplicates('id', keep='last')
+    latest = latest[~latest['deleted']].set_index('id')['snapshot_cursor']
+
+    frame = read(table)
+    key = 'id' if table == 'deviations' else 'deviation_id'
+    current = frame[frame[key].map(latest) == frame['snapshot_cursor']]
+    return current.drop(columns=['deleted'] if table == 'deviations' else []).reset_index(drop=True)
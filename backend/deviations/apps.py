@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class DeviationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'deviations'
+
+    def ready(self):
+        from .db import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='deviations_sqlite_pragmas')
+        from . import signals # noqa: F401 (registers the change log receivers)
@@ -0,0 +1,203 @@
+# deviation_tracker_app/deviation_backend/deviations/archive.py
+#
+# Hot/cold split of the deviation tables. Years of closed deviations make up most
+# of the rows but are hardly ever looked at, while every list, report and index
+# scan pays for them. Deviations that are Done (every action Done) and expired more
+# than ARCHIVE_AFTER_DAYS ago are moved, with their actions and responsible users,
+# into ArchivedDeviation / ArchivedAction, keeping their ids and attachment files.
+#
+#   * `python manage.py archive_deviations` (or an `archive_deviations` job) moves
+#     them ARCHIVE_BATCH_SIZE deviations per transaction, so API writers wait for one
+#     batch at a time. `python manage.py restore_deviations DEV24-0439 ...` moves
+#     deviations back, e.g. to reopen them.
+#   * Lists, reports and the similarity index only read the hot tables;
+#     `?include_archived=true` on /api/deviations/ merges the archive into the list
+#     (paged in SQL with `limit`/`offset`, see natural_page()),
+#     and the detail and attachment preview endpoints fall back to it. Archived
+#     deviations are read-only.
+#   * Archiving is logged as a delete in the change log (sync clients drop the rows)
+#     and restoring as a create. The analytics snapshot keeps archived deviations.
+#   * DEV numbers stay reserved: numbering, the Excel import and the bulk upsert
+#     look at the archive too, so an archived number is never created again.
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import IntegerField, Value
+from django.utils import timezone
+
+from .changes import record_changes
+from .db import serialized_write
+from .models import (
+    Action, ArchivedAction, ArchivedDeviation, ChangeLogEntry, Deviation, SimilarityBucket, SimilaritySignature,
+)
+from .responsibles import Responsible
+from .similarity import schedule_index
+
+ArchivedResponsible = ArchivedAction.action_responsible_users.through
+
+# Columns copied between the hot and the archive tables (same attnames on both sides)
+DEVIATION_COLUMNS = [field.attname for field in ArchivedDeviation._meta.concrete_fields if field.name != 'archived_at']
+ACTION_COLUMNS = [field.attname for field in ArchivedAction._meta.concrete_fields]
+LOOKUP_CHUNK_SIZE = 500
+
+
+def archive_after_days():
+    return getattr(settings, 'ARCHIVE_AFTER_DAYS', 3 * 365)
+
+
+def archive_batch_size():
+    return getattr(settings, 'ARCHIVE_BATCH_SIZE', 500)
+
+
+def archivable(older_than_days=None, today=None):
+    """Deviations with at least one action, all of them Done, that expired more than `older_than_days` ago."""
+    older_than_days = archive_after_days() if older_than_days is None else older_than_days
+    cutoff = (today or date.today()) - timedelta(days=older_than_days)
+    return Deviation.objects.filter(expiration_date__lt=cutoff, pk__in=Action.objects.values('deviation_id')) \
+        .exclude(pk__in=Action.objects.exclude(status='Done').values('deviation_id'))
+
+
+def archived_dev_numbers(dev_numbers):
+    """The set of `dev_numbers` that belong to archived deviations."""
+    dev_numbers = list(dev_numbers)
+    found = set()
+    for start in range(0, len(dev_numbers), LOOKUP_CHUNK_SIZE):
+        found.update(ArchivedDeviation.objects.filter(dev_number__in=dev_numbers[start:start + LOOKUP_CHUNK_SIZE])
+                     .values_list('dev_number', flat=True))
+    return found
+
+
+def natural_page(deviations, archived, offset=0, limit=None, reverse=False):
+    """
+    Rows `offset` to `offset + limit` (None: to the end) of two deviation querysets
+    merged in natural order (descending with `reverse`). The page is cut in SQL, by a
+    UNION ALL of both tables' sort keys, and only its rows are then loaded.
+    """
+    keys = Deviation.NATURAL_ORDERING
+    union = deviations.order_by().annotate(in_archive=Value(0, IntegerField())).values('pk', *keys, 'in_archive') \
+        .union(archived.order_by().annotate(in_archive=Value(1, IntegerField())).values('pk', *keys, 'in_archive'),
+               all=True) \
+        .order_by(*[f'-{key}' if reverse else key for key in keys])
+    page = [(row['in_archive'], row['pk'])
+            for row in (union[offset:offset + limit] if limit is not None else union[offset:])]
+    rows = {}
+    for in_archive, queryset in ((0, deviations), (1, archived)):
+        ids = [pk for source, pk in page if source == in_archive]
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            rows.update(((in_archive, row.pk), row)
+                        for row in queryset.order_by().filter(pk__in=ids[start:start + LOOKUP_CHUNK_SIZE]))
+    return [rows[key] for key in page]
+
+
+def _move(source, target, columns, ids, renumber=False, **extra):
+    """
+    Copies the `source` rows of `ids` to `target` and returns {old id: new id}. With
+    `renumber`, rows whose id is taken in `target` get a new one.
+    """
+    rows = list(source.objects.filter(pk__in=ids).order_by('pk').values(*columns))
+    taken = set(target.objects.filter(pk__in=ids).values_list('pk', flat=True)) if renumber else set()
+    objects = [target(**{**row, **{name: value(row) for name, value in extra.items()},
+                         'id': None if row['id'] in taken else row['id']})
+               for row in rows]
+    target.objects.bulk_create(objects, batch_size=1000)
+    return {row['id']: obj.pk for row, obj in zip(rows, objects)}
+
+
+def _archive_batch(deviation_ids, archived_at):
+    """Moves the deviations to the archive tables. Returns (deviations, actions) moved."""
+    _move(Deviation, ArchivedDeviation, DEVIATION_COLUMNS, deviation_ids, archived_at=lambda row: archived_at)
+    actions = list(Action.objects.filter(deviation_id__in=deviation_ids).values_list('id', 'deviation_id'))
+    action_ids = [action_id for action_id, _ in actions]
+    _move(Action, ArchivedAction, ACTION_COLUMNS, action_ids)
+    links = Responsible.objects.filter(action_id__in=action_ids)
+    ArchivedResponsible.objects.bulk_create([
+        ArchivedResponsible(archivedaction_id=action_id, user_id=user_id)
+        for action_id, user_id in links.values_list('action_id', 'user_id')
+    ], batch_size=5000)
+
+    # No delete signals (or cascades): the attachment files stay, the change log is written below
+    links.delete()
+    SimilarityBucket.objects.filter(deviation_id__in=deviation_ids).delete()
+    SimilaritySignature.objects.filter(deviation_id__in=deviation_ids).delete()
+    Action.objects.filter(pk__in=action_ids)._raw_delete(Action.objects.db)
+    Deviation.objects.filter(pk__in=deviation_ids)._raw_delete(Deviation.objects.db)
+    record_changes(ChangeLogEntry.ACTION, actions, ChangeLogEntry.DELETE)
+    record_changes(ChangeLogEntry.DEVIATION, deviation_ids, ChangeLogEntry.DELETE)
+    return len(deviation_ids), len(actions)
+
+
+def archive_deviations(older_than_days=None, batch_size=None, dry_run=False, progress=None, today=None):
+    """
+    Moves the archivable deviations (see archivable()) to the archive, `batch_size`
+    per transaction. Returns the counts: candidates, deviations and actions archived.
+    """
+    batch_size = batch_size or archive_batch_size()
+    candidates = list(archivable(older_than_days, today).order_by('pk').values_list('pk', flat=True))
+    counts = {'candidates': len(candidates), 'deviations': 0, 'actions': 0}
+    if dry_run:
+        return counts
+    for start in range(0, len(candidates), batch_size):
+        with serialized_write(), transaction.atomic():
+            # Still archivable: an action may have been reopened since the candidates were read
+            batch = list(archivable(older_than_days, today).filter(pk__in=candidates[start:start + batch_size])
+                         .values_list('pk', flat=True))
+            deviations, actions = _archive_batch(batch, timezone.now())
+        counts['deviations'] += deviations
+        counts['actions'] += actions
+        if progress is not None:
+            progress(min(start + batch_size, len(candidates)), len(candidates))
+    return counts
+
+
+def _restore_batch(archived_ids):
+    """Moves archived deviations back to the hot tables. Returns (deviations, actions) restored."""
+    # Ids are kept (AUTOINCREMENT never hands them out again); one taken anyway gets a new id
+    deviation_ids = _move(ArchivedDeviation, Deviation, DEVIATION_COLUMNS, archived_ids, renumber=True)
+    archived_actions = dict(ArchivedAction.objects.filter(deviation_id__in=archived_ids).values_list('pk', 'deviation_id'))
+    action_ids = _move(ArchivedAction, Action, ACTION_COLUMNS, list(archived_actions), renumber=True,
+                       deviation_id=lambda row: deviation_ids[row['deviation_id']])
+    links = ArchivedResponsible.objects.filter(archivedaction_id__in=list(archived_actions))
+    Responsible.objects.bulk_create([
+        Responsible(action_id=action_ids[action_id], user_id=user_id)
+        for action_id, user_id in links.values_list('archivedaction_id', 'user_id')
+    ], batch_size=5000)
+
+    links.delete()
+    ArchivedAction.objects.filter(pk__in=list(archived_actions))._raw_delete(ArchivedAction.objects.db)
+    ArchivedDeviation.objects.filter(pk__in=archived_ids)._raw_delete(ArchivedDeviation.objects.db)
+    record_changes(ChangeLogEntry.DEVIATION, list(deviation_ids.values()), ChangeLogEntry.CREATE)
+    record_changes(ChangeLogEntry.ACTION, [(action_ids[pk], deviation_ids[deviation_id])
+                                           for pk, deviation_id in archived_actions.items()], ChangeLogEntry.CREATE)
+    schedule_index(*deviation_ids.values())
+    return len(deviation_ids), len(action_ids)
+
+
+def restore_deviations(dev_numbers=None, batch_size=None, progress=None):
+    """
+    Moves the archived deviations with `dev_numbers` (None: all of them) back to the hot
+    tables. Returns the counts: deviations and actions restored, and the dev numbers
+    `not_found` in the archive and `conflicting` with a deviation created meanwhile.
+    """
+    batch_size = batch_size or archive_batch_size()
+    archived = ArchivedDeviation.objects.all()
+    if dev_numbers is not None:
+        dev_numbers = list(dict.fromkeys(dev_numbers))
+        archived = archived.filter(dev_number__in=dev_numbers)
+    found = dict(archived.order_by('pk').values_list('pk', 'dev_number'))
+    counts = {'deviations': 0, 'actions': 0, 'conflicting': [],
+              'not_found': [] if dev_numbers is None else sorted(set(dev_numbers) - set(found.values()))}
+    ids = list(found)
+    for start in range(0, len(ids), batch_size):
+        with serialized_write(), transaction.atomic():
+            batch = ids[start:start + batch_size]
+            conflicting = set(Deviation.objects.filter(dev_number__in=[found[pk] for pk in batch])
+                              .values_list('dev_number', flat=True))
+            counts['conflicting'].extend(sorted(conflicting))
+            deviations, actions = _restore_batch([pk for pk in batch if found[pk] not in conflicting])
+        counts['deviations'] += deviations
+        counts['actions'] += actions
+        if progress is not None:
+            progress(min(start + batch_size, len(ids)), len(ids))
+    return counts
@@ -0,0 +1,56 @@
+# deviation_tracker_app/deviation_backend/deviations/authentication.py
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+USER_CACHE_PREFIX = 'jwt-user:'
+
+
+def user_cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def user_cache_key(user_id):
+    return f'{USER_CACHE_PREFIX}{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    user_cache().delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the resolved User in a short-TTL cache keyed by
+    user id, so the common request authenticates without touching the database.
+
+    Entries are dropped whenever the user is saved or deleted (see signals.py),
+    which covers deactivation and password changes in this process; the TTL
+    (settings.AUTH_USER_CACHE_TTL) bounds staleness for other worker processes.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        cache = user_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token) # Database lookup + the usual checks
+            cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+            return user
+
+        # Same checks as JWTAuthentication.get_user, against the cached copy.
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
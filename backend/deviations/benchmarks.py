@@ -0,0 +1,274 @@
+# deviation_tracker_app/deviation_backend/deviations/benchmarks.py
+#
+# Endpoint benchmark suite used by `python manage.py benchmark_api`.
+# Every URL in deviations/urls.py is exercised through the Django test client,
+# plus the Excel importer and the action reorder path. Write requests run inside
+# a transaction that is rolled back, so the benchmark never changes the data.
+
+import contextlib
+import io
+import json
+import math
+import platform
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import URLPattern, reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import urls as deviation_urls
+from .analytics import list_files
+from .models import Deviation, Action, Job
+from .throttling import ScopedTokenBucketThrottle, buckets
+
+PERCENTILES = (50, 90, 95, 99)
+THROTTLE_BATCH = 1000 # Throttle checks per timed iteration, so its milliseconds read as microseconds per check
+
+# How each named route in deviations/urls.py is exercised: (method, body builder).
+# Bodies are built from the sample deviation/action picked for the run.
+ENDPOINT_REQUESTS = {
+    'deviation-list-create': [
+        ('GET', None),
+        ('GET', lambda ctx: {'my_deviations': 'true'}),
+        ('GET', lambda ctx: {'dev_from': 'DEV24-0001', 'dev_to': 'DEV24-0500'}),
+        ('POST', lambda ctx: {'dev_number': 'BENCH-0001', 'owner_plant': 'Arimex', 'sbu': 'LND'}),
+    ],
+    'deviation-bulk-upsert': [
+        ('POST', lambda ctx: [{'dev_number': f'BENCH-{n:04d}', 'owner_plant': 'Arimex',
+                               'actions': [{'action_description': 'Benchmark action', 'action_responsible': 'Bench'}]}
+                              for n in range(500)]),
+    ],
+    'deviation-detail-update-delete': [
+        ('GET', None),
+        ('GET', lambda ctx: {'actions_limit': 50}),
+        ('PATCH', lambda ctx: {'drawing_number': 'BENCH-DRAWING'}),
+    ],
+    'action-list-create': [
+        ('GET', None),
+        ('GET', lambda ctx: {'status': 'Done', 'limit': 100}),
+        ('POST', lambda ctx: {'action_description': 'Benchmark action', 'action_responsible': 'Bench'}),
+    ],
+    'action-detail-update-delete': [
+        ('GET', None),
+        ('PATCH', lambda ctx: {'status': 'In Progress'}),
+    ],
+    'reorder-actions': [
+        ('PATCH', lambda ctx: {'new_order': ctx['reversed_order']}),
+    ],
+    'similar-deviations': [
+        ('GET', None),
+        ('GET', lambda ctx: {'min_similarity': 0.3, 'limit': 100}),
+    ],
+    'attachment-preview': [
+        ('GET', None), # 404 unless the sample deviation has a rendered preview
+    ],
+    'next-dev-number': [
+        ('POST', lambda ctx: {'prefix': 'DEV'}),
+    ],
+    'bulk-action-status': [
+        ('POST', lambda ctx: {'status': 'Done', 'dev_number': ctx['deviation'].dev_number}),
+    ],
+    'user-list': [
+        ('GET', None),
+    ],
+    'current-user': [
+        ('GET', None),
+    ],
+    'job-list-create': [
+        ('GET', None),
+        ('POST', lambda ctx: {'kind': 'export_deviations'}),
+    ],
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(timings_ms, query_counts):
+    timings_ms = sorted(timings_ms)
+    summary = {'iterations': len(timings_ms)}
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(timings_ms, pct), 3)
+    summary['mean_ms'] = round(sum(timings_ms) / len(timings_ms), 3)
+    summary['max_ms'] = round(timings_ms[-1], 3)
+    summary['queries'] = sorted(query_counts)[len(query_counts) // 2]
+    summary['max_queries'] = max(query_counts)
+    return summary
+
+
+@contextlib.contextmanager
+def rolled_back():
+    """Runs the block in a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+class QueryCounter:
+    """execute_wrapper that only counts queries (no 9000-query cap like connection.queries)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, iterations, rollback=False):
+    timings, query_counts = [], []
+    for _ in range(iterations):
+        counter = QueryCounter()
+        with contextlib.ExitStack() as stack:
+            # Read-only requests run on the 'read' connection, so count queries on every alias.
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            with rolled_back() if rollback else contextlib.nullcontext():
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+        query_counts.append(counter.count)
+    return summarize(timings, query_counts)
+
+
+def pick_sample():
+    """The deviation with the most actions is the worst case for detail/reorder endpoints."""
+    deviation = (
+        Deviation.objects.annotate(action_count=Count('actions'))
+        .filter(action_count__gt=0)
+        .order_by('-action_count')
+        .first()
+    )
+    if deviation is None:
+        return None
+    actions = list(Action.objects.filter(deviation=deviation).order_by('order').values_list('id', 'order'))
+    orders = [order for _, order in actions]
+    return {
+        'deviation': deviation,
+        'action_id': actions[0][0],
+        'job_id': Job.objects.values_list('id', flat=True).first() or 0, # 0: measures the 404 path
+        'analytics_path': next((file['path'] for file in list_files()), 'deviations/none.parquet'),
+        'reversed_order': [{'id': action_id, 'order': order} for (action_id, _), order in zip(actions, reversed(orders))],
+    }
+
+
+def url_kwargs(pattern, ctx):
+    kwargs = {}
+    if 'dev_number' in pattern.pattern.converters:
+        kwargs['dev_number'] = ctx['deviation'].dev_number
+    if 'action_id' in pattern.pattern.converters:
+        kwargs['action_id'] = ctx['action_id']
+    if 'job_id' in pattern.pattern.converters:
+        kwargs['job_id'] = ctx['job_id']
+    if 'path' in pattern.pattern.converters:
+        kwargs['path'] = ctx['analytics_path']
+    return kwargs
+
+
+def benchmark_endpoints(client, ctx, iterations, only=None):
+    results = {}
+    seen = set()
+    for pattern in deviation_urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in seen:
+            continue
+        seen.add(pattern.name)
+        if only and pattern.name not in only:
+            continue
+        path = reverse(pattern.name, kwargs=url_kwargs(pattern, ctx))
+        for method, body in ENDPOINT_REQUESTS.get(pattern.name, [('GET', None)]):
+            data = body(ctx) if body else None
+            if method == 'GET':
+                func = lambda path=path, data=data: client.get(path, data)
+            else:
+                func = lambda path=path, data=data, method=method: getattr(client, method.lower())(
+                    path, json.dumps(data), content_type='application/json'
+                )
+            suffix = '?' + '&'.join(f'{k}={v}' for k, v in data.items()) if method == 'GET' and data else ''
+            key = f'{method} {pattern.name}{suffix}'
+            buckets.clear() # Every endpoint starts with full rate-limit buckets
+            results[key] = {'method': method, 'path': path + suffix, **measure(func, iterations, rollback=method != 'GET')}
+    return results
+
+
+def benchmark_import(iterations):
+    from .excel_data_manager import import_deviations_from_excel_to_db
+
+    def run_import():
+        with contextlib.redirect_stdout(io.StringIO()): # The importer prints its own summary
+            import_deviations_from_excel_to_db()
+
+    return {'importer': {'method': 'IMPORT', 'path': 'excel_data_manager', **measure(run_import, iterations, rollback=True)}}
+
+
+def benchmark_throttle(iterations, user):
+    throttle = ScopedTokenBucketThrottle()
+    request, view = SimpleNamespace(method='GET', user=user), SimpleNamespace()
+
+    def check_batch():
+        buckets.clear() # Stay under the read budget so every check takes the "allowed" path
+        for _ in range(THROTTLE_BATCH):
+            throttle.allow_request(request, view)
+
+    result = measure(check_batch, iterations)
+    return {'throttle-check': {'method': 'THROTTLE', 'path': f'{THROTTLE_BATCH} checks', 'us_per_check': result['p50_ms'], **result}}
+
+
+def run_benchmarks(iterations=20, import_iterations=1, include_import=True, only=None, username=None, host='localhost',
+                   include_throttle=True):
+    ctx = pick_sample()
+    if ctx is None:
+        raise ValueError('No deviation with actions found. Run `seed_load_data` first.')
+
+    user = User.objects.filter(username=username).first() if username else User.objects.order_by('id').first()
+    if user is None:
+        raise ValueError('No user found to authenticate the benchmark requests.')
+    # Authenticate like the frontend does, with a JWT access token on every request.
+    client = Client(HTTP_HOST=host, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    results = benchmark_endpoints(client, ctx, iterations, only=only)
+    if include_throttle:
+        results.update(benchmark_throttle(iterations, user))
+    if include_import:
+        results.update(benchmark_import(import_iterations))
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'deviations': Deviation.objects.count(),
+            'actions': Action.objects.count(),
+            'sample_deviation': ctx['deviation'].dev_number,
+            'sample_actions': len(ctx['reversed_order']),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold_pct=20.0):
+    """Returns (name, metric, before, after, change_pct) rows that regressed by more than threshold_pct."""
+    regressions = []
+    for name, after in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries'):
+            old, new = before.get(metric), after.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if change > threshold_pct:
+                regressions.append((name, metric, old, new, round(change, 1)))
+    return regressions
@@ -0,0 +1,105 @@
+# deviation_tracker_app/deviation_backend/deviations/bulk.py
+#
+# Set-based writes shared by the admin actions, the Excel import and the bulk API
+# endpoints (POST /api/actions/bulk_status, POST /api/deviations/bulk_upsert).
+# A few statements per batch instead of one save() per row; bulk statements bypass
+# the change log signals, so the change log is written here in bulk too.
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .changes import record_changes
+from .db import serialized_write
+from .models import Action, ChangeLogEntry, Deviation, parse_dev_number
+from .responsibles import Responsible, UserNameIndex, link_responsible_users
+from .similarity import schedule_index
+
+
+def set_actions_status(actions, new_status):
+    """
+    Moves every action in `actions` that is not already in `new_status` to it.
+    Returns [(action_id, deviation_id, new_version)] of the actions that changed.
+    """
+    with serialized_write(), transaction.atomic():
+        actions = Action.objects.filter(pk__in=actions.exclude(status=new_status).values('pk'))
+        changed = [(action_id, deviation_id, version + 1)
+                   for action_id, deviation_id, version in actions.values_list('id', 'deviation_id', 'version')]
+        if changed:
+            actions.update(status=new_status, version=F('version') + 1)
+            record_changes(ChangeLogEntry.ACTION, [(action_id, deviation_id) for action_id, deviation_id, _ in changed],
+                           ChangeLogEntry.UPDATE)
+    return changed
+
+
+def replace_actions(deviation_ids, actions):
+    """
+    Deletes the actions of `deviation_ids` and creates `actions` (unsaved Action
+    objects, with their `order` set) instead, logging both. Returns the new actions.
+    """
+    old_actions = list(Action.objects.filter(deviation_id__in=deviation_ids).values_list('id', 'deviation_id'))
+    Responsible.objects.filter(action_id__in=[action_id for action_id, _ in old_actions]).delete()
+    # No per-action delete signals: their change log entries are written in bulk below
+    Action.objects.filter(pk__in=[action_id for action_id, _ in old_actions])._raw_delete(Action.objects.db)
+    Action.objects.bulk_create(actions, batch_size=1000)
+    record_changes(ChangeLogEntry.ACTION, old_actions, ChangeLogEntry.DELETE)
+    record_changes(ChangeLogEntry.ACTION, [(action.pk, action.deviation_id) for action in actions], ChangeLogEntry.CREATE)
+    return actions
+
+
+def upsert_deviations(items, name_index=None):
+    """
+    Creates or updates deviations keyed on dev_number, from validated items (see
+    DeviationUpsertSerializer): only the fields an item has are written, `actions`
+    (if given) replace the deviation's actions and `version` makes the item apply
+    only if the deviation is still at that version. Rows are written with
+    INSERT ... ON CONFLICT (dev_number) DO UPDATE, one statement per set of fields
+    given. Returns one result per item:
+      {'dev_number', 'result': 'created' | 'updated' | 'conflict', 'id', 'version'}
+    """
+    with serialized_write(), transaction.atomic():
+        existing = {dev_number: (pk, version) for dev_number, pk, version in Deviation.objects.filter(
+            dev_number__in=[item['dev_number'] for item in items]).values_list('dev_number', 'id', 'version')}
+
+        results, groups, written = [], defaultdict(list), []
+        for item in items:
+            fields = {name: value for name, value in item.items() if name not in ('version', 'actions')}
+            current = existing.get(item['dev_number'])
+            expected = item.get('version')
+            if expected is not None and (current is None or current[1] != expected):
+                results.append({'dev_number': item['dev_number'], 'result': 'conflict',
+                                'current_version': current[1] if current else None})
+                continue
+            deviation = Deviation(**fields, version=current[1] + 1 if current else 1)
+            # bulk_create skips Deviation.save(), which fills these
+            deviation.dev_prefix, deviation.dev_year, deviation.dev_sequence = parse_dev_number(deviation.dev_number)
+            # One INSERT ... ON CONFLICT per set of fields: its DO UPDATE must only overwrite the fields given
+            groups[tuple(sorted(fields))].append(deviation)
+            results.append({'dev_number': deviation.dev_number, 'result': 'updated' if current else 'created'})
+            written.append((results[-1], deviation, item.get('actions')))
+
+        for field_names, deviations in groups.items():
+            # RETURNING sets the pk of inserted and updated rows alike
+            Deviation.objects.bulk_create(
+                deviations, update_conflicts=True, unique_fields=['dev_number'],
+                update_fields=[name for name in field_names if name != 'dev_number'] + ['version'])
+        for result, deviation, _ in written:
+            result.update(id=deviation.pk, version=deviation.version)
+        record_changes(ChangeLogEntry.DEVIATION, [result['id'] for result, _, _ in written if result['result'] == 'created'],
+                       ChangeLogEntry.CREATE)
+        record_changes(ChangeLogEntry.DEVIATION, [result['id'] for result, _, _ in written if result['result'] == 'updated'],
+                       ChangeLogEntry.UPDATE)
+
+        replaced = [(result['id'], actions) for result, _, actions in written if actions is not None]
+        if replaced:
+            actions = replace_actions([pk for pk, _ in replaced], [
+                Action(deviation_id=pk, order=order, **action)
+                for pk, actions in replaced
+                for order, action in enumerate(actions, start=1)
+            ])
+            # Like the Excel import, link the responsible users named in the text
+            link_responsible_users(Action.objects.filter(pk__in=[action.pk for action in actions]),
+                                   index=name_index or UserNameIndex())
+        schedule_index(*[result['id'] for result, _, _ in written])
+    return results
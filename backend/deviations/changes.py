@@ -0,0 +1,85 @@
+# deviation_tracker_app/deviation_backend/deviations/changes.py
+#
+# Change feed. Every create/update/delete of a Deviation or Action (including
+# responsible-user changes) appends a ChangeLogEntry: single-object saves via the
+# receivers in signals.py, bulk paths (update(), bulk_create(), imports) by
+# calling record_changes() themselves. /api/changes?since=<cursor> then returns
+# only what changed after the cursor.
+
+from .events import publish_on_commit
+from .models import ChangeLogEntry, Deviation, Action
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+
+def record_change(model, object_id, operation, deviation_id=None):
+    entry = ChangeLogEntry.objects.create(
+        model=model, object_id=object_id, operation=operation, deviation_id=deviation_id
+    )
+    publish_on_commit([entry])
+    return entry
+
+
+def record_changes(model, pairs, operation):
+    """
+    Bulk-writes one entry per (object_id, deviation_id) pair. For deviations the
+    deviation_id is the object id itself, so plain ids are accepted too.
+    """
+    entries = []
+    for pair in pairs:
+        object_id, deviation_id = pair if isinstance(pair, tuple) else (pair, pair)
+        entries.append(ChangeLogEntry(model=model, object_id=object_id, operation=operation, deviation_id=deviation_id))
+    entries = ChangeLogEntry.objects.bulk_create(entries, batch_size=5000)
+    publish_on_commit(entries)
+    return entries
+
+
+def record_action_changes(action_ids, operation=ChangeLogEntry.UPDATE):
+    """Logs a change for each action id (looks up their deviations in one query)."""
+    pairs = list(Action.objects.filter(id__in=action_ids).values_list('id', 'deviation_id'))
+    return record_changes(ChangeLogEntry.ACTION, pairs, operation)
+
+
+def latest_cursor():
+    return ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def oldest_cursor():
+    return ChangeLogEntry.objects.order_by('id').values_list('id', flat=True).first()
+
+
+def collect_changes(since, limit=DEFAULT_PAGE_SIZE):
+    """
+    Reads at most `limit` log entries after `since` and collapses them to the last
+    operation per object. Returns (cursor, has_more, {model: {'upserted': ids, 'deleted': ids}}).
+    """
+    entries = list(
+        ChangeLogEntry.objects.filter(id__gt=since)
+        .order_by('id')
+        .values_list('id', 'model', 'object_id', 'operation')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    last_operation = {}
+    for _, model, object_id, operation in entries:
+        last_operation[(model, object_id)] = operation
+
+    changes = {ChangeLogEntry.DEVIATION: {'upserted': [], 'deleted': []},
+               ChangeLogEntry.ACTION: {'upserted': [], 'deleted': []}}
+    for (model, object_id), operation in last_operation.items():
+        bucket = 'deleted' if operation == ChangeLogEntry.DELETE else 'upserted'
+        changes[model][bucket].append(object_id)
+
+    cursor = entries[-1][0] if entries else since
+    return cursor, has_more, changes
+
+
+def changed_querysets(changes):
+    """Current rows for the upserted ids (ids that no longer exist are treated as deleted)."""
+    deviations = Deviation.objects.filter(id__in=changes[ChangeLogEntry.DEVIATION]['upserted']) \
+        .select_related('attachment_preview').prefetch_related('actions').order_by('id')
+    actions = Action.objects.filter(id__in=changes[ChangeLogEntry.ACTION]['upserted']) \
+        .prefetch_related('action_responsible_users').order_by('deviation_id', 'order', 'id')
+    return deviations, actions
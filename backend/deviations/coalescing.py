@@ -0,0 +1,116 @@
+# deviation_tracker_app/deviation_backend/deviations/coalescing.py
+#
+# Request coalescing ("single flight") for expensive GETs. At shift start many
+# users open the deviation list within seconds of each other; without this every
+# request runs the same query and serialization. With it, the first request for a
+# key computes the payload and the identical requests arriving while it runs wait
+# for it and share the result.
+#
+#   * The key is the normalized URL (scheme, host, path, sorted query parameters), the
+#     view's permission scope (coalesce_scope(): e.g. per user for
+#     `my_deviations=true`) and the change-log cursor. A request made after a
+#     write therefore never joins a computation that started before it.
+#   * Nothing is cached: a result is only handed to requests that arrived while it
+#     was being computed. Coalescing is per process.
+#   * A waiter gives up after SINGLE_FLIGHT_TIMEOUT seconds (or when the leader
+#     failed) and computes its own result.
+#   * Outcomes are counted in deviations_coalesced_requests_total{view,role} at
+#     /api/_metrics (role: leader, follower, fallback); followers / all is the
+#     coalescing ratio. A follower's wait shows as `coalesce` in Server-Timing.
+
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from rest_framework.response import Response
+
+from .changes import latest_cursor
+from .instrumentation import record, registry, view_label
+
+
+def wait_timeout():
+    return getattr(settings, 'SINGLE_FLIGHT_TIMEOUT', 10.0)
+
+
+class Flight:
+    """One computation in progress, and its outcome once `done` is set."""
+
+    __slots__ = ('done', 'result', 'failed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key, compute, timeout=None):
+        """
+        Returns (result, role): 'leader' if this call computed the result, 'follower' if
+        it got the result of a computation already in progress, 'fallback' if it waited
+        in vain (timeout or failed leader) and computed its own.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(timeout) and not flight.failed:
+                return flight.result, 'follower'
+            return compute(), 'fallback'
+
+        try:
+            flight.result = compute()
+        except BaseException:
+            flight.failed = True # Waiters compute their own; an exception is not shared across threads
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, 'leader'
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+# Module-level singleton shared by every coalesced view in this process.
+flights = SingleFlight()
+
+
+def coalescing_key(request, scope):
+    """Normalized URL + permission scope + change-log cursor."""
+    query = urlencode(sorted((name, value) for name, values in request.query_params.lists() for value in values))
+    return f'{scope}|{request.build_absolute_uri(request.path)}?{query}|{latest_cursor()}'
+
+
+class CoalescedListMixin:
+    """
+    For list views: identical concurrent GETs share one run of list() (query and
+    serialization); each request still renders its own response. Views override
+    coalesce_scope() to say who may share a result (default: only the same user).
+    """
+
+    def coalesce_scope(self, request):
+        return f'user:{request.user.pk}'
+
+    def list(self, request, *args, **kwargs):
+        key = coalescing_key(request, self.coalesce_scope(request))
+        start = time.perf_counter()
+        data, role = flights.run(key, lambda: super(CoalescedListMixin, self).list(request, *args, **kwargs).data,
+                                 wait_timeout())
+        if role == 'follower':
+            record('coalesce', (time.perf_counter() - start) * 1000)
+        registry.increment('coalesced_requests', (('view', view_label(request)), ('role', role)))
+        return Response(data)
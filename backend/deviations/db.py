@@ -0,0 +1,175 @@
+# deviation_tracker_app/deviation_backend/deviations/db.py (SQLite connection layer)
+#
+# Everything we need to run several users against a single SQLite file:
+#   * tuned PRAGMAs (WAL, busy timeout, ...) applied to every new connection,
+#   * one in-process, first-come-first-served write queue so writers never
+#     fight over the database lock,
+#   * a router that sends reads of read-only requests to a separate connection.
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# Alias of the read connection in settings.DATABASES (same file, query_only).
+READ_DATABASE_ALIAS = 'read'
+
+# Used when settings.SQLITE_PRAGMAS is not defined.
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',       # Readers no longer block on the writer (and vice versa)
+    'synchronous': 'NORMAL',     # Safe with WAL, avoids an fsync per commit
+    'busy_timeout': 20000,       # Milliseconds to wait for a lock before "database is locked"
+    'temp_store': 'MEMORY',
+    'cache_size': -64000,        # Negative = KiB, so ~64 MB page cache per connection
+    'mmap_size': 268435456,      # 256 MB memory-mapped I/O
+    'foreign_keys': 'ON',
+}
+
+# Set to True for the duration of a read-only (GET/HEAD/OPTIONS) request.
+_read_only_request = ContextVar('deviations_read_only_request', default=False)
+
+
+def get_sqlite_pragmas(alias=None):
+    """Returns the PRAGMAs to apply to a connection for the given database alias."""
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS))
+    if alias == READ_DATABASE_ALIAS:
+        pragmas['query_only'] = 'ON' # The read connection must never write
+    return pragmas
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    """Runs each PRAGMA on a DB-API cursor. Works for Django and plain sqlite3 cursors."""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """connection_created receiver: tune every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_sqlite_pragmas(cursor, get_sqlite_pragmas(connection.alias))
+
+
+class WriteQueue:
+    """
+    First-come-first-served, re-entrant lock for database writes.
+
+    SQLite allows one writer at a time. Instead of letting every thread race for
+    the file lock (and fail with "database is locked" once busy_timeout runs out),
+    writers take a ticket and run strictly in arrival order. The same thread may
+    re-enter, so an import running inside a request does not deadlock itself.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._now_serving = 0
+        self._owner = None
+        self._depth = 0
+        self._abandoned = set() # Tickets whose waiter timed out
+
+    def acquire(self, timeout=None):
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            if not self._condition.wait_for(lambda: self._now_serving == ticket, timeout):
+                # Give our place away; whoever waits behind us must not be stuck.
+                self._skip(ticket)
+                return False
+            self._owner = me
+            self._depth = 1
+            return True
+
+    def release(self):
+        with self._condition:
+            if self._owner != threading.get_ident():
+                raise RuntimeError('Cannot release a write slot held by another thread.')
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._advance()
+
+    def _advance(self):
+        self._now_serving += 1
+        while self._now_serving in self._abandoned:
+            self._abandoned.discard(self._now_serving)
+            self._now_serving += 1
+        self._condition.notify_all()
+
+    def _skip(self, ticket):
+        if self._now_serving == ticket:
+            self._advance()
+        else:
+            self._abandoned.add(ticket)
+
+    @property
+    def pending(self):
+        """Number of writers currently holding or waiting for the queue."""
+        with self._condition:
+            return self._next_ticket - self._now_serving - len(self._abandoned)
+
+    @contextmanager
+    def __call__(self, timeout=None):
+        if not self.acquire(timeout):
+            raise TimeoutError('Timed out waiting for the database write queue.')
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Module-level singleton shared by the middleware, the importer and commands.
+write_queue = WriteQueue()
+
+
+@contextmanager
+def serialized_write(timeout=None):
+    """Runs the block as the only writer in this process."""
+    with write_queue(timeout):
+        yield
+
+
+@contextmanager
+def read_only_request():
+    """Marks the current context as read-only so reads may use the read connection."""
+    token = _read_only_request.set(True)
+    try:
+        yield
+    finally:
+        _read_only_request.reset(token)
+
+
+class ReadWriteRouter:
+    """
+    Routes reads made during read-only requests to the 'read' connection.
+
+    Everything else (writes, reads inside a write request, reads while the
+    default connection is inside a transaction) stays on 'default' so code
+    always sees its own uncommitted changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _read_only_request.get():
+            return None
+        if READ_DATABASE_ALIAS not in settings.DATABASES:
+            return None
+        if connections['default'].in_atomic_block:
+            return None
+        return READ_DATABASE_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same SQLite file.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
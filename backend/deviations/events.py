@@ -0,0 +1,189 @@
+# deviation_tracker_app/deviation_backend/deviations/events.py
+#
+# Broker for pushing change events to connected clients (see sse.py).
+#
+# Events are the compact form of a ChangeLogEntry, plus the object's version when
+# the event goes out (null once deleted), so clients skip changes they already hold:
+#   {"cursor": 812, "model": "action", "id": 55, "deviation_id": 12, "op": "update", "version": 4}
+#
+# Two backends, picked with settings.EVENTS_BACKEND:
+#   * InProcessBackend: entries are handed to subscribers right after the
+#     transaction commits. Zero latency, but only reaches clients connected to
+#     the same worker process.
+#   * ChangeLogBackend: every worker tails the ChangeLogEntry table (shared by all
+#     workers through the SQLite file) and fans new rows out to its own
+#     subscribers, so it works with any number of workers.
+# Any class with publish(entries), subscribe(...) and unsubscribe(...) can be plugged in.
+
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+VERSION_LOOKUP_CHUNK_SIZE = 500
+
+
+def entry_to_event(entry):
+    return {
+        'cursor': entry.pk,
+        'model': entry.model,
+        'id': entry.object_id,
+        'deviation_id': entry.deviation_id,
+        'op': entry.operation,
+    }
+
+
+def with_versions(events):
+    """Sets each event's `version` to its object's current version, one query per model and chunk."""
+    from .models import Action, ChangeLogEntry, Deviation
+
+    for name, model in ((ChangeLogEntry.DEVIATION, Deviation), (ChangeLogEntry.ACTION, Action)):
+        ids = list({event['id'] for event in events if event['model'] == name and event['op'] != ChangeLogEntry.DELETE})
+        versions = {}
+        for start in range(0, len(ids), VERSION_LOOKUP_CHUNK_SIZE):
+            versions.update(model.objects.filter(pk__in=ids[start:start + VERSION_LOOKUP_CHUNK_SIZE])
+                            .values_list('pk', 'version'))
+        for event in events:
+            if event['model'] == name:
+                event['version'] = versions.get(event['id'])
+    return events
+
+
+class Subscription:
+    """One connected client. `deviation_ids=None` means every deviation."""
+
+    def __init__(self, loop, deviation_ids=None):
+        self.loop = loop
+        self.deviation_ids = set(deviation_ids) if deviation_ids is not None else None
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        return self.deviation_ids is None or event['deviation_id'] in self.deviation_ids
+
+    def offer(self, event):
+        """Called on the subscriber's event loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: tell the client to resync from /api/changes instead.
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'op': 'resync'})
+
+
+class InProcessBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, entries):
+        if not self.subscriber_count:
+            return # Nobody listening: skip the version lookup
+        self.fan_out(with_versions([entry_to_event(entry) for entry in entries]))
+
+    def fan_out(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            wanted = [event for event in events if subscription.wants(event)]
+            if not wanted:
+                continue
+            for event in wanted:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, event)
+                except RuntimeError:
+                    self.unsubscribe(subscription) # Loop closed, client is gone
+                    break
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+class ChangeLogBackend(InProcessBackend):
+    """Tails ChangeLogEntry from a background thread; publish() is a no-op because the row itself is the message."""
+
+    def __init__(self, poll_interval=None, batch_size=500):
+        super().__init__()
+        self.poll_interval = poll_interval or getattr(settings, 'EVENTS_POLL_INTERVAL', 0.5)
+        self.batch_size = batch_size
+        self._thread = None
+        self._started = threading.Lock()
+
+    def subscribe(self, subscription):
+        super().subscribe(subscription)
+        with self._started:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._tail, name='changelog-tail', daemon=True)
+                self._thread.start()
+
+    def publish(self, entries):
+        pass
+
+    def _tail(self):
+        from .changes import latest_cursor
+        from .models import ChangeLogEntry
+
+        cursor = latest_cursor()
+        while True:
+            time.sleep(self.poll_interval)
+            if not self.subscriber_count:
+                continue
+            try:
+                entries = list(ChangeLogEntry.objects.filter(id__gt=cursor).order_by('id')[:self.batch_size])
+            except DatabaseError:
+                logger.exception('Could not read the change log, retrying.')
+                continue
+            if entries:
+                cursor = entries[-1].pk
+                try:
+                    events = with_versions([entry_to_event(entry) for entry in entries])
+                except DatabaseError:
+                    logger.exception('Could not read the versions, sending the events without them.')
+                    events = [entry_to_event(entry) for entry in entries]
+                self.fan_out(events)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend_path = getattr(settings, 'EVENTS_BACKEND', 'deviations.events.InProcessBackend')
+                _broker = import_string(backend_path)()
+    return _broker
+
+
+def reset_broker():
+    global _broker
+    _broker = None
+
+
+def publish_on_commit(entries):
+    """Hands freshly written change log entries to the broker once they are committed."""
+    if entries:
+        transaction.on_commit(lambda: get_broker().publish(entries))
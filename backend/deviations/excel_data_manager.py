@@ -1,168 +1,213 @@
 # deviation_backend/deviations/excel_data_manager.py (CLEANED VERSION - NO DEBUG PRINTS)
+#
+# Excel import. Workbooks are parsed in parallel worker processes (workbooks.py),
+# conflicting copies of a deviation resolved, and the result written by this one
+# process in batches: a handful of bulk queries per IMPORT_BATCH_SIZE deviations,
+# all inside one transaction holding the write queue, so SQLite keeps a single writer
+# and API writers only wait for the writing, not for the parsing.
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
-import os
-from datetime import datetime
-from django.db import transaction
-from .models import Deviation, Action # Import your Django models
+from django.db import connection, transaction
+from .models import Deviation, Action, ChangeLogEntry, parse_dev_number # Import your Django models
+from .archive import archived_dev_numbers
+from .bulk import replace_actions
+from .changes import record_changes
+from .db import serialized_write
+from .responsibles import LinkReport, UserNameIndex, link_responsible_users
+from .similarity import schedule_index
+from .workbooks import expand_paths, parse_workbook, resolve_conflicts
 
 # Define the absolute path to your Excel file directly.
 # IMPORTANT: REPLACE THIS WITH THE EXACT ABSOLUTE PATH TO YOUR Deviation_Matrix.xlsx file.
 # Example: EXCEL_FILE_PATH = r"C:\Users\ersosa\Documents\Dev_tracker_app\Deviation_Matrix.xlsx"
 EXCEL_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Deviation_Matrix.xlsx')
 
-def import_deviations_from_excel_to_db():
+IMPORT_BATCH_SIZE = 500 # Deviations written per batch of bulk queries
+MAX_LOGGED_CONFLICTS = 20
+
+
+def parse_workbooks(paths, sheets=None, workers=None, progress=None):
     """
-    Reads deviation data from the Excel file and imports/updates it into the Django database.
-    This version handles deviations that span multiple rows for their actions,
-    and correctly filters out truly blank action rows.
+    Parses the workbooks, `workers` processes at a time (default: one per CPU, at most one
+    per workbook). Returns ([records of each workbook, in `paths` order], messages).
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    if workers == 1:
+        results = []
+        for done, path in enumerate(paths, start=1):
+            results.append(parse_workbook(path, sheets))
+            if progress is not None:
+                progress(done)
+    else:
+        # spawn, not fork: the parent may be a threaded server or job worker
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(parse_workbook, path, sheets) for path in paths]
+            for done, _ in enumerate(as_completed(futures), start=1):
+                if progress is not None:
+                    progress(done)
+            results = [future.result() for future in futures] # Path order, whichever finished first
+    return [records for records, _ in results], [message for _, messages in results for message in messages]
+
+
+def update_rows(objects, field_names):
+    """
+    Saves `field_names` of `objects` with one prepared UPDATE run for every row
+    (bulk_update builds a CASE expression per field and row, which is much slower).
+    """
+    model = type(objects[0])
+    fields = [model._meta.get_field(name) for name in field_names]
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+    sql = f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE {quote(model._meta.pk.column)} = %s'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+            for obj in objects
+        ])
+
+
+def write_deviations(records, name_index=None):
+    """
+    Creates or updates the deviations of `records`, replaces their actions and links the
+    new actions to the users named in them, with bulk queries. Bulk writes bypass the
+    signals, so the change log, versions and the similarity index are kept up to date
+    here. Returns (created, updated, actions created, LinkReport).
+    """
+    existing = Deviation.objects.in_bulk([record['dev_number'] for record in records], field_name='dev_number')
+    created, updated, update_fields = [], [], set()
+    for record in records:
+        deviation = existing.get(record['dev_number'])
+        if deviation is None:
+            deviation = Deviation(**record['fields'])
+            # bulk_create skips Deviation.save(), which fills these
+            deviation.dev_prefix, deviation.dev_year, deviation.dev_sequence = parse_dev_number(deviation.dev_number)
+            created.append(deviation)
+        else:
+            # Only the columns present in the workbook are overwritten
+            for field, value in record['fields'].items():
+                setattr(deviation, field, value)
+            deviation.version += 1
+            update_fields.update(record['fields'])
+            updated.append(deviation)
+    Deviation.objects.bulk_create(created, batch_size=1000)
+    if updated:
+        update_rows(updated, sorted(update_fields - {'dev_number'}) + ['version'])
+
+    record_changes(ChangeLogEntry.DEVIATION, [deviation.pk for deviation in created], ChangeLogEntry.CREATE)
+    record_changes(ChangeLogEntry.DEVIATION, [deviation.pk for deviation in updated], ChangeLogEntry.UPDATE)
+
+    # Replace the existing actions of these deviations
+    by_number = {deviation.dev_number: deviation.pk for deviation in created + updated}
+    actions = replace_actions([deviation.pk for deviation in updated], [
+        Action(deviation_id=by_number[record['dev_number']], action_description=description,
+               action_responsible=responsible, action_expiration_date=expiration, reminder_sent=False, order=order)
+        for record in records
+        for order, (description, responsible, expiration) in enumerate(record['actions'], start=1)
+    ])
+    # Only this batch's new actions, not every unlinked action in the table
+    link_report = link_responsible_users(Action.objects.filter(pk__in=[action.pk for action in actions]),
+                                         index=name_index or UserNameIndex())
+    schedule_index(*by_number.values())
+    return len(created), len(updated), len(actions), link_report
+
+
+def import_workbooks(paths, sheets=None, workers=None, batch_size=IMPORT_BATCH_SIZE, log=print, progress=None):
+    """
+    Imports deviations and their actions from workbooks (files or directories of them).
+    `sheets`: sheet names to read from each workbook, '*' for all, None for the first one.
+    A dev_number found in several workbooks or sheets is taken from one copy only
+    (see workbooks.resolve_conflicts); its actions replace the existing ones.
+    Deviations that are archived (see archive.py) are skipped.
+
+    `log` receives the messages (print by default), `progress(done, total)` is called
+    after each workbook parsed and each batch written. Returns the row counts, or None
+    if the import failed.
     """
-    if not os.path.exists(EXCEL_FILE_PATH):
-        print(f"Error: Excel file not found at: {EXCEL_FILE_PATH}")
-        return
-
     try:
-        df = pd.read_excel(EXCEL_FILE_PATH)
-        df.columns = df.columns.str.strip() # Clean column names (remove leading/trailing spaces)
-
-        # --- CRITICAL: Adjust this column mapping ---
-        # Map your EXACT Excel column headers (keys) to your Django Model field names (values)
-        # Ensure these match the columns in your deviation_matrix.xlsx
-        column_mapping = {
-            'Primary Column': 'primary_column',
-            'Year': 'year',
-            'DEV NUMBER': 'dev_number', # Match your Excel header exactly!
-            'Created By': 'created_by',
-            'Owner Plant': 'owner_plant',
-            'Affected Plant': 'affected_plant',
-            'SBU': 'sbu',
-            'Release Date': 'release_date',
-            'Effectivity Date': 'effectivity_date',
-            'Expiration Date': 'expiration_date',
-            'Drawing Number': 'drawing_number',
-            'Back to Back Deviation': 'back_to_back_deviation',
-            'Defect Category': 'defect_category',
-            'Assembly Defect Type': 'assembly_defect_type',
-            'Molding Defect Type': 'molding_defect_type',
-            'Actions': 'action_description_excel',
-            'Action Responsible': 'action_responsible_excel', # CONFIRMED: This is the correct column name for Action Responsible
-            'Action Expiration Date': 'action_expiration_date_excel',
+        paths = expand_paths(paths)
+        if not paths:
+            log("Error: No Excel workbooks to import.")
+            return
+        for path in paths:
+            if not os.path.exists(path):
+                log(f"Error: Excel file not found at: {path}")
+                return
+
+        start = time.perf_counter()
+        total = len(paths) # Grows by the number of deviations once they are known
+        record_lists, messages = parse_workbooks(
+            paths, sheets, workers, progress=None if progress is None else lambda done: progress(done, total + 1))
+        for message in messages:
+            log(message)
+        records, conflicts = resolve_conflicts(record_lists)
+        parse_seconds = time.perf_counter() - start
+        log(f"Parsed {len(paths)} workbook(s), {len(records)} deviations in {parse_seconds:.2f}s.")
+        for dev_number, winner, others in conflicts[:MAX_LOGGED_CONFLICTS]:
+            log(f"Conflict: {dev_number} taken from {winner} (also in {', '.join(others)}).")
+        if len(conflicts) > MAX_LOGGED_CONFLICTS:
+            log(f"... and {len(conflicts) - MAX_LOGGED_CONFLICTS} more conflicts.")
+        # A workbook still listing archived deviations must not create them again in the hot tables
+        archived = archived_dev_numbers(record['dev_number'] for record in records)
+        if archived:
+            records = [record for record in records if record['dev_number'] not in archived]
+            log(f"Skipped {len(archived)} archived deviation(s) "
+                f"(`python manage.py restore_deviations` brings them back first).")
+
+        total = len(paths) + len(records)
+        start = time.perf_counter()
+        # Take the write queue first so API writers wait their turn instead of hitting "database is locked"
+        with serialized_write(), transaction.atomic(): # Use a database transaction for atomic import
+            imported_deviations_count = updated_deviations_count = imported_actions_count = 0
+            # The imported actions are linked to users from their "Action Responsible" text as they are written
+            name_index, link_report = UserNameIndex(), LinkReport()
+            for done in range(0, len(records), batch_size):
+                created, updated, actions, batch_report = write_deviations(records[done:done + batch_size], name_index)
+                imported_deviations_count += created
+                updated_deviations_count += updated
+                imported_actions_count += actions
+                link_report.add(batch_report)
+                if progress is not None:
+                    progress(len(paths) + min(done + batch_size, len(records)), total)
+        write_seconds = time.perf_counter() - start
+
+        log(f"\n--- Excel Import Summary ---")
+        log(f"Deviations: Imported {imported_deviations_count} new, updated {updated_deviations_count} existing.")
+        log(f"Actions: Imported {imported_actions_count} new (existing actions were replaced for deviations).")
+        log(f"Responsibles: Linked {link_report.actions_linked} actions to users, "
+            f"{len(link_report.ambiguous)} ambiguous and {len(link_report.unmatched)} unknown names "
+            f"(see `python manage.py link_responsible_users --dry-run`).")
+        log(f"Time: parsing {parse_seconds:.2f}s, writing {write_seconds:.2f}s.")
+        log("Please verify data in your database via the Django Admin or API after restarting the server.")
+
+        return {
+            'deviations_created': imported_deviations_count,
+            'deviations_updated': updated_deviations_count,
+            'actions_imported': imported_actions_count,
+            'actions_linked_to_users': link_report.actions_linked,
+            'workbooks': len(paths),
+            'conflicts': len(conflicts),
         }
 
-        # Filter model fields to update only those present in your Deviation model
-        model_deviation_fields = [f.name for f in Deviation._meta.get_fields() if f.name != 'id']
-
-        # Rename columns in DataFrame to match our mapping, if they exist
-        df = df.rename(columns=column_mapping)
-
-        # Apply forward fill (ffill) to propagate values downwards for logical deviation records
-        deviation_detail_cols = [col for col in model_deviation_fields if col in df.columns]
-        df[deviation_detail_cols] = df[deviation_detail_cols].ffill()
-
-        df.dropna(subset=['dev_number'], inplace=True) # Drop rows where 'dev_number' is still empty
-
-
-        with transaction.atomic(): # Use a database transaction for atomic import
-            imported_deviations_count = 0
-            updated_deviations_count = 0
-            imported_actions_count = 0
-
-            grouped_deviations = df.groupby('dev_number')
-
-            for dev_number, dev_rows in grouped_deviations:
-                first_row = dev_rows.iloc[0] # Get the first row for main deviation details
-
-                deviation_data_for_db = {}
-                for model_field_name in model_deviation_fields:
-                    if model_field_name in first_row and pd.notna(first_row.get(model_field_name)):
-                        value = first_row[model_field_name]
-                        if 'date' in model_field_name:
-                            # MODIFIED DATE HANDLING FOR DEVIATION FIELDS
-                            if isinstance(value, (datetime, pd.Timestamp)):
-                                parsed_date = value
-                            else:
-                                parsed_date = pd.to_datetime(value, errors='coerce') # 'coerce' invalid dates to NaT
-
-                            if pd.isna(parsed_date): # Check if parsing failed
-                                deviation_data_for_db[model_field_name] = None
-                            else:
-                                deviation_data_for_db[model_field_name] = parsed_date.date() # Convert to date object
-                        elif model_field_name == 'back_to_back_deviation':
-                            deviation_data_for_db[model_field_name] = str(value).strip().lower() == 'true'
-                        else:
-                            deviation_data_for_db[model_field_name] = value
-
-                deviation, created = Deviation.objects.update_or_create(
-                    dev_number=dev_number,
-                    defaults=deviation_data_for_db
-                )
-                if created:
-                    imported_deviations_count += 1
-                else:
-                    updated_deviations_count += 1
-
-                # Clear existing actions for this deviation before importing new ones
-                Action.objects.filter(deviation=deviation).delete()
-
-                # Iterate through ALL rows for this deviation to find actions
-                for _, action_row in dev_rows.iterrows():
-                    # Get raw values from pandas. These might be NaN/NaT for empty cells.
-                    raw_action_description = action_row.get('action_description_excel')
-                    raw_action_responsible = action_row.get('action_responsible_excel')
-                    raw_action_expiration_date = action_row.get('action_expiration_date_excel')
-
-                    # Convert raw values to strings for a consistent check
-                    action_description_str = str(raw_action_description).strip()
-                    action_responsible_str = str(raw_action_responsible).strip()
-                    action_expiration_date_str = str(raw_action_expiration_date).strip()
-
-                    # --- CRITICAL MODIFIED CONDITION: Only create action if fields are truly populated ---
-                    # Check if description and responsible are NOT pandas NaN and NOT the string 'nan' (from empty cells)
-                    has_valid_description = pd.notna(raw_action_description) and action_description_str != 'nan' and action_description_str != ''
-                    has_valid_responsible = pd.notna(raw_action_responsible) and action_responsible_str != 'nan' and action_responsible_str != ''
-
-                    if has_valid_description and has_valid_responsible:
-                        action_expiration_date_obj = None
-                        try:
-                            if pd.notna(raw_action_expiration_date): # Only try to parse if not already NaN
-                                if isinstance(raw_action_expiration_date, (datetime, pd.Timestamp)):
-                                    parsed_date = raw_action_expiration_date
-                                else:
-                                    parsed_date = pd.to_datetime(action_expiration_date_str, errors='coerce') # 'coerce' invalid dates to NaT
-
-                                if pd.isna(parsed_date): # Check if parsing failed (it's NaT)
-                                    action_expiration_date_obj = None
-                                else:
-                                    action_expiration_date_obj = parsed_date.date() # Convert to date object
-                            else: # raw_action_expiration_date was already NaN or blank
-                                action_expiration_date_obj = None
-
-                        except Exception as date_err:
-                            action_expiration_date_obj = None
-
-                        # Create the Action record in the database
-                        Action.objects.create(
-                            deviation=deviation,
-                            action_description=action_description_str,
-                            action_responsible=action_responsible_str,
-                            action_expiration_date=action_expiration_date_obj,
-                            reminder_sent=False
-                        )
-                        imported_actions_count += 1
-                    # else: (Removed debugging else block)
-
-            print(f"\n--- Excel Import Summary ---")
-            print(f"Deviations: Imported {imported_deviations_count} new, updated {updated_deviations_count} existing.")
-            print(f"Actions: Imported {imported_actions_count} new (existing actions were replaced for deviations).")
-            print("Please verify data in your database via the Django Admin or API after restarting the server.")
-
     except pd.errors.EmptyDataError:
-        print(f"Error: Excel file '{EXCEL_FILE_PATH}' is empty or has no data rows.")
-    except FileNotFoundError:
-        print(f"Error: Excel file not found at: {EXCEL_FILE_PATH}")
+        log(f"Error: Excel file is empty or has no data rows.")
+    except FileNotFoundError as e:
+        log(f"Error: {e}")
     except Exception as e:
-        print(f"!!! AN UNEXPECTED ERROR OCCURRED DURING EXCEL IMPORT !!!")
-        print(f"Error Type: {type(e).__name__}")
-        print(f"Error Details: {e}")
-        print("\nCommon issues: Incorrect Excel column names in 'column_mapping', or unexpected data formats.")
-        print("Please double-check your Excel headers (spelling, spacing, capitalization) against the 'column_mapping' keys.")
\ No newline at end of file
+        log(f"!!! AN UNEXPECTED ERROR OCCURRED DURING EXCEL IMPORT !!!")
+        log(f"Error Type: {type(e).__name__}")
+        log(f"Error Details: {e}")
+        log("\nCommon issues: Incorrect Excel column names (see COLUMN_MAPPING in workbooks.py), or unexpected data formats.")
+
+
+def import_deviations_from_excel_to_db(excel_file_path=EXCEL_FILE_PATH, log=print, progress=None):
+    """
+    Reads deviation data from the Excel file and imports/updates it into the Django database.
+    Deviations span multiple rows for their actions; truly blank action rows are skipped.
+    Same arguments and return value as import_workbooks().
+    """
+    return import_workbooks([excel_file_path], log=log, progress=progress)
@@ -0,0 +1,211 @@
+# deviation_tracker_app/deviation_backend/deviations/instrumentation.py
+#
+# Per-request timing: SQL (count + time), serializer time and render time.
+# deviations.middleware.RequestInstrumentationMiddleware turns them into a Server-Timing header, a
+# structured log line and per-view latency histograms served at /api/_metrics.
+# Everything is in-process and lock-light so it can stay on in production.
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+# Latency buckets in seconds (Prometheus "le" labels).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_metrics = ContextVar('deviations_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters collected while one request is being handled."""
+
+    __slots__ = ('queries', 'sql_ms', 'serializer_sql_ms', 'phases', '_active_phase')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.serializer_sql_ms = 0.0
+        self.phases = {} # e.g. {'serializer': 12.5, 'render': 3.1, 'queue': 0.2}
+        self._active_phase = None
+
+    def add(self, phase, ms):
+        self.phases[phase] = self.phases.get(phase, 0.0) + ms
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed as a database execute_wrapper for the duration of the request.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.queries += 1
+            self.sql_ms += elapsed
+            if self._active_phase == 'serializer':
+                self.serializer_sql_ms += elapsed
+
+
+def current_metrics():
+    return _current_metrics.get()
+
+
+def start_request(metrics):
+    return _current_metrics.set(metrics)
+
+
+def end_request(token):
+    _current_metrics.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Adds the time spent in the block to `phase` of the current request (no-op outside requests)."""
+    metrics = _current_metrics.get()
+    if metrics is None or metrics._active_phase is not None:
+        # Outside a request, or nested inside another timed phase (e.g. a nested serializer).
+        yield
+        return
+    metrics._active_phase = phase
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, (time.perf_counter() - start) * 1000)
+        metrics._active_phase = None
+
+
+def record(phase, ms):
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add(phase, ms)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, the same shape Prometheus expects."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Process-wide aggregates keyed by (view, method, status class)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._latency = {}
+        self._sql_seconds = {}
+        self._queries = {}
+        self._serializer_seconds = {}
+        self._render_seconds = {}
+        self._counters = {} # Free-form counters other modules can bump (see increment())
+
+    def observe(self, view, method, status, duration_s, metrics):
+        key = (view, method, f'{status // 100}xx')
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(duration_s)
+            self._sql_seconds[key] = self._sql_seconds.get(key, 0.0) + metrics.sql_ms / 1000
+            self._queries[key] = self._queries.get(key, 0) + metrics.queries
+            self._serializer_seconds[key] = self._serializer_seconds.get(key, 0.0) + metrics.phases.get('serializer', 0.0) / 1000
+            self._render_seconds[key] = self._render_seconds.get(key, 0.0) + metrics.phases.get('render', 0.0) / 1000
+
+    def increment(self, name, labels=(), amount=1):
+        """Bumps a counter exported as deviations_<name>_total{labels}."""
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render_prometheus(self):
+        with self._lock:
+            latency = {key: (list(h.counts), h.sum, h.count) for key, h in self._latency.items()}
+            totals = [
+                ('deviations_request_sql_seconds_total', 'Time spent in SQL.', dict(self._sql_seconds)),
+                ('deviations_request_queries_total', 'Number of SQL queries.', dict(self._queries)),
+                ('deviations_request_serializer_seconds_total', 'Time spent in DRF serializers.', dict(self._serializer_seconds)),
+                ('deviations_request_render_seconds_total', 'Time spent rendering responses.', dict(self._render_seconds)),
+            ]
+            counters = dict(self._counters)
+
+        lines = [
+            '# HELP deviations_request_duration_seconds Request latency per view.',
+            '# TYPE deviations_request_duration_seconds histogram',
+        ]
+        for (view, method, status), (counts, total, count) in sorted(latency.items()):
+            labels = f'view="{view}",method="{method}",status="{status}"'
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'deviations_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'deviations_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'deviations_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'deviations_request_duration_seconds_count{{{labels}}} {count}')
+
+        for name, help_text, values in totals:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (view, method, status), value in sorted(values.items()):
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{name}{{view="{view}",method="{method}",status="{status}"}} {value}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE deviations_{name}_total counter')
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name != name:
+                    continue
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'deviations_{name}_total{{{label_text}}} {value}' if label_text else f'deviations_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def server_timing_header(metrics, total_ms):
+    parts = [f'db;dur={metrics.sql_ms:.1f};desc="{metrics.queries} queries"']
+    if 'serializer' in metrics.phases:
+        parts.append(f'serializer;dur={metrics.phases["serializer"]:.1f}')
+        parts.append(f'serializer-db;dur={metrics.serializer_sql_ms:.1f}')
+    for phase, ms in metrics.phases.items():
+        if phase != 'serializer':
+            parts.append(f'{phase};dur={ms:.1f}')
+    parts.append(f'total;dur={total_ms:.1f}')
+    return ', '.join(parts)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched' # Keep 404 spam from creating one time series per URL
+    return match.view_name or match.func.__name__
+
+
+@contextmanager
+def instrument_connections(metrics):
+    wrapped = []
+    try:
+        for alias in connections:
+            conn = connections[alias]
+            conn.execute_wrappers.append(metrics)
+            wrapped.append(conn)
+        yield
+    finally:
+        for conn in wrapped:
+            conn.execute_wrappers.remove(metrics)
@@ -0,0 +1,412 @@
+# deviation_tracker_app/deviation_backend/deviations/jobs.py
+#
+# Background jobs: imports, exports, linking and reminders run by a local pool of
+# worker threads (`python manage.py run_jobs`) instead of inside HTTP requests or
+# shell sessions. The Job table is the queue, so there is no broker to run.
+#
+#   * enqueue() adds a job; /api/jobs/ does the same for uploads from the UI.
+#   * Workers claim the oldest queued job inside an IMMEDIATE transaction, so
+#     several worker processes never pick the same job. Jobs of EXCLUSIVE_KINDS
+#     (everything that bulk-writes) run one at a time across all workers.
+#   * Live progress, counts and log go to the 'jobs' cache (shared by processes
+#     through the file system). A long import holds the SQLite write lock in one
+#     transaction, so the Job row itself is only updated before and after.
+
+import io
+import logging
+import threading
+import time
+import traceback
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.mail import send_mass_mail
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .analytics import snapshot_analytics
+from .archive import archive_deviations
+from .changes import record_changes
+from .db import serialized_write
+from .models import Action, ChangeLogEntry, Deviation, Job
+from .previews import render_previews
+from .responsibles import link_responsible_users, write_report
+from .similarity import index_deviations
+from .snapshots import snapshot_database
+
+logger = logging.getLogger(__name__)
+
+EXCLUSIVE_KINDS = [Job.IMPORT_DEVIATIONS, Job.IMPORT_USERS, Job.LINK_ATTACHMENTS, Job.LINK_RESPONSIBLES,
+                   Job.SEND_REMINDERS, Job.SNAPSHOT_ANALYTICS, # The analytics files must not be written twice at once
+                   Job.RENDER_PREVIEWS, # Two would render the same attachments
+                   Job.ARCHIVE_DEVIATIONS, Job.INDEX_SIMILARITY]
+STAFF_ONLY_KINDS = EXCLUSIVE_KINDS + [Job.SNAPSHOT_DB]
+MAX_LOG_CHARS = 200000
+FLUSH_INTERVAL = 0.5 # Seconds between live progress writes
+
+
+class JobError(Exception):
+    """Raised by a job handler to fail the job with a readable message."""
+
+
+def progress_cache():
+    return caches[getattr(settings, 'JOBS_CACHE_ALIAS', 'jobs')]
+
+
+def _live_key(job_id):
+    return f'job-live:{job_id}'
+
+
+def live_state(job_id):
+    """Progress/counts/log of a running job as last reported by its worker, or None."""
+    return progress_cache().get(_live_key(job_id))
+
+
+class JobOutput(io.TextIOBase):
+    """File-like object for call_command(stdout=...) that feeds the job log."""
+
+    def __init__(self, context):
+        self.context = context
+
+    def write(self, text):
+        for line in text.splitlines():
+            self.context.log(line)
+        return len(text)
+
+
+class JobContext:
+    """Handed to the job handlers to report progress, row counts and log lines."""
+
+    def __init__(self, job):
+        self.job = job
+        self.lines = []
+        self.output = JobOutput(self)
+        self._last_flush = 0.0
+
+    def log(self, message=''):
+        self.lines.extend(str(message).splitlines() or [''])
+        self.flush()
+
+    def progress(self, done, total):
+        self.job.progress = min(100, int(done * 100 / total)) if total else 100
+        self.flush()
+
+    def count(self, **counts):
+        self.job.counts.update(counts)
+        self.flush()
+
+    def log_text(self):
+        return '\n'.join(self.lines)[-MAX_LOG_CHARS:]
+
+    def flush(self, force=False):
+        if not force and time.monotonic() - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = time.monotonic()
+        self.heartbeat()
+
+    def heartbeat(self):
+        progress_cache().set(_live_key(self.job.pk), {
+            'progress': self.job.progress,
+            'counts': self.job.counts,
+            'log': self.log_text(),
+            'heartbeat': time.time(),
+        }, timeout=getattr(settings, 'JOB_STALE_SECONDS', 300) * 2)
+
+
+# --- Handlers: job -> run(job, context) ---
+
+def _input_path(job, default=None):
+    if job.input_file:
+        return job.input_file.path
+    if default is None:
+        raise JobError('This job needs an uploaded file.')
+    return default
+
+
+def run_import_deviations(job, context):
+    from .excel_data_manager import EXCEL_FILE_PATH, import_deviations_from_excel_to_db
+    counts = import_deviations_from_excel_to_db(_input_path(job, EXCEL_FILE_PATH), log=context.log,
+                                                progress=context.progress)
+    if counts is None:
+        raise JobError('Import failed, see the log.')
+    context.count(**counts)
+
+
+def run_import_users(job, context):
+    before = User.objects.count()
+    with serialized_write():
+        call_command('import_users', file=_input_path(job, 'master_user_list.csv'),
+                     stdout=context.output, stderr=context.output)
+    context.count(users_created=User.objects.count() - before)
+
+
+def run_link_attachments(job, context):
+    with serialized_write():
+        call_command('link_attachments', stdout=context.output, stderr=context.output)
+    context.count(deviations_with_attachment=Deviation.objects.exclude(attachment='').exclude(attachment=None).count())
+
+
+def run_link_responsibles(job, context):
+    with serialized_write(), transaction.atomic():
+        report = link_responsible_users()
+    write_report(context.output, no_style(), report)
+    context.count(actions_linked=report.actions_linked, links_created=report.links_created,
+                  ambiguous_names=len(report.ambiguous), unmatched_names=len(report.unmatched))
+
+
+# Export uses the import's column headers, so an export can be edited and re-imported.
+EXPORT_DEVIATION_COLUMNS = {
+    'primary_column': 'Primary Column', 'year': 'Year', 'dev_number': 'DEV NUMBER', 'created_by': 'Created By',
+    'owner_plant': 'Owner Plant', 'affected_plant': 'Affected Plant', 'sbu': 'SBU',
+    'release_date': 'Release Date', 'effectivity_date': 'Effectivity Date', 'expiration_date': 'Expiration Date',
+    'drawing_number': 'Drawing Number', 'back_to_back_deviation': 'Back to Back Deviation',
+    'defect_category': 'Defect Category', 'assembly_defect_type': 'Assembly Defect Type',
+    'molding_defect_type': 'Molding Defect Type',
+}
+
+
+def run_export_deviations(job, context):
+    import pandas as pd
+
+    responsibles = {}
+    through = Action.action_responsible_users.through.objects.order_by('user__last_name', 'user__first_name')
+    for action_id, first_name, last_name, username in through.values_list(
+            'action_id', 'user__first_name', 'user__last_name', 'user__username'):
+        responsibles.setdefault(action_id, []).append(f'{first_name} {last_name}'.strip() or username)
+
+    actions = {}
+    for action in Action.objects.order_by('deviation_id', 'order', 'id').values(
+            'id', 'deviation_id', 'action_description', 'action_responsible', 'action_expiration_date', 'status'):
+        actions.setdefault(action['deviation_id'], []).append(action)
+
+    deviations = Deviation.objects.order_by(*Deviation.NATURAL_ORDERING).values('id', *EXPORT_DEVIATION_COLUMNS)
+    total = deviations.count()
+    rows = []
+    for done, deviation in enumerate(deviations.iterator(chunk_size=2000), start=1):
+        base = {header: deviation[field] for field, header in EXPORT_DEVIATION_COLUMNS.items()}
+        for action in actions.get(deviation['id']) or [None]:
+            row = dict(base)
+            if action is not None:
+                row['Actions'] = action['action_description']
+                row['Action Responsible'] = ' / '.join(responsibles.get(action['id'], [])) or action['action_responsible']
+                row['Action Expiration Date'] = action['action_expiration_date']
+                row['Action Status'] = action['status']
+            rows.append(row)
+        if done % 1000 == 0:
+            context.progress(done, total + total // 10) # Leave room for writing the workbook
+
+    buffer = io.BytesIO()
+    columns = list(EXPORT_DEVIATION_COLUMNS.values()) + ['Actions', 'Action Responsible', 'Action Expiration Date',
+                                                          'Action Status']
+    pd.DataFrame(rows, columns=columns).to_excel(buffer, index=False)
+    job.result_file.save(f'deviations-{date.today():%Y%m%d}-job{job.pk}.xlsx', ContentFile(buffer.getvalue()),
+                         save=False)
+    context.count(deviations=total, rows=len(rows))
+
+
+def run_send_reminders(job, context):
+    """Emails each responsible user their open actions due within REMINDER_DAYS_AHEAD days, once per action."""
+    days_ahead = int(job.params.get('days_ahead', getattr(settings, 'REMINDER_DAYS_AHEAD', 3)))
+    due = Action.objects.filter(status__in=Action.OPEN_STATUSES, reminder_sent=False,
+                                action_expiration_date__lte=date.today() + timedelta(days=days_ahead))
+    through = Action.action_responsible_users.through.objects.filter(action__in=due).exclude(user__email='')
+    per_user = {}
+    reminded = {}
+    for email, dev_number, description, expiration, action_id, deviation_id in through.values_list(
+            'user__email', 'action__deviation__dev_number', 'action__action_description',
+            'action__action_expiration_date', 'action_id', 'action__deviation_id').order_by('user_id', 'action__action_expiration_date'):
+        per_user.setdefault(email, []).append(f'- {dev_number}: {description[:100]} (due {expiration:%Y-%m-%d})')
+        reminded[action_id] = deviation_id
+
+    messages = [
+        (f'{len(lines)} deviation action(s) due soon', 'These actions are due or overdue:\n\n' + '\n'.join(lines),
+         settings.DEFAULT_FROM_EMAIL, [email])
+        for email, lines in per_user.items()
+    ]
+    sent = send_mass_mail(messages, fail_silently=False) if messages else 0
+    with serialized_write(), transaction.atomic():
+        Action.objects.filter(id__in=list(reminded)).update(reminder_sent=True, version=F('version') + 1)
+        record_changes(ChangeLogEntry.ACTION, list(reminded.items()), ChangeLogEntry.UPDATE)
+    context.log(f'Sent {sent} reminder email(s) covering {len(reminded)} action(s).')
+    context.count(emails_sent=sent, actions_reminded=len(reminded))
+
+
+def run_snapshot_db(job, context):
+    manifest = snapshot_database(keep=job.params.get('keep'), progress=context.progress)
+    context.log(f'Snapshot {manifest["name"]} written in {manifest["seconds"]:.2f}s.')
+    for name in manifest['pruned']:
+        context.log(f'Pruned {name}')
+    context.count(bytes=manifest['bytes'], pruned=len(manifest['pruned']), **manifest['rows'])
+
+
+def run_snapshot_analytics(job, context):
+    summary = snapshot_analytics(full=bool(job.params.get('full')), progress=context.progress)
+    context.log(f'{summary["mode"].capitalize()} analytics snapshot up to change {summary["cursor"]}: '
+                f'{summary["deviations_written"]} deviation(s) written in {summary["seconds"]:.2f}s.')
+    context.count(deviations_written=summary['deviations_written'],
+                  **{f'{table}_rows': rows for table, rows in summary['rows'].items()})
+
+
+def run_attachment_previews(job, context):
+    counts = render_previews(force=bool(job.params.get('force')), progress=context.progress, log=context.log)
+    context.log(f'{counts["rendered"]} preview(s) rendered, {counts["reused"]} reused from identical files, '
+                f'{counts["missing"]} attachment(s) missing.')
+    context.count(**counts)
+
+
+def run_archive_deviations(job, context):
+    counts = archive_deviations(older_than_days=job.params.get('older_than_days'), progress=context.progress)
+    context.log(f'{counts["deviations"]} deviation(s) and {counts["actions"]} action(s) archived.')
+    context.count(**counts)
+
+
+def run_index_similarity(job, context):
+    # Queued by similarity.schedule_index() with the saved deviations; without ids (API) it checks them all
+    deviation_ids = job.params.get('deviation_ids') or list(Deviation.objects.order_by('pk').values_list('pk', flat=True))
+    written = index_deviations(deviation_ids)
+    context.log(f'{written} of {len(deviation_ids)} deviation(s) reindexed.')
+    context.count(deviations=len(deviation_ids), indexed=written)
+
+
+HANDLERS = {
+    Job.IMPORT_DEVIATIONS: run_import_deviations,
+    Job.IMPORT_USERS: run_import_users,
+    Job.LINK_ATTACHMENTS: run_link_attachments,
+    Job.LINK_RESPONSIBLES: run_link_responsibles,
+    Job.EXPORT_DEVIATIONS: run_export_deviations,
+    Job.SEND_REMINDERS: run_send_reminders,
+    Job.SNAPSHOT_DB: run_snapshot_db,
+    Job.SNAPSHOT_ANALYTICS: run_snapshot_analytics,
+    Job.RENDER_PREVIEWS: run_attachment_previews,
+    Job.ARCHIVE_DEVIATIONS: run_archive_deviations,
+    Job.INDEX_SIMILARITY: run_index_similarity,
+}
+
+
+# --- Queue ---
+
+_wakeup = threading.Event() # Lets a pool in this process pick up new jobs without waiting for the next poll
+
+
+def enqueue(kind, user=None, params=None, input_file=None):
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind "{kind}".')
+    job = Job(kind=kind, params=params or {}, created_by=user)
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    transaction.on_commit(_wakeup.set)
+    return job
+
+
+def claim_next_job():
+    """Marks the oldest runnable queued job as running and returns it (None if there is nothing to do)."""
+    with serialized_write(), transaction.atomic():
+        queued = Job.objects.filter(status=Job.QUEUED).order_by('id')
+        if Job.objects.filter(status=Job.RUNNING, kind__in=EXCLUSIVE_KINDS).exists():
+            queued = queued.exclude(kind__in=EXCLUSIVE_KINDS)
+        job = queued.first()
+        if job is None:
+            return None
+        now = timezone.now()
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=now, heartbeat_at=now)
+        job.status, job.started_at, job.heartbeat_at = Job.RUNNING, now, now
+    return job
+
+
+def run_job(job):
+    context = JobContext(job)
+    context.heartbeat()
+    stop_heartbeat = threading.Event()
+
+    def beat():
+        while not stop_heartbeat.wait(10):
+            context.heartbeat()
+    threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True).start()
+
+    try:
+        HANDLERS[job.kind](job, context)
+        job.status, job.progress = Job.SUCCEEDED, 100
+    except JobError as exc:
+        job.status, job.error = Job.FAILED, str(exc)
+    except Exception as exc:
+        job.status, job.error = Job.FAILED, f'{type(exc).__name__}: {exc}'
+        context.log(traceback.format_exc())
+        logger.exception('Job %s (%s) failed.', job.pk, job.kind)
+    finally:
+        stop_heartbeat.set()
+
+    job.log = context.log_text()
+    job.finished_at = job.heartbeat_at = timezone.now()
+    with serialized_write():
+        job.save(update_fields=['status', 'progress', 'counts', 'log', 'error', 'result_file',
+                                'finished_at', 'heartbeat_at'])
+    progress_cache().delete(_live_key(job.pk))
+    return job
+
+
+def fail_stale_jobs():
+    """Fails running jobs whose worker stopped sending heartbeats (e.g. it was killed)."""
+    cutoff = time.time() - getattr(settings, 'JOB_STALE_SECONDS', 300)
+    failed = 0
+    for job in Job.objects.filter(status=Job.RUNNING):
+        state = live_state(job.pk)
+        last_seen = state['heartbeat'] if state else job.heartbeat_at.timestamp() if job.heartbeat_at else 0
+        if last_seen < cutoff:
+            Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                status=Job.FAILED, error='The worker running this job stopped.', finished_at=timezone.now())
+            failed += 1
+    return failed
+
+
+class WorkerPool:
+    """Threads that claim and run queued jobs until stopped."""
+
+    def __init__(self, workers=None, poll_interval=None):
+        self.workers = workers or getattr(settings, 'JOB_WORKERS', 2)
+        self.poll_interval = poll_interval or getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        fail_stale_jobs()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_next_job()
+            except Exception:
+                logger.exception('Could not claim a job, retrying.')
+                job = None
+            if job is None:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+                continue
+            run_job(job)
+        close_old_connections()
+
+
+def run_pending():
+    """Runs queued jobs one after the other in this thread until the queue is empty."""
+    finished = []
+    while (job := claim_next_job()) is not None:
+        finished.append(run_job(job))
+    return finished
@@ -0,0 +1,35 @@
+# deviation_tracker_app/deviations/management/commands/archive_deviations.py
+#
+# Moves closed deviations (every action Done, expired more than ARCHIVE_AFTER_DAYS
+# ago) to the archive tables (see deviations/archive.py):
+#   python manage.py archive_deviations --dry-run
+#   python manage.py archive_deviations --older-than-days 730
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from deviations.archive import archive_after_days, archive_deviations
+
+
+class Command(BaseCommand):
+    help = 'Moves closed deviations that expired long ago, with their actions, to the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help=f'Archive deviations that expired more than this many days ago '
+                                 f'(default: ARCHIVE_AFTER_DAYS, {archive_after_days()}).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Deviations moved per transaction (default: ARCHIVE_BATCH_SIZE).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the deviations that would be archived.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = archive_deviations(older_than_days=options['older_than_days'], batch_size=options['batch_size'],
+                                    dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f'Would archive {counts["candidates"]} deviation(s).')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {counts["deviations"]} deviation(s) and {counts["actions"]} action(s) '
+            f'({time.perf_counter() - start:.2f}s).'))
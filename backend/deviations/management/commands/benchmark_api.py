@@ -0,0 +1,70 @@
+# deviation_tracker_app/deviations/management/commands/benchmark_api.py
+#
+#   python manage.py seed_load_data --deviations 50000
+#   python manage.py benchmark_api --output benchmarks/v1.json
+#   python manage.py benchmark_api --output benchmarks/v2.json --compare benchmarks/v1.json
+
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deviations.benchmarks import compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Records latency percentiles and SQL query counts for every API endpoint, the importer and reordering.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per endpoint.')
+        parser.add_argument('--import-iterations', type=int, default=1, help='Runs of the Excel importer.')
+        parser.add_argument('--skip-import', action='store_true', help='Do not benchmark the Excel importer.')
+        parser.add_argument('--skip-throttle', action='store_true', help='Do not benchmark the rate-limit check.')
+        parser.add_argument('--only', nargs='*', help='Only benchmark these URL names (e.g. deviation-list-create).')
+        parser.add_argument('--user', type=str, default=None, help='Username to authenticate as (default: first user).')
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON results to this file.')
+        parser.add_argument('--compare', type=str, default=None, help='Baseline JSON file to compare against.')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Regression threshold in percent.')
+
+    def handle(self, *args, **options):
+        try:
+            report = run_benchmarks(
+                iterations=options['iterations'],
+                import_iterations=options['import_iterations'],
+                include_import=not options['skip_import'],
+                include_throttle=not options['skip_throttle'],
+                only=options['only'],
+                username=options['user'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        meta = report['meta']
+        self.stdout.write(self.style.SUCCESS(
+            f"--- Benchmark ({meta['deviations']} deviations, {meta['actions']} actions, "
+            f"sample {meta['sample_deviation']} with {meta['sample_actions']} actions) ---"
+        ))
+        self.stdout.write(f"{'endpoint':<50} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<50} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['queries']:>8}"
+            )
+        if 'throttle-check' in report['results']:
+            self.stdout.write(f"Rate-limit check: {report['results']['throttle-check']['us_per_check']:.2f} µs per request")
+
+        if options['output']:
+            directory = os.path.dirname(options['output'])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare(report, baseline, options['threshold'])
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS(f"No regressions above {options['threshold']}% against {options['compare']}"))
+            for name, metric, old, new, change in regressions:
+                self.stdout.write(self.style.WARNING(f'REGRESSION {name} {metric}: {old} -> {new} (+{change}%)'))
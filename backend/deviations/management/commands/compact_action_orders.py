@@ -0,0 +1,120 @@
+# deviation_tracker_app/deviations/management/commands/compact_action_orders.py
+#
+# Renumbers Action.order to 1..n per deviation (keeping the current relative
+# order, ties broken by id), reports deviations whose orders had gaps or
+# duplicates, logs the renumbered actions in the change log and finishes with
+# ANALYZE/VACUUM. Set-based: one ROW_NUMBER() window query, two UPDATEs and one
+# INSERT ... SELECT, whatever the number of deviations.
+#
+#   python manage.py compact_action_orders            # Report, renumber, ANALYZE, VACUUM
+#   python manage.py compact_action_orders --dry-run  # Report only
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from deviations.db import serialized_write
+from deviations.models import Action, ChangeLogEntry
+
+RENUMBER_TABLE = 'action_order_renumber'
+
+
+def order_problems():
+    """Per-deviation check in one grouped query: (deviations with gaps, deviations with duplicate orders)."""
+    stats = (
+        Action.objects.order_by().values('deviation_id')
+        .annotate(n=Count('id'), distinct_orders=Count('order', distinct=True), low=Min('order'), high=Max('order'))
+    )
+    gaps, duplicates = [], []
+    for row in stats:
+        if row['distinct_orders'] != row['n']:
+            duplicates.append(row['deviation_id'])
+        elif row['low'] != 1 or row['high'] != row['n']:
+            gaps.append(row['deviation_id'])
+    return gaps, duplicates
+
+
+def renumber_action_orders():
+    """
+    Renumbers every deviation's actions to 1..n and appends a change log entry for
+    each action whose order changed (UPDATEs bypass the signals), bumping its
+    version so stale If-Match writes get a 409. Returns how many
+    actions were renumbered. Must run inside a transaction.
+    """
+    table = connection.ops.quote_name(Action._meta.db_table)
+    changelog = connection.ops.quote_name(ChangeLogEntry._meta.db_table)
+    order = connection.ops.quote_name('order')
+    version = connection.ops.quote_name('version')
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS temp.{RENUMBER_TABLE}')
+        cursor.execute(f'CREATE TEMP TABLE {RENUMBER_TABLE} (id INTEGER PRIMARY KEY, deviation_id INTEGER, new_order INTEGER)')
+        try:
+            cursor.execute(f"""
+                INSERT INTO {RENUMBER_TABLE} (id, deviation_id, new_order)
+                SELECT id, deviation_id, new_order FROM (
+                    SELECT id, deviation_id, {order} AS old_order,
+                           ROW_NUMBER() OVER (PARTITION BY deviation_id ORDER BY {order}, id) AS new_order
+                    FROM {table}
+                ) WHERE old_order <> new_order
+            """)
+            cursor.execute(f'SELECT COUNT(*) FROM {RENUMBER_TABLE}')
+            renumbered = cursor.fetchone()[0]
+            if not renumbered:
+                return 0
+
+            # (deviation, order) is unique, so park the changed rows above every
+            # existing order first, then drop them into place.
+            cursor.execute(f'SELECT MAX({order}) + 1 FROM {table}')
+            offset = cursor.fetchone()[0]
+            cursor.execute(f"""
+                UPDATE {table}
+                SET {order} = (SELECT new_order FROM {RENUMBER_TABLE} r WHERE r.id = {table}.id) + %s,
+                    {version} = {version} + 1
+                WHERE id IN (SELECT id FROM {RENUMBER_TABLE})
+            """, [offset])
+            cursor.execute(f'UPDATE {table} SET {order} = {order} - %s WHERE {order} >= %s', [offset, offset])
+
+            # INSERT ... SELECT rather than record_changes(): going through bulk_create
+            # costs seconds per hundred thousand rows. Nothing is published to the
+            # in-process broker, this runs outside the web workers anyway; the
+            # ChangeLogBackend and /api/changes pick the rows up from the table.
+            cursor.execute(f"""
+                INSERT INTO {changelog} (model, object_id, deviation_id, operation, created_at)
+                SELECT %s, id, deviation_id, %s, %s FROM {RENUMBER_TABLE} ORDER BY id
+            """, [ChangeLogEntry.ACTION, ChangeLogEntry.UPDATE,
+                  connection.ops.adapt_datetimefield_value(timezone.now())])
+        finally:
+            cursor.execute(f'DROP TABLE temp.{RENUMBER_TABLE}')
+    return renumbered
+
+
+class Command(BaseCommand):
+    help = 'Renumbers action orders to 1..n per deviation in one set-based pass, then runs ANALYZE and VACUUM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report gaps and duplicates.')
+        parser.add_argument('--skip-vacuum', action='store_true', help='Run ANALYZE but not VACUUM.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        gaps, duplicates = order_problems()
+        self.stdout.write(f'{len(gaps)} deviation(s) with gaps in their action orders, '
+                          f'{len(duplicates)} with duplicate orders.')
+        if duplicates:
+            self.stdout.write(f'  Duplicates in deviation ids: {", ".join(map(str, duplicates[:20]))}'
+                              f'{" ..." if len(duplicates) > 20 else ""}')
+        if options['dry_run']:
+            return
+
+        with serialized_write(), transaction.atomic():
+            renumbered = renumber_action_orders()
+        self.stdout.write(f'Renumbered {renumbered} action(s) in {time.perf_counter() - start:.2f}s.')
+
+        with serialized_write(), connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            if not options['skip_vacuum'] and connection.vendor == 'sqlite':
+                cursor.execute('VACUUM') # Not allowed inside a transaction, so outside the atomic block
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - start:.2f}s.'))
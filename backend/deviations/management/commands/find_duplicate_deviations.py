@@ -0,0 +1,53 @@
+# deviation_tracker_app/deviations/management/commands/find_duplicate_deviations.py
+#
+# Reports groups of near-duplicate deviations across the whole history, from the
+# LSH index in deviations/similarity.py (only deviations sharing a bucket are compared):
+#   python manage.py find_duplicate_deviations
+#   python manage.py find_duplicate_deviations --reindex --threshold 0.6 --csv duplicates.csv
+
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deviations.models import Deviation
+from deviations.similarity import duplicate_clusters, index_deviations, threshold
+
+
+class Command(BaseCommand):
+    help = 'Reports clusters of near-duplicate deviations (same drawing family, defect fields and action texts).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=None,
+                            help='Minimum estimated similarity of two deviations (default: SIMILARITY_THRESHOLD).')
+        parser.add_argument('--reindex', action='store_true',
+                            help='Index every deviation first (only changed ones are rewritten), e.g. after seed_load_data.')
+        parser.add_argument('--csv', default=None, help='Also write the clusters to this CSV file.')
+
+    def handle(self, *args, **options):
+        min_similarity = threshold() if options['threshold'] is None else options['threshold']
+        if not 0 < min_similarity <= 1:
+            raise CommandError('--threshold must be between 0 and 1.')
+
+        if options['reindex']:
+            start = time.perf_counter()
+            written = index_deviations(Deviation.objects.order_by('pk').values_list('pk', flat=True))
+            self.stdout.write(f'Indexed {written} deviation(s) in {time.perf_counter() - start:.2f}s.')
+
+        start = time.perf_counter()
+        clusters = duplicate_clusters(min_similarity)
+        numbers = dict(Deviation.objects.filter(pk__in=[pk for cluster in clusters for pk in cluster])
+                       .values_list('pk', 'dev_number'))
+        for number, cluster in enumerate(clusters, start=1):
+            self.stdout.write(f'{number:4d}. ' + ', '.join(numbers[pk] for pk in cluster if pk in numbers))
+
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['cluster', 'dev_number'])
+                for number, cluster in enumerate(clusters, start=1):
+                    writer.writerows([number, numbers[pk]] for pk in cluster if pk in numbers)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(clusters)} cluster(s) covering {sum(map(len, clusters))} deviations at similarity >= '
+            f'{min_similarity:.2f} ({time.perf_counter() - start:.2f}s).'))
@@ -1,13 +1,34 @@
+# deviation_tracker_app/deviations/management/commands/import_deviations.py
+#
+# Imports deviations and actions from the plants' copies of the deviation matrix
+# (see deviations/excel_data_manager.py). Workbooks are parsed in parallel, then
+# written by this process alone:
+#   python manage.py import_deviations                            # Deviation_Matrix.xlsx
+#   python manage.py import_deviations plants/ extra.xlsx --all-sheets --workers 8
+
 from django.core.management.base import BaseCommand
-from deviations.excel_data_manager import import_deviations_from_excel_to_db
+from deviations.excel_data_manager import EXCEL_FILE_PATH, IMPORT_BATCH_SIZE, import_workbooks
 
 class Command(BaseCommand):
-    help = 'Imports deviations and actions from Deviation_Matrix.xlsx file'
+    help = 'Imports deviations and actions from Excel workbooks (default: Deviation_Matrix.xlsx)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[EXCEL_FILE_PATH],
+                            help='Workbooks or directories of workbooks. Earlier ones win ties between copies.')
+        sheets = parser.add_mutually_exclusive_group()
+        sheets.add_argument('--sheet', action='append', dest='sheets', default=None,
+                            help='Sheet to read from each workbook (repeatable; default: the first sheet).')
+        sheets.add_argument('--all-sheets', action='store_const', const='*', dest='sheets',
+                            help='Read every sheet that has a "DEV NUMBER" column.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Parser processes (default: one per CPU, at most one per workbook).')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Deviations written per batch.')
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('Starting deviation import from Deviation_Matrix.xlsx...'))
-        try:
-            import_deviations_from_excel_to_db()
+        self.stdout.write(self.style.SUCCESS(f'Starting deviation import from {", ".join(options["paths"])}...'))
+        counts = import_workbooks(options['paths'], sheets=options['sheets'], workers=options['workers'],
+                                  batch_size=options['batch_size'], log=self.stdout.write)
+        if counts is None:
+            self.stdout.write(self.style.ERROR('Deviation import failed, nothing was changed.'))
+        else:
             self.stdout.write(self.style.SUCCESS('Deviation import completed successfully!'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error during deviation import: {e}'))
\ No newline at end of file
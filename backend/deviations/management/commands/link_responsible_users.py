@@ -0,0 +1,24 @@
+# deviation_tracker_app/deviations/management/commands/link_responsible_users.py
+#
+# Backfills Action.action_responsible_users from the free-text action_responsible
+# column (see deviations/responsibles.py). Only actions without linked users are
+# touched, so it is safe to run repeatedly, e.g. after adding missing users:
+#   python manage.py link_responsible_users --dry-run
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from deviations.db import serialized_write
+from deviations.responsibles import link_responsible_users, write_report
+
+
+class Command(BaseCommand):
+    help = 'Links actions to users by resolving the free-text "Action Responsible" names.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be linked.')
+
+    def handle(self, *args, **options):
+        with serialized_write(), transaction.atomic():
+            report = link_responsible_users(dry_run=options['dry_run'])
+        write_report(self.stdout, self.style, report, dry_run=options['dry_run'])
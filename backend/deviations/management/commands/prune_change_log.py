@@ -0,0 +1,27 @@
+# deviation_tracker_app/deviations/management/commands/prune_change_log.py
+#
+# Deletes change log entries (see deviations/changes.py) older than --days, so the
+# log behind /api/changes and the event stream does not grow forever. Sync clients
+# holding an older cursor get a 410 and reload:
+#   python manage.py prune_change_log --days 30
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from deviations.db import serialized_write
+from deviations.models import ChangeLogEntry
+
+
+class Command(BaseCommand):
+    help = 'Deletes change log entries older than --days. Clients with an older cursor get a 410 and reload.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Keep entries from the last N days.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        with serialized_write():
+            deleted, _ = ChangeLogEntry.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change log entries older than {options["days"]} days.'))
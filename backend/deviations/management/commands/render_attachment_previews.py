@@ -0,0 +1,28 @@
+# deviation_tracker_app/deviations/management/commands/render_attachment_previews.py
+#
+# Renders the first-page thumbnails and page counts of attachments that have none
+# yet (see deviations/previews.py), e.g. the ones linked before previews existed:
+#   python manage.py render_attachment_previews
+#   python manage.py render_attachment_previews --force   # Hash every attachment again
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from deviations.previews import render_previews
+
+
+class Command(BaseCommand):
+    help = 'Renders first-page previews and page counts of deviation attachments that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Redo every attachment, also the ones with a preview (identical files are still rendered once).')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = render_previews(force=options['force'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["deviations"]} attachment(s): {counts["rendered"]} rendered ({counts["failed"]} without thumbnail), '
+            f'{counts["reused"]} reused from identical files, {counts["missing"]} missing '
+            f'({time.perf_counter() - start:.2f}s).'))
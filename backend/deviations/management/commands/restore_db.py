@@ -0,0 +1,50 @@
+# deviation_tracker_app/deviations/management/commands/restore_db.py
+#
+# Restores a snapshot written by snapshot_db after checking its checksum, SQLite
+# integrity, row counts and migrations. Take a fresh snapshot first if the
+# current data might still be needed.
+#   python manage.py restore_db latest --verify-only
+#   python manage.py restore_db snapshot-20250101-020000-000000
+
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deviations.snapshots import SnapshotError, resolve_snapshot, restore_database, verify_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Verifies a database snapshot and restores it over the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', help='Snapshot name, file or path, or "latest".')
+        parser.add_argument('--dir', default=None, help='Snapshot directory (default: SNAPSHOT_DIR).')
+        parser.add_argument('--verify-only', action='store_true', help='Only verify the snapshot.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation.')
+
+    def handle(self, *args, **options):
+        try:
+            path = resolve_snapshot(options['snapshot'], options['dir'])
+            if options['verify_only']:
+                with tempfile.TemporaryDirectory() as workdir:
+                    _, manifest, pending = verify_snapshot(path, workdir)
+                self.stdout.write(self.style.SUCCESS(f'{path.name} is valid (rows: {manifest["rows"]}).'))
+                self._pending(pending)
+                return
+
+            if options['interactive']:
+                answer = input(f'This replaces ALL current data with {path.name}. Type "yes" to continue: ')
+                if answer != 'yes':
+                    self.stdout.write('Restore cancelled.')
+                    return
+            manifest, pending = restore_database(path)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Restored {path.name} (rows: {manifest["rows"]}).'))
+        self._pending(pending)
+
+    def _pending(self, pending):
+        if pending:
+            self.stdout.write(self.style.WARNING(
+                f'{len(pending)} migration(s) are newer than the snapshot; run `python manage.py migrate`.'))
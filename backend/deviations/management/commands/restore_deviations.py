@@ -0,0 +1,29 @@
+# deviation_tracker_app/deviations/management/commands/restore_deviations.py
+#
+# Moves archived deviations back to the hot tables (see deviations/archive.py),
+# e.g. to reopen one:
+#   python manage.py restore_deviations DEV21-0042 DEV21-0043
+#   python manage.py restore_deviations --all
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deviations.archive import restore_deviations
+
+
+class Command(BaseCommand):
+    help = 'Moves archived deviations, with their actions, back to the deviation tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dev_numbers', nargs='*', help='DEV numbers of the deviations to restore.')
+        parser.add_argument('--all', action='store_true', help='Restore every archived deviation.')
+
+    def handle(self, *args, **options):
+        if bool(options['dev_numbers']) == options['all']:
+            raise CommandError('Give either DEV numbers or --all.')
+        counts = restore_deviations(None if options['all'] else options['dev_numbers'])
+        for dev_number in counts['not_found']:
+            self.stderr.write(f'{dev_number} is not archived.')
+        for dev_number in counts['conflicting']:
+            self.stderr.write(f'{dev_number} was not restored: a deviation with this number exists.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Restored {counts["deviations"]} deviation(s) and {counts["actions"]} action(s).'))
@@ -0,0 +1,38 @@
+# deviation_tracker_app/deviations/management/commands/run_jobs.py
+#
+# Runs queued background jobs (see deviations/jobs.py) with a pool of worker threads:
+#   python manage.py run_jobs --workers 2
+#   python manage.py run_jobs --once   # Run what is queued, then exit (cron, tests)
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from deviations.jobs import WorkerPool, fail_stale_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (imports, exports, linking, reminders).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker threads (default: JOB_WORKERS).')
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs one by one, then exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            stale = fail_stale_jobs()
+            if stale:
+                self.stdout.write(self.style.WARNING(f'Failed {stale} stale running job(s).'))
+            for job in run_pending():
+                style = self.style.SUCCESS if job.status == job.SUCCEEDED else self.style.ERROR
+                self.stdout.write(style(f'Job #{job.pk} {job.kind}: {job.status}{f" ({job.error})" if job.error else ""}'))
+            return
+
+        pool = WorkerPool(workers=options['workers']).start()
+        self.stdout.write(self.style.SUCCESS(f'Running jobs with {pool.workers} worker(s). Ctrl+C to stop.'))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running jobs finish...')
+            pool.stop()
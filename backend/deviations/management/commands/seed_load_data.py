@@ -0,0 +1,187 @@
+# deviation_tracker_app/deviations/management/commands/seed_load_data.py
+#
+# Generates a synthetic, realistic-looking dataset for load testing, e.g.:
+#   python manage.py seed_load_data --deviations 50000 --max-actions 30 --users 300
+
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from deviations.changes import record_changes
+from deviations.db import serialized_write
+from deviations.models import Deviation, Action, ChangeLogEntry, format_dev_number
+
+OWNER_PLANTS = ['Arimex', 'Nogales', 'Lago', 'Tucson', 'Azusa', 'El Paso']
+AFFECTED_PLANTS = [
+    '005 LAM', '008 BUY', '013E EEX', '013S STL', '019 AZU', '020MX NMD',
+    '025 OTY', '026 ELG', '028 TUC', '041 NOG', '047 TUC', 'CHINA',
+]
+SBUS = ['ACC', 'AG', 'BUY', 'CNTL', 'COM', 'CP', 'CTR', 'GLF', 'LND', 'SMD/PMP']
+DEFECT_CATEGORIES = {
+    'Molding': ('molding_defect_type', ['Flash', 'Short Shot', 'Sink Marks', 'Warpage', 'Burn Marks', 'Color']),
+    'Assembly': ('assembly_defect_type', ['Missing Part', 'Wrong Part', 'Loose Fit', 'Leak', 'Damaged Thread']),
+    'Dimensional': (None, []),
+    'Cosmetic': (None, []),
+    'Material': (None, []),
+}
+ACTION_VERBS = ['Inspect', 'Sort', 'Rework', 'Update', 'Verify', 'Audit', 'Replace', 'Contain', 'Train operators on']
+ACTION_OBJECTS = [
+    'all WIP parts', 'finished goods in warehouse', 'mold cavity 4', 'the control plan', 'the PFMEA',
+    'incoming material lot', 'the work instruction', 'gauge calibration', 'supplier PPAP documents',
+]
+FIRST_NAMES = ['Luis', 'Jeffery', 'Marisol', 'Oscar', 'Jorge', 'Abdul', 'Roberto', 'Alonso', 'Xavier', 'Juan',
+               'Maria', 'Ana', 'Carlos', 'Sofia', 'Diego', 'Laura', 'Miguel', 'Elena', 'Pedro', 'Lucia']
+LAST_NAMES = ['Montoya', 'Cooper', 'Arvizu', 'Santillan', 'Rivero', 'Castillo', 'Guzman', 'Sanchez', 'Vela',
+              'Gonzalez', 'Lopez', 'Martinez', 'Hernandez', 'Ramirez', 'Torres', 'Flores', 'Reyes', 'Cruz']
+STATUS_WEIGHTS = [('Not Started', 3), ('In Progress', 3), ('Done', 4)]
+LOAD_USER_PREFIX = 'loaduser'
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generates synthetic deviations, actions and responsible users for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deviations', type=int, default=1000, help='Number of deviations to create.')
+        parser.add_argument('--min-actions', type=int, default=0, help='Minimum actions per deviation.')
+        parser.add_argument('--max-actions', type=int, default=30, help='Maximum actions per deviation.')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Number of synthetic users to draw responsibles from (created if missing).')
+        parser.add_argument('--start-year', type=int, default=2019, help='First year to spread deviations over.')
+        parser.add_argument('--end-year', type=int, default=date.today().year, help='Last year to spread deviations over.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Deviations written per transaction.')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible dataset.')
+
+    def handle(self, *args, **options):
+        if options['deviations'] < 0 or options['min_actions'] < 0:
+            raise CommandError('Counts must not be negative.')
+        if options['min_actions'] > options['max_actions']:
+            raise CommandError('--min-actions cannot be greater than --max-actions.')
+        if options['start_year'] > options['end_year']:
+            raise CommandError('--start-year cannot be after --end-year.')
+
+        rng = random.Random(options['seed'])
+        users = self._ensure_users(options['users'])
+        years = list(range(options['start_year'], options['end_year'] + 1))
+        next_sequence = self._next_sequences(years)
+
+        total = options['deviations']
+        batch_size = max(1, options['batch_size'])
+        created_deviations = created_actions = created_links = 0
+
+        for start in range(0, total, batch_size):
+            count = min(batch_size, total - start)
+            with serialized_write(), transaction.atomic():
+                deviations = Deviation.objects.bulk_create(
+                    [self._build_deviation(rng, years, next_sequence, users) for _ in range(count)]
+                )
+                actions = []
+                for deviation in deviations:
+                    actions.extend(self._build_actions(rng, deviation, options['min_actions'], options['max_actions']))
+                actions = Action.objects.bulk_create(actions, batch_size=5000)
+
+                through = Action.action_responsible_users.through
+                links = []
+                for action in actions:
+                    if not users:
+                        break
+                    # Mostly a single owner, sometimes a small team
+                    for user_id in rng.sample(users, k=min(len(users), rng.choice((1, 1, 1, 2, 3)))):
+                        links.append(through(action_id=action.pk, user_id=user_id))
+                through.objects.bulk_create(links, batch_size=5000)
+
+                # bulk_create skips the change log signals
+                record_changes(ChangeLogEntry.DEVIATION, [d.pk for d in deviations], ChangeLogEntry.CREATE)
+                record_changes(ChangeLogEntry.ACTION, [(a.pk, a.deviation_id) for a in actions], ChangeLogEntry.CREATE)
+
+            created_deviations += len(deviations)
+            created_actions += len(actions)
+            created_links += len(links)
+            self.stdout.write(f'  {created_deviations}/{total} deviations, {created_actions} actions...')
+
+        self.stdout.write(self.style.SUCCESS('--- Load Data Summary ---'))
+        self.stdout.write(self.style.SUCCESS(f'Deviations created: {created_deviations}'))
+        self.stdout.write(self.style.SUCCESS(f'Actions created: {created_actions}'))
+        self.stdout.write(self.style.SUCCESS(f'Responsible user links created: {created_links}'))
+
+    def _ensure_users(self, count):
+        """Returns the ids of `count` synthetic users, creating the missing ones in one query."""
+        existing = set(User.objects.filter(username__startswith=LOAD_USER_PREFIX).values_list('username', flat=True))
+        missing = []
+        for i in range(count):
+            username = f'{LOAD_USER_PREFIX}{i:05d}'
+            if username not in existing:
+                missing.append(User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name=FIRST_NAMES[i % len(FIRST_NAMES)],
+                    last_name=LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)],
+                    password='!', # Unusable password, these accounts cannot log in
+                ))
+        User.objects.bulk_create(missing, batch_size=1000)
+        usernames = [f'{LOAD_USER_PREFIX}{i:05d}' for i in range(count)]
+        return list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+    def _next_sequences(self, years):
+        """Next free DEV sequence number per year, so we never collide with real deviations."""
+        highest = dict(
+            Deviation.objects.filter(dev_prefix='DEV', dev_year__in=[year % 100 for year in years])
+            .order_by().values_list('dev_year').annotate(Max('dev_sequence'))
+        )
+        return {year: (highest.get(year % 100) or 0) + 1 for year in years}
+
+    def _build_deviation(self, rng, years, next_sequence, users):
+        year = rng.choice(years)
+        sequence = next_sequence[year]
+        next_sequence[year] += 1
+
+        release_date = date(year, 1, 1) + timedelta(days=rng.randint(0, 364))
+        effectivity_date = release_date - timedelta(days=rng.randint(0, 14))
+        expiration_date = release_date + timedelta(days=rng.randint(14, 180))
+        defect_category = rng.choice(list(DEFECT_CATEGORIES))
+        defect_field, defect_types = DEFECT_CATEGORIES[defect_category]
+        owner_plant = rng.choice(OWNER_PLANTS)
+        affected = rng.sample(AFFECTED_PLANTS, k=rng.randint(1, 3))
+        creator = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+        deviation = Deviation(
+            primary_column='DEV',
+            year=year,
+            dev_number=format_dev_number('DEV', year, sequence),
+            # bulk_create skips Deviation.save(), which fills these
+            dev_prefix='DEV',
+            dev_year=year % 100,
+            dev_sequence=sequence,
+            created_by=creator,
+            created_by_user_id=rng.choice(users) if users and rng.random() < 0.5 else None,
+            owner_plant=owner_plant,
+            affected_plant='\n'.join(affected),
+            sbu=rng.choice(SBUS),
+            release_date=release_date,
+            effectivity_date=effectivity_date,
+            expiration_date=expiration_date,
+            drawing_number=str(rng.randint(100000, 299999)),
+            back_to_back_deviation=rng.random() < 0.1,
+            defect_category=defect_category,
+        )
+        if defect_field:
+            setattr(deviation, defect_field, rng.choice(defect_types))
+        return deviation
+
+    def _build_actions(self, rng, deviation, min_actions, max_actions):
+        actions = []
+        # Orders are assigned here because bulk_create bypasses Action.save()
+        for order in range(1, rng.randint(min_actions, max_actions) + 1):
+            status = rng.choices([s for s, _ in STATUS_WEIGHTS], weights=[w for _, w in STATUS_WEIGHTS])[0]
+            actions.append(Action(
+                deviation=deviation,
+                action_description=f'{rng.choice(ACTION_VERBS)} {rng.choice(ACTION_OBJECTS)}',
+                action_responsible=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                action_expiration_date=deviation.release_date + timedelta(days=rng.randint(1, 120)),
+                status=status,
+                order=order,
+            ))
+        return actions
@@ -0,0 +1,37 @@
+# deviation_tracker_app/deviations/management/commands/snapshot_db.py
+#
+# Online, compressed snapshot of the database while the app keeps running
+# (see deviations/snapshots.py). Keeps the newest SNAPSHOT_RETENTION snapshots.
+#   python manage.py snapshot_db
+#   python manage.py snapshot_db --keep 14 --dir /backups/deviations
+#   python manage.py snapshot_db --list
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deviations.snapshots import SnapshotError, list_snapshots, snapshot_database
+
+
+class Command(BaseCommand):
+    help = 'Writes a compressed snapshot of the database without blocking writers, and prunes old snapshots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Snapshot directory (default: SNAPSHOT_DIR).')
+        parser.add_argument('--keep', type=int, default=None, help='Snapshots to keep (default: SNAPSHOT_RETENTION).')
+        parser.add_argument('--list', action='store_true', help='List the existing snapshots instead.')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for snapshot in list_snapshots(options['dir']):
+                self.stdout.write(f'{snapshot["file"]}  {snapshot["compressed_bytes"] / 1e6:.1f} MB  '
+                                  f'rows: {snapshot.get("rows", {})}')
+            return
+
+        try:
+            manifest = snapshot_database(options['dir'], keep=options['keep'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot {manifest["name"]} written in {manifest["seconds"]:.2f}s '
+            f'({manifest["bytes"] / 1e6:.1f} MB uncompressed, rows: {manifest["rows"]}).'))
+        for name in manifest['pruned']:
+            self.stdout.write(f'  Pruned {name}')
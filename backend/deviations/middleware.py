@@ -0,0 +1,161 @@
+# deviation_tracker_app/deviation_backend/deviations/middleware.py
+
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from .db import read_only_request, write_queue
+from .profiling import SamplingProfiler, save_profile
+from .instrumentation import (
+    RequestMetrics, end_request, instrument_connections, record, registry, server_timing_header, start_request,
+    view_label,
+)
+
+logger = logging.getLogger('deviations.requests')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class SQLiteConcurrencyMiddleware:
+    """
+    Read-only requests read through the 'read' connection; every other request
+    waits for its turn in the process-wide write queue before touching the DB.
+    Views with `queue_whole_request = False` take the queue themselves around
+    their writes (serialized_write()), e.g. to receive a large body first.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.write_timeout = getattr(settings, 'SQLITE_WRITE_QUEUE_TIMEOUT', None)
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS:
+            with read_only_request():
+                return self.get_response(request)
+        if not queues_whole_request(request):
+            return self.get_response(request)
+        start = time.perf_counter()
+        acquired = write_queue.acquire(self.write_timeout)
+        record('queue', (time.perf_counter() - start) * 1000) # Time spent waiting for our turn to write
+        if not acquired:
+            response = JsonResponse({'detail': 'The database is busy, please retry.'}, status=503)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            write_queue.release()
+
+
+def queues_whole_request(request):
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return True
+    return getattr(getattr(match.func, 'view_class', None), 'queue_whole_request', True)
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Records query count, SQL time, serializer and render time for every request and
+    reports them as a Server-Timing header, a JSON log line and /api/_metrics histograms.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = start_request(metrics)
+        start = time.perf_counter()
+        try:
+            with instrument_connections(metrics):
+                response = self.get_response(request)
+        finally:
+            end_request(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = server_timing_header(metrics, total_ms)
+        view = view_label(request)
+        registry.observe(view, request.method, response.status_code, total_ms / 1000, metrics)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'event': 'request',
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                'duration_ms': round(total_ms, 2),
+                'queries': metrics.queries,
+                'sql_ms': round(metrics.sql_ms, 2),
+                **{f'{phase}_ms': round(ms, 2) for phase, ms in metrics.phases.items()},
+            }))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when a staff user asks for it (`X-Profile: 1` header or
+    `?_profile=1`) and a random PROFILER_SAMPLE_RATE fraction of all requests.
+    The profile id is returned in the `X-Profile-Id` response header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1'
+        sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0.0)
+        if requested and _is_staff(request):
+            trigger = 'requested'
+        elif sample_rate and random.random() < sample_rate:
+            trigger = 'sampled'
+        else:
+            return self.get_response(request)
+
+        profiler = SamplingProfiler(interval=getattr(settings, 'PROFILER_INTERVAL_MS', 5) / 1000).start()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        user = getattr(request, 'user', None)
+        profile_id = save_profile(profiler, {
+            'trigger': trigger,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_label(request),
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'user': user.username if user is not None and user.is_authenticated else None,
+            'created': time.time(),
+        })
+        if trigger == 'requested':
+            response['X-Profile-Id'] = profile_id
+        return response
+
+
+def _is_staff(request):
+    """Staff check that also works for JWT requests (DRF only authenticates those inside the view)."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        from rest_framework.exceptions import APIException
+        from rest_framework.request import Request
+        from .authentication import CachedJWTAuthentication
+        try:
+            result = CachedJWTAuthentication().authenticate(Request(request))
+        except APIException:
+            return False
+        if result is None:
+            return False
+        user = result[0]
+        request.user = user
+    return user.is_staff
+
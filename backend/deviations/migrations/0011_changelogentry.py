@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0010_remove_action_action_responsible_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('deviation', 'Deviation'), ('action', 'Action')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deviation_id', models.BigIntegerField(blank=True, null=True)),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Change log entries',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['created_at'], name='changelog_created_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0011_changelogentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['status', 'action_expiration_date'], name='action_status_expiry_idx'),
+        ),
+    ]
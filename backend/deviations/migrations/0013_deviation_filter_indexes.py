@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0012_action_status_expiry_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deviation',
+            index=models.Index(fields=['owner_plant'], name='deviation_owner_plant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deviation',
+            index=models.Index(fields=['sbu'], name='deviation_sbu_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deviation',
+            index=models.Index(fields=['year'], name='deviation_year_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+from deviations.models import parse_dev_number
+
+
+def fill_dev_keys(apps, schema_editor):
+    Deviation = apps.get_model('deviations', 'Deviation')
+    rows = [(*parse_dev_number(dev_number), pk) for pk, dev_number in Deviation.objects.values_list('id', 'dev_number')]
+    # executemany of a plain UPDATE: bulk_update's CASE WHEN is far slower on tens of thousands of rows
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {Deviation._meta.db_table} SET dev_prefix = %s, dev_year = %s, dev_sequence = %s WHERE id = %s', rows
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0015_job_snapshot_kind'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DevNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=20)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('last_sequence', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='deviation',
+            name='dev_prefix',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='deviation',
+            name='dev_sequence',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='deviation',
+            name='dev_year',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_dev_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='deviation',
+            index=models.Index(fields=['dev_prefix', 'dev_year', 'dev_sequence', 'dev_number'], name='deviation_dev_key_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='devnumbercounter',
+            unique_together={('prefix', 'year')},
+        ),
+    ]
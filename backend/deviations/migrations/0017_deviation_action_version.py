@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0016_deviation_dev_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deviation',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
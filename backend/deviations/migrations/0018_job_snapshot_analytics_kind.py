@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0017_deviation_action_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_deviations', 'Import deviations'), ('import_users', 'Import users'), ('link_attachments', 'Link attachments'), ('link_responsibles', 'Link responsible users'), ('export_deviations', 'Export deviations'), ('send_reminders', 'Send reminders'), ('snapshot_db', 'Database snapshot'), ('snapshot_analytics', 'Analytics (Parquet) snapshot')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0018_job_snapshot_analytics_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilaritySignature',
+            fields=[
+                ('deviation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similarity_signature', serialize=False, to='deviations.deviation')),
+                ('minhash', models.BinaryField()),
+                ('digest', models.CharField(max_length=16)),
+                ('shingle_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('deviation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='deviations.deviation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'deviation'], name='similarity_bucket_key_idx')],
+            },
+        ),
+    ]
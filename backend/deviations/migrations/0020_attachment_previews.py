@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0019_similarity_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentPreview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file_size', models.PositiveBigIntegerField()),
+                ('page_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('thumbnail', models.FileField(blank=True, null=True, upload_to='attachment_previews/')),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_deviations', 'Import deviations'), ('import_users', 'Import users'), ('link_attachments', 'Link attachments'), ('link_responsibles', 'Link responsible users'), ('export_deviations', 'Export deviations'), ('send_reminders', 'Send reminders'), ('snapshot_db', 'Database snapshot'), ('snapshot_analytics', 'Analytics (Parquet) snapshot'), ('attachment_previews', 'Attachment previews')], max_length=30),
+        ),
+        migrations.AddField(
+            model_name='deviation',
+            name='attachment_preview',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='deviations.attachmentpreview'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deviations', '0020_attachment_previews'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_deviations', 'Import deviations'), ('import_users', 'Import users'), ('link_attachments', 'Link attachments'), ('link_responsibles', 'Link responsible users'), ('export_deviations', 'Export deviations'), ('send_reminders', 'Send reminders'), ('snapshot_db', 'Database snapshot'), ('snapshot_analytics', 'Analytics (Parquet) snapshot'), ('attachment_previews', 'Attachment previews'), ('archive_deviations', 'Archive closed deviations')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='ArchivedDeviation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('primary_column', models.CharField(blank=True, max_length=50, null=True)),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('dev_number', models.CharField(max_length=100, unique=True)),
+                ('created_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('owner_plant', models.CharField(blank=True, max_length=100, null=True)),
+                ('affected_plant', models.CharField(blank=True, max_length=255, null=True)),
+                ('sbu', models.CharField(blank=True, max_length=50, null=True)),
+                ('release_date', models.DateField(blank=True, null=True)),
+                ('effectivity_date', models.DateField(blank=True, null=True)),
+                ('expiration_date', models.DateField(blank=True, null=True)),
+                ('drawing_number', models.CharField(blank=True, max_length=255, null=True)),
+                ('back_to_back_deviation', models.BooleanField(default=False)),
+                ('defect_category', models.CharField(blank=True, max_length=100, null=True)),
+                ('assembly_defect_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('molding_defect_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('attachment', models.FileField(blank=True, null=True, upload_to='deviation_attachments/')),
+                ('dev_prefix', models.CharField(blank=True, default='', max_length=20)),
+                ('dev_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('dev_sequence', models.PositiveIntegerField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField()),
+                ('attachment_preview', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='deviations.attachmentpreview')),
+                ('created_by_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Archived deviations',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('action_description', models.TextField()),
+                ('action_responsible', models.CharField(blank=True, max_length=100, null=True)),
+                ('action_expiration_date', models.DateField(blank=True, null=True)),
+                ('reminder_sent', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('Not Started', 'Not Started'), ('In Progress', 'In Progress'), ('Done', 'Done')], default='Not Started', max_length=20)),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('action_responsible_users', models.ManyToManyField(blank=True, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('deviation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actions', to='deviations.archiveddeviation')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived actions',
+                'ordering': ['order', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archiveddeviation',
+            index=models.Index(fields=['dev_prefix', 'dev_year', 'dev_sequence', 'dev_number'], name='archived_dev_key_idx'),
+        ),
+    ]
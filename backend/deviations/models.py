@@ -1,10 +1,86 @@
 # deviation_tracker_app/deviation_backend/deviations/models.py (FINAL - Action with ManyToManyField)
 
-from django.db import models
+import re
+
+from django.db import models, router
 from django.contrib.auth.models import User
-from django.db.models import Max
+from django.db.models import F, Max, signals
+
+# "DEV24-0439" -> ('DEV', 24, 439). Tolerates case, spaces and a dash before the year ("dev 24-439").
+DEV_NUMBER_RE = re.compile(r'^\s*([A-Za-z]+)[\s-]*(\d{2})-(\d+)\s*$')
+
+
+def parse_dev_number(dev_number):
+    """(prefix, two-digit year, sequence) of a DEV number, or ('', None, None) if it has another format."""
+    match = DEV_NUMBER_RE.match(dev_number or '')
+    if not match:
+        return '', None, None
+    return match.group(1).upper(), int(match.group(2)), int(match.group(3))
+
+
+def format_dev_number(prefix, year, sequence):
+    return f'{prefix}{year % 100:02d}-{sequence:04d}'
+
+
+class VersionConflict(Exception):
+    """A conditional save found the row at another version (or gone)."""
+
+
+class VersionedModel(models.Model):
+    """
+    Adds a `version` that every save() of an existing row bumps in SQL (`SET version = version + 1`),
+    so saves from stale instances can never lower or reuse a version.
+    Set `expected_version` before save() to make the save conditional: the row is written with one
+    `UPDATE ... WHERE id = <pk> AND version = <expected>`, and VersionConflict is raised when it
+    matches no row. Bulk update() paths bump the version themselves (see bump_versions).
+    """
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    expected_version = None
+
+    class Meta:
+        abstract = True
 
-class Deviation(models.Model):
+    def save(self, *args, **kwargs):
+        expected, self.expected_version = self.expected_version, None
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        update_fields = kwargs.get('update_fields')
+        if expected is not None:
+            self._save_at_version(expected, using, None if update_fields is None else frozenset(update_fields))
+        else:
+            self.version = F('version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+            super().save(*args, **kwargs)
+        self.refresh_from_db(using=using, fields=['version'])
+
+    def _save_at_version(self, expected, using, update_fields):
+        """save() as one UPDATE that only matches the row while it is still at `expected`."""
+        deferred = self.get_deferred_fields() if update_fields is None else set()
+        fields = [field for field in self._meta.local_concrete_fields
+                  if not field.primary_key and field.name != 'version' and field.attname not in deferred
+                  and (update_fields is None or field.name in update_fields or field.attname in update_fields)]
+        signals.pre_save.send(sender=type(self), instance=self, raw=False, using=using, update_fields=update_fields)
+        values = {field.attname: field.pre_save(self, False) for field in fields}
+        updated = type(self)._base_manager.using(using).filter(pk=self.pk, version=expected).update(
+            **values, version=F('version') + 1)
+        if not updated:
+            raise VersionConflict(f'{self._meta.object_name} {self.pk} is no longer at version {expected}.')
+        self._state.db = using
+        signals.post_save.send(sender=type(self), instance=self, created=False, update_fields=update_fields,
+                               raw=False, using=using)
+
+
+def bump_versions(model, ids, batch_size=5000):
+    """Bumps the version of the `model` rows in `ids`, for writes that bypass save() (bulk m2m changes)."""
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        model.objects.filter(pk__in=ids[start:start + batch_size]).update(version=F('version') + 1)
+
+
+class Deviation(VersionedModel):
     primary_column = models.CharField(max_length=50, blank=True, null=True)
     year = models.IntegerField(blank=True, null=True)
     dev_number = models.CharField(max_length=100, unique=True, db_index=True)
@@ -23,20 +99,81 @@ class Deviation(models.Model):
     assembly_defect_type = models.CharField(max_length=100, blank=True, null=True)
     molding_defect_type = models.CharField(max_length=100, blank=True, null=True)
     attachment = models.FileField(upload_to='deviation_attachments/', blank=True, null=True)
+    # Thumbnail and page count of the attachment, rendered in the background (see previews.py)
+    attachment_preview = models.ForeignKey('AttachmentPreview', on_delete=models.SET_NULL, null=True, blank=True,
+                                           editable=False, related_name='+')
+
+    # dev_number parsed on save (see parse_dev_number), for natural sorting, range filters and numbering
+    dev_prefix = models.CharField(max_length=20, blank=True, default='', editable=False)
+    dev_year = models.PositiveSmallIntegerField(blank=True, null=True, editable=False) # Two digits, 24 for DEV24-0439
+    dev_sequence = models.PositiveIntegerField(blank=True, null=True, editable=False)
+
+    NATURAL_ORDERING = ['dev_prefix', 'dev_year', 'dev_sequence', 'dev_number']
 
     class Meta:
         verbose_name_plural = "Deviations"
+        indexes = [
+            # Admin list filters (SELECT DISTINCT ... / WHERE ... = ...)
+            models.Index(fields=['owner_plant'], name='deviation_owner_plant_idx'),
+            models.Index(fields=['sbu'], name='deviation_sbu_idx'),
+            models.Index(fields=['year'], name='deviation_year_idx'),
+            # Natural order, "DEV24-0400..0500" ranges and the highest sequence per prefix/year
+            models.Index(fields=['dev_prefix', 'dev_year', 'dev_sequence', 'dev_number'], name='deviation_dev_key_idx'),
+        ]
+
+    _loaded_attachment = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_attachment = instance.__dict__.get('attachment') or None # Raw name; absent when deferred
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.dev_prefix, self.dev_year, self.dev_sequence = parse_dev_number(self.dev_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'dev_number' in update_fields:
+            update_fields = kwargs['update_fields'] = {*update_fields, 'dev_prefix', 'dev_year', 'dev_sequence'}
+        # A replaced (or removed) attachment needs a new preview
+        if 'attachment' not in self.get_deferred_fields():
+            attachment = self.attachment.name or None
+            if attachment != self._loaded_attachment:
+                self.attachment_preview = None
+                if update_fields is not None and 'attachment' in update_fields:
+                    kwargs['update_fields'] = {*update_fields, 'attachment_preview'}
+        super().save(*args, **kwargs)
+        if 'attachment' not in self.get_deferred_fields():
+            self._loaded_attachment = self.attachment.name or None # As stored (an upload is renamed on save)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if (fields is None or 'attachment' in fields) and 'attachment' not in self.get_deferred_fields():
+            self._loaded_attachment = self.attachment.name or None
 
     def __str__(self):
         return self.dev_number
 
 
-class Action(models.Model):
+class DevNumberCounter(models.Model):
+    """Last DEV sequence handed out per prefix and year (see numbering.allocate_dev_number)."""
+    prefix = models.CharField(max_length=20)
+    year = models.PositiveSmallIntegerField()
+    last_sequence = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['prefix', 'year']
+
+    def __str__(self):
+        return f"{format_dev_number(self.prefix, self.year, self.last_sequence)} (last allocated)"
+
+
+class Action(VersionedModel):
     STATUS_CHOICES = [
         ('Not Started', 'Not Started'),
         ('In Progress', 'In Progress'),
         ('Done', 'Done'),
     ]
+    OPEN_STATUSES = ['Not Started', 'In Progress']
 
     deviation = models.ForeignKey(Deviation, on_delete=models.CASCADE, related_name='actions')
     action_description = models.TextField()
@@ -62,6 +199,10 @@ class Action(models.Model):
         verbose_name_plural = "Actions"
         ordering = ['order', 'id']
         unique_together = ['deviation', 'order']
+        indexes = [
+            # Overdue report: status IN (open statuses) AND action_expiration_date < cutoff
+            models.Index(fields=['status', 'action_expiration_date'], name='action_status_expiry_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.pk:
@@ -79,3 +220,221 @@ class Action(models.Model):
             return f"Action {self.order} for DEV {self.deviation.dev_number}: {self.action_description[:50]}... ({self.action_responsible})"
         else:
             return f"Action {self.order} for DEV {self.deviation.dev_number}: {self.action_description[:50]}..."
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only log of changes to deviations, actions and their responsible users.
+    The auto-increment id is the sync cursor handed out by /api/changes.
+    """
+    DEVIATION = 'deviation'
+    ACTION = 'action'
+    MODEL_CHOICES = [
+        (DEVIATION, 'Deviation'),
+        (ACTION, 'Action'),
+    ]
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OPERATION_CHOICES = [
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    deviation_id = models.BigIntegerField(blank=True, null=True) # The deviation itself, or the action's deviation
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Change log entries"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['created_at'], name='changelog_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.operation} {self.model} {self.object_id}"
+
+
+class SimilaritySignature(models.Model):
+    """MinHash signature of a deviation's shingled text (see similarity.py)."""
+    deviation = models.OneToOneField(Deviation, on_delete=models.CASCADE, primary_key=True, related_name='similarity_signature')
+    minhash = models.BinaryField() # NUM_PERM little-endian uint32 values
+    digest = models.CharField(max_length=16) # Of the shingle set: unchanged text is not reindexed
+    shingle_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Signature of deviation {self.deviation_id} ({self.shingle_count} shingles)"
+
+
+class SimilarityBucket(models.Model):
+    """One LSH band of a deviation's signature, hashed: deviations sharing a key are near-duplicate candidates."""
+    deviation = models.ForeignKey(Deviation, on_delete=models.CASCADE, related_name='+')
+    key = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            # Candidates of a deviation: key IN (its band keys), answered from the index alone
+            models.Index(fields=['key', 'deviation'], name='similarity_bucket_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"Bucket {self.key} of deviation {self.deviation_id}"
+
+
+class AttachmentPreview(models.Model):
+    """
+    First-page thumbnail, page count and size of an attachment, keyed by the sha256 of
+    its content: deviations sharing the same file share one preview (see previews.py).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file_size = models.PositiveBigIntegerField()
+    page_count = models.PositiveIntegerField(blank=True, null=True) # None: not a (readable) PDF
+    thumbnail = models.FileField(upload_to='attachment_previews/', blank=True, null=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default='') # Why no thumbnail could be rendered
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Preview {self.sha256[:12]} ({self.page_count or '?'} pages)"
+
+
+class ArchivedDeviation(models.Model):
+    """
+    A closed deviation moved out of the hot tables (see archive.py): Deviation's columns,
+    id included, and when it was archived. Not edited in place; restore_deviations moves
+    it back first.
+    """
+    id = models.BigIntegerField(primary_key=True) # The id it had (and gets back on restore)
+    version = models.PositiveIntegerField(default=1)
+    primary_column = models.CharField(max_length=50, blank=True, null=True)
+    year = models.IntegerField(blank=True, null=True)
+    dev_number = models.CharField(max_length=100, unique=True)
+    created_by = models.CharField(max_length=100, blank=True, null=True)
+    created_by_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    owner_plant = models.CharField(max_length=100, blank=True, null=True)
+    affected_plant = models.CharField(max_length=255, blank=True, null=True)
+    sbu = models.CharField(max_length=50, blank=True, null=True)
+    release_date = models.DateField(blank=True, null=True)
+    effectivity_date = models.DateField(blank=True, null=True)
+    expiration_date = models.DateField(blank=True, null=True)
+    drawing_number = models.CharField(max_length=255, blank=True, null=True)
+    back_to_back_deviation = models.BooleanField(default=False)
+    defect_category = models.CharField(max_length=100, blank=True, null=True)
+    assembly_defect_type = models.CharField(max_length=100, blank=True, null=True)
+    molding_defect_type = models.CharField(max_length=100, blank=True, null=True)
+    attachment = models.FileField(upload_to='deviation_attachments/', blank=True, null=True) # Same file, not copied
+    attachment_preview = models.ForeignKey(AttachmentPreview, on_delete=models.SET_NULL, null=True, blank=True,
+                                           related_name='+')
+
+    dev_prefix = models.CharField(max_length=20, blank=True, default='')
+    dev_year = models.PositiveSmallIntegerField(blank=True, null=True)
+    dev_sequence = models.PositiveIntegerField(blank=True, null=True)
+
+    archived_at = models.DateTimeField()
+
+    NATURAL_ORDERING = Deviation.NATURAL_ORDERING
+
+    class Meta:
+        verbose_name_plural = "Archived deviations"
+        indexes = [
+            models.Index(fields=['dev_prefix', 'dev_year', 'dev_sequence', 'dev_number'], name='archived_dev_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dev_number} (archived)"
+
+
+class ArchivedAction(models.Model):
+    """An action of an ArchivedDeviation, with Action's columns and id."""
+    id = models.BigIntegerField(primary_key=True)
+    version = models.PositiveIntegerField(default=1)
+    # Same related names as Action's, so queries written for deviations work on archived ones
+    deviation = models.ForeignKey(ArchivedDeviation, on_delete=models.CASCADE, related_name='actions')
+    action_description = models.TextField()
+    action_responsible = models.CharField(max_length=100, blank=True, null=True)
+    action_responsible_users = models.ManyToManyField(User, blank=True, related_name='+')
+    action_expiration_date = models.DateField(blank=True, null=True)
+    reminder_sent = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=Action.STATUS_CHOICES, default='Not Started')
+    order = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Archived actions"
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return f"Action {self.order} of archived deviation {self.deviation_id}"
+
+
+class Job(models.Model):
+    """
+    Background job run by the worker pool in jobs.py (`python manage.py run_jobs`).
+    `counts` holds the row counts the job reports, `log` its output.
+    """
+    IMPORT_DEVIATIONS = 'import_deviations'
+    IMPORT_USERS = 'import_users'
+    LINK_ATTACHMENTS = 'link_attachments'
+    LINK_RESPONSIBLES = 'link_responsibles'
+    EXPORT_DEVIATIONS = 'export_deviations'
+    SEND_REMINDERS = 'send_reminders'
+    SNAPSHOT_DB = 'snapshot_db'
+    SNAPSHOT_ANALYTICS = 'snapshot_analytics'
+    RENDER_PREVIEWS = 'attachment_previews'
+    ARCHIVE_DEVIATIONS = 'archive_deviations'
+    INDEX_SIMILARITY = 'index_similarity'
+    KIND_CHOICES = [
+        (IMPORT_DEVIATIONS, 'Import deviations'),
+        (IMPORT_USERS, 'Import users'),
+        (LINK_ATTACHMENTS, 'Link attachments'),
+        (LINK_RESPONSIBLES, 'Link responsible users'),
+        (EXPORT_DEVIATIONS, 'Export deviations'),
+        (SEND_REMINDERS, 'Send reminders'),
+        (SNAPSHOT_DB, 'Database snapshot'),
+        (SNAPSHOT_ANALYTICS, 'Analytics (Parquet) snapshot'),
+        (RENDER_PREVIEWS, 'Attachment previews'),
+        (ARCHIVE_DEVIATIONS, 'Archive closed deviations'),
+        (INDEX_SIMILARITY, 'Similarity index'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='jobs/input/', blank=True, null=True)
+    result_file = models.FileField(upload_to='jobs/results/', blank=True, null=True)
+    progress = models.PositiveSmallIntegerField(default=0) # Percent
+    counts = models.JSONField(default=dict, blank=True)
+    log = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True) # Bumped while running, to spot dead workers
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.pk} {self.kind} ({self.status})"
@@ -0,0 +1,36 @@
+# deviation_tracker_app/deviation_backend/deviations/numbering.py
+#
+# Hands out the next DEV number ("DEV25-0193") for a prefix and year.
+#
+# One DevNumberCounter row per (prefix, year) holds the last sequence given out,
+# bumped inside the write queue and an IMMEDIATE transaction, so two requests (or
+# two processes) never get the same number. The first allocation for a year, and
+# every later one as a guard against numbers typed in by hand, also reads the
+# highest existing sequence (archived deviations included), a single seek on
+# deviation_dev_key_idx and archived_dev_key_idx.
+
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Max
+
+from .db import serialized_write
+from .models import ArchivedDeviation, Deviation, DevNumberCounter, format_dev_number
+
+DEFAULT_PREFIX = 'DEV'
+
+
+def highest_sequence(prefix, year):
+    return max(model.objects.filter(dev_prefix=prefix, dev_year=year).aggregate(Max('dev_sequence'))['dev_sequence__max'] or 0
+               for model in (Deviation, ArchivedDeviation))
+
+
+def allocate_dev_number(prefix=DEFAULT_PREFIX, year=None):
+    """Reserves and returns the next free DEV number, e.g. 'DEV25-0193'. Unused numbers are simply skipped."""
+    prefix = prefix.upper()
+    year = (year if year is not None else date.today().year) % 100
+    with serialized_write(), transaction.atomic():
+        counter, _ = DevNumberCounter.objects.get_or_create(prefix=prefix, year=year)
+        counter.last_sequence = max(counter.last_sequence, highest_sequence(prefix, year)) + 1
+        counter.save(update_fields=['last_sequence'])
+    return format_dev_number(prefix, year, counter.last_sequence)
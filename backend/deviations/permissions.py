@@ -0,0 +1,20 @@
+# deviation_tracker_app/deviation_backend/deviations/permissions.py
+
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    """
+    Staff users, or scrapers sending the shared secret from settings.METRICS_TOKEN
+    in an `X-Metrics-Token` header (Prometheus cannot log in with a JWT).
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_authenticated and request.user.is_staff:
+            return True
+        expected = getattr(settings, 'METRICS_TOKEN', None)
+        supplied = request.headers.get('X-Metrics-Token')
+        return bool(expected and supplied and hmac.compare_digest(expected, supplied))
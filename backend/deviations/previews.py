@@ -0,0 +1,150 @@
+# deviation_tracker_app/deviation_backend/deviations/previews.py
+#
+# First-page thumbnails, page counts and sizes of deviation attachments, so the
+# detail page and lists show what a PDF is without downloading and rendering the
+# whole file in the browser.
+#
+# Previews are rendered in the background (an `attachment_previews` job, queued
+# when a deviation with an attachment but no preview is saved; see signals.py) and
+# keyed by the sha256 of the file: the same drawing attached to many deviations is
+# rendered once, and a preview never goes stale since changed content has another
+# hash. That also lets /api/deviations/<dev_number>/attachment/preview?v=<hash>
+# be cached by browsers for good. Attachments saved before this existed are
+# caught up with `python manage.py render_attachment_previews`.
+
+import hashlib
+import io
+
+import pypdfium2 as pdfium
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .db import serialized_write
+from .models import AttachmentPreview, Deviation, Job
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PDF_MAGIC = b'%PDF-'
+
+
+def thumbnail_width():
+    return getattr(settings, 'THUMBNAIL_WIDTH', 320)
+
+
+def version_tag(preview):
+    """The `?v=` of a preview's URL: the start of its hash."""
+    return preview.sha256[:16]
+
+
+def file_digest(field_file):
+    """(sha256 hex digest, size in bytes) of a stored file, read in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with field_file.storage.open(field_file.name, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def render_first_page(data, width):
+    """(PNG bytes of the first page scaled to `width` pixels, page count, (width, height))."""
+    document = pdfium.PdfDocument(data)
+    try:
+        page_count = len(document)
+        if not page_count:
+            raise ValueError('The PDF has no pages.')
+        page = document[0]
+        try:
+            page_width, _ = page.get_size() # Points
+            image = page.render(scale=width / page_width).to_pil()
+        finally:
+            page.close()
+    finally:
+        document.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue(), page_count, image.size
+
+
+def build_preview(field_file):
+    """
+    The AttachmentPreview of a stored file: an existing one with the same content,
+    or a new one. PDFs get a thumbnail and page count; other files and PDFs that
+    cannot be read only their size (and the reason in `error`).
+    """
+    sha256, size = file_digest(field_file)
+    preview = AttachmentPreview.objects.filter(sha256=sha256).first()
+    if preview is not None:
+        return preview, False
+
+    preview = AttachmentPreview(sha256=sha256, file_size=size)
+    with field_file.storage.open(field_file.name, 'rb') as handle:
+        data = handle.read()
+    if not data.startswith(PDF_MAGIC):
+        preview.error = 'Not a PDF.'
+    else:
+        try:
+            png, preview.page_count, (preview.width, preview.height) = render_first_page(data, thumbnail_width())
+        except Exception as e: # pdfium raises PdfiumError for damaged files, among others
+            preview.error = f'Could not render the PDF: {e}'
+        else:
+            preview.thumbnail.save(f'{sha256}.png', ContentFile(png), save=False)
+    with serialized_write(), transaction.atomic():
+        # Another worker may have rendered the same file meanwhile
+        existing = AttachmentPreview.objects.filter(sha256=sha256).first()
+        if existing is not None:
+            if preview.thumbnail:
+                preview.thumbnail.delete(save=False)
+            return existing, False
+        preview.save()
+    return preview, True
+
+
+def render_previews(deviations=None, force=False, progress=None, log=None):
+    """
+    Links a preview to each deviation (of `deviations`, default all) that has an
+    attachment but no preview; `force` redoes the ones that have one, hashing their
+    files again. Returns the counts.
+    """
+    deviations = Deviation.objects.all() if deviations is None else deviations
+    deviations = deviations.exclude(attachment='').exclude(attachment=None)
+    if not force:
+        deviations = deviations.filter(attachment_preview=None)
+    pending = list(deviations.order_by('pk').only('pk', 'dev_number', 'attachment'))
+
+    counts = {'deviations': len(pending), 'rendered': 0, 'reused': 0, 'missing': 0, 'failed': 0}
+    for done, deviation in enumerate(pending, start=1):
+        attachment = deviation.attachment
+        if not attachment.storage.exists(attachment.name):
+            counts['missing'] += 1
+            if log is not None:
+                log(f'{deviation.dev_number}: attachment {attachment.name} is missing.')
+        else:
+            preview, created = build_preview(attachment)
+            counts['rendered' if created else 'reused'] += 1
+            if preview.error and created:
+                counts['failed'] += 1
+                if log is not None:
+                    log(f'{deviation.dev_number}: {preview.error}')
+            with serialized_write():
+                # Derived data: no version bump or change log entry. Only if the attachment is still the same file.
+                Deviation.objects.filter(pk=deviation.pk, attachment=attachment.name).update(attachment_preview=preview)
+        if progress is not None:
+            progress(done, len(pending))
+    return counts
+
+
+def queue_previews():
+    """Queues an `attachment_previews` job unless one is already waiting."""
+    from .jobs import enqueue # jobs.py imports this module
+
+    with serialized_write(), transaction.atomic():
+        if not Job.objects.filter(kind=Job.RENDER_PREVIEWS, status=Job.QUEUED).exists():
+            enqueue(Job.RENDER_PREVIEWS)
+
+
+def schedule_previews(deviation):
+    """Queues the rendering of the deviation's preview once the current transaction commits."""
+    if deviation.attachment and deviation.attachment_preview_id is None:
+        transaction.on_commit(queue_previews, robust=True)
@@ -0,0 +1,129 @@
+# deviation_tracker_app/deviation_backend/deviations/profiling.py
+#
+# Opt-in request profiler. A background thread samples the stack of the thread
+# serving the request every few milliseconds and the result is written in the
+# "folded stacks" format (one `frame;frame;frame count` line per stack), which
+# flamegraph.pl, speedscope.app and inferno read directly.
+#
+# Profiles are triggered by ProfilingMiddleware: staff users can ask for one with
+# an `X-Profile: 1` header or `?_profile=1`, and settings.PROFILER_SAMPLE_RATE
+# profiles a random fraction of all requests.
+
+import json
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+$')
+
+
+def get_profile_dir():
+    return str(getattr(settings, 'PROFILER_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    for prefix in sorted({p for p in sys.path if p}, key=len, reverse=True):
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval until stopped."""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {} # code object -> label, frames repeat a lot
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+
+def save_profile(profiler, meta):
+    """Writes <id>.folded and <id>.json to the profile directory and returns the id."""
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    view = re.sub(r'[^\w-]', '_', meta.get('view') or 'unknown')
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{meta['method']}_{view}"
+
+    with open(os.path.join(profile_dir, f'{profile_id}.folded'), 'w') as f:
+        f.write(profiler.folded())
+    with open(os.path.join(profile_dir, f'{profile_id}.json'), 'w') as f:
+        json.dump({**meta, 'id': profile_id, 'samples': profiler.samples,
+                   'interval_ms': profiler.interval * 1000}, f, indent=2)
+
+    _prune(profile_dir, getattr(settings, 'PROFILER_MAX_PROFILES', 200))
+    return profile_id
+
+
+def _prune(profile_dir, keep):
+    metas = sorted(name for name in os.listdir(profile_dir) if name.endswith('.json'))
+    for name in metas[:max(0, len(metas) - keep)]:
+        for extension in ('.json', '.folded'):
+            path = os.path.join(profile_dir, name[:-len('.json')] + extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles():
+    """Metadata of all saved profiles, newest first."""
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profile_dir, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of the folded stacks file for `profile_id`, or None if it does not exist."""
+    if not PROFILE_NAME_RE.match(profile_id):
+        return None
+    path = os.path.join(get_profile_dir(), f'{profile_id}.folded')
+    return path if os.path.exists(path) else None
@@ -0,0 +1,19 @@
+# deviation_tracker_app/deviation_backend/deviations/renderers.py
+
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+
+from .instrumentation import timed
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    """JSONRenderer that reports its time as the 'render' phase of the request."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class InstrumentedBrowsableAPIRenderer(BrowsableAPIRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
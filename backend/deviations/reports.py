@@ -0,0 +1,189 @@
+# deviation_tracker_app/deviation_backend/deviations/reports.py
+#
+# Aggregations computed in SQL rather than per object in Python.
+#
+# Overdue-actions report behind /api/actions/overdue. An action is overdue when
+# it is still open and its action_expiration_date lies at least `days_overdue`
+# days in the past; the (status, action_expiration_date) index turns that into
+# a range scan. Actions are grouped by owner: each user in
+# action_responsible_users, or the legacy action_responsible text (people's
+# names, resolved like the import does, see responsibles.py) for actions that
+# have no users assigned yet.
+
+import math
+from datetime import date, timedelta
+
+from django.db.models import Case, CharField, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Floor
+
+from .models import Action
+from .responsibles import UserNameIndex
+
+Responsible = Action.action_responsible_users.through
+STARTED_STATUSES = ['In Progress', 'Done']
+
+
+def overdue_actions(days_overdue=1, plant=None, today=None):
+    cutoff = (today or date.today()) - timedelta(days=days_overdue - 1)
+    actions = Action.objects.filter(status__in=Action.OPEN_STATUSES, action_expiration_date__lt=cutoff)
+    if plant:
+        actions = actions.filter(Q(deviation__owner_plant__iexact=plant) | Q(deviation__affected_plant__icontains=plant))
+    return actions
+
+
+def owner_counts(actions, user=None):
+    """
+    One grouped query (a UNION of the M2M owners and the legacy text owners) giving
+    rows of {'user_id', 'owner', 'overdue_count'}, most overdue actions first.
+    `user` is a User to restrict the report to; legacy texts count when they name them.
+    """
+    assigned = Responsible.objects.filter(action__in=actions)
+    legacy = actions.filter(action_responsible_users__isnull=True)
+    if user is not None:
+        assigned = assigned.filter(user=user)
+        legacy = legacy.filter(action_responsible__in=legacy_texts_naming(user, legacy))
+
+    # order_by(): no per-part ORDER BY (Action's Meta.ordering) inside the UNION
+    assigned = assigned.order_by().values('user_id').annotate(owner=F('user__username'), overdue_count=Count('action_id'))
+    legacy = legacy.order_by().values('action_responsible').annotate(
+        user_id=Value(None, output_field=IntegerField()), owner=F('action_responsible'), overdue_count=Count('id'),
+    ).values('user_id', 'owner', 'overdue_count')
+    return assigned.values('user_id', 'owner', 'overdue_count').union(legacy, all=True) \
+        .order_by('-overdue_count', 'owner')
+
+
+def legacy_texts_naming(user, actions):
+    """
+    The distinct action_responsible texts of `actions` that name `user` ("Jeffery Cooper",
+    "Cooper, Jeffery", "J. Cooper / Ana Ruiz", ...), matched like responsibles.link_responsible_users.
+    """
+    texts = list(actions.exclude(action_responsible__isnull=True).exclude(action_responsible='')
+                 .order_by().values_list('action_responsible', flat=True).distinct())
+    if not texts:
+        return []
+    index = UserNameIndex()
+    return [text for text in texts if user.pk in index.resolve(text).user_ids]
+
+
+ACTION_FIELDS = ['id', 'deviation__dev_number', 'action_description', 'action_expiration_date', 'status']
+
+
+def _action_row(values, today, prefix=''):
+    expiration_date = values[f'{prefix}action_expiration_date']
+    return {
+        'id': values[f'{prefix}id'],
+        'dev_number': values[f'{prefix}deviation__dev_number'],
+        'action_description': values[f'{prefix}action_description'],
+        'action_expiration_date': expiration_date,
+        'status': values[f'{prefix}status'],
+        'days_overdue': (today - expiration_date).days,
+    }
+
+
+def overdue_groups(actions, owners, today=None):
+    """Attaches the overdue actions to each owner row of one page of owner_counts()."""
+    today = today or date.today()
+    user_ids = [row['user_id'] for row in owners if row['user_id'] is not None]
+    legacy_names = [row['owner'] for row in owners if row['user_id'] is None]
+
+    by_user, by_name = {}, {}
+    if user_ids:
+        assigned = Responsible.objects.filter(user_id__in=user_ids, action__in=actions) \
+            .order_by('action__action_expiration_date', 'action_id') \
+            .values('user_id', *[f'action__{field}' for field in ACTION_FIELDS])
+        for values in assigned:
+            by_user.setdefault(values['user_id'], []).append(_action_row(values, today, prefix='action__'))
+    if legacy_names:
+        query = Q(action_responsible__in=[name for name in legacy_names if name is not None])
+        if None in legacy_names:
+            query |= Q(action_responsible__isnull=True) # Actions nobody is responsible for
+        legacy = actions.filter(query, action_responsible_users__isnull=True) \
+            .order_by('action_expiration_date', 'id').values('action_responsible', *ACTION_FIELDS)
+        for values in legacy:
+            by_name.setdefault(values['action_responsible'], []).append(_action_row(values, today))
+
+    return [
+        {
+            'user_id': row['user_id'],
+            'owner': row['owner'],
+            'overdue_count': row['overdue_count'],
+            'actions': by_user.get(row['user_id'], []) if row['user_id'] is not None else by_name.get(row['owner'], []),
+        }
+        for row in owners
+    ]
+
+
+def percent_done(done, total):
+    """Completion percentage, rounded half up (12.5 -> 13), the same as annotate_deviation_status."""
+    return math.floor(100 * done / total + 0.5) if total else 0
+
+
+def _action_count(actions=Action, **filters):
+    return Coalesce(Subquery(
+        actions.objects.filter(deviation=OuterRef('pk'), **filters).order_by()
+        .values('deviation').annotate(n=Count('pk')).values('n')
+    ), 0)
+
+
+def annotate_deviation_status(deviations, today=None):
+    """
+    Adds action_count, done_count, completion_percentage and deviation_status,
+    computed in SQL with the same rules as DeviationSerializer. Correlated
+    subqueries rather than a JOIN + GROUP BY, so a paginated list only computes
+    them for the rows on the page (and COUNT(*) skips them entirely). Works on
+    ArchivedDeviation querysets too (counting their ArchivedActions).
+    """
+    actions = deviations.model._meta.get_field('actions').related_model
+    deviations = deviations.annotate(
+        action_count=_action_count(actions),
+        done_count=_action_count(actions, status='Done'),
+        started_count=_action_count(actions, status__in=STARTED_STATUSES),
+    )
+    return deviations.annotate(**_rollups(today or date.today()))
+
+
+def _rollups(today):
+    """completion_percentage and deviation_status from action_count/done_count/started_count and expiration_date."""
+    return {
+        'completion_percentage': Case(
+            When(action_count=0, then=Value(0)),
+            # Half up, like percent_done(): SQL ROUND() and Python's round() disagree on halves
+            default=Cast(Floor(100.0 * F('done_count') / F('action_count') + 0.5), IntegerField()),
+            output_field=IntegerField(),
+        ),
+        'deviation_status': Case(
+            When(action_count__gt=0, done_count=F('action_count'), then=Value('Done')),
+            When(expiration_date__lt=today, then=Value('Delayed')),
+            When(started_count__gt=0, then=Value('In Progress')),
+            default=Value('Not Started'),
+            output_field=CharField(),
+        ),
+    }
+
+
+def deviation_rollups(deviation_ids, today=None):
+    """
+    Status, completion and per-status action counts of the given deviations (that
+    have actions) in one GROUP BY over their actions, using the (deviation, order) index.
+    """
+    rows = Action.objects.filter(deviation_id__in=deviation_ids).order_by().values(
+        'deviation_id', dev_number=F('deviation__dev_number'), expiration_date=F('deviation__expiration_date'),
+    ).annotate(
+        action_count=Count('pk'),
+        done_count=Count('pk', filter=Q(status='Done')),
+        started_count=Count('pk', filter=Q(status__in=STARTED_STATUSES)),
+    ).annotate(**_rollups(today or date.today())).order_by('dev_number')
+    return [
+        {
+            'dev_number': row['dev_number'],
+            'deviation_status': row['deviation_status'],
+            'completion_percentage': row['completion_percentage'],
+            'action_counts': {
+                'total': row['action_count'],
+                'Not Started': row['action_count'] - row['started_count'],
+                'In Progress': row['started_count'] - row['done_count'],
+                'Done': row['done_count'],
+            },
+        }
+        for row in rows
+    ]
@@ -0,0 +1,211 @@
+# deviation_tracker_app/deviation_backend/deviations/responsibles.py
+#
+# Resolves the legacy free-text Action.action_responsible ("Jeffery Cooper",
+# "J. Rivero / Luis Montoya", "Cooper, Jeffery", "jcooper@rainbird.com") to
+# Users and fills Action.action_responsible_users from it.
+#
+# An in-memory index over every user's full name, username and email is built
+# once per run: exact lookups on normalized names first, then a trigram index
+# for spelling variants. Every distinct responsible string is resolved once and
+# all M2M links are written with a single bulk_create on the through table.
+# Names matching several users equally well are reported, never guessed. A cell
+# is only linked once every name in it resolves: linked actions are not looked at
+# again, so a partly resolved cell stays unlinked (and reported) until it can be
+# linked whole.
+
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.contrib.auth.models import User
+
+from .changes import record_changes
+from .models import Action, ChangeLogEntry, bump_versions
+
+Responsible = Action.action_responsible_users.through
+
+# "A / B", "A; B", "A & B", "A + B", "A and B", one name per line
+SEPARATOR_RE = re.compile(r'\s*(?:/|;|&|\+|\n|\band\b)\s*', re.IGNORECASE)
+# Spanish "A y B": only between full names, "Y" is also an initial ("Y. Chen", "Andy Y Wong")
+SPANISH_AND_RE = re.compile(r'\s+y\s+', re.IGNORECASE)
+MIN_SIMILARITY = 0.6 # Trigram similarity (Dice) needed for a fuzzy match
+MIN_MARGIN = 0.1 # ...and how far ahead of the runner-up it must be
+
+
+def normalize(text):
+    """Lowercase, accents stripped, punctuation collapsed to single spaces."""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^a-z0-9@.]+', ' ', text.lower()).replace('.', ' ').split())
+
+
+def split_names(text):
+    """Splits a responsible cell into the individual names in it."""
+    parts = []
+    for part in SEPARATOR_RE.split(text or ''):
+        pieces = SPANISH_AND_RE.split(part.strip())
+        if len(pieces) > 1 and all(len(piece.split()) > 1 for piece in pieces):
+            parts.extend(pieces)
+        elif part.strip():
+            parts.append(part.strip())
+    names = []
+    for part in parts:
+        pieces = [piece.strip() for piece in part.split(',') if piece.strip()]
+        if len(pieces) == 2 and all(len(piece.split()) == 1 for piece in pieces):
+            names.append(f'{pieces[1]} {pieces[0]}') # "Cooper, Jeffery"
+        else:
+            names.extend(pieces)
+    return names
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class Resolution:
+    user_ids: list = field(default_factory=list)
+    ambiguous: list = field(default_factory=list) # [(name, [usernames])]
+    unmatched: list = field(default_factory=list) # [name]
+
+
+class UserNameIndex:
+    """Exact and trigram lookups over all users, built with one query."""
+
+    def __init__(self, users=None):
+        if users is None:
+            users = User.objects.values_list('id', 'username', 'first_name', 'last_name', 'email')
+        self.exact = defaultdict(set) # normalized key -> user ids
+        self.grams = defaultdict(set) # trigram -> name variant numbers
+        self.variants = [] # variant number -> (user id, number of trigrams)
+        self.usernames = {}
+
+        for user_id, username, first_name, last_name, email in users:
+            self.usernames[user_id] = username
+            full_name = normalize(f'{first_name} {last_name}')
+            keys = {normalize(username)}
+            if full_name:
+                tokens = full_name.split()
+                names = {full_name, normalize(f'{last_name} {first_name}')}
+                if len(tokens) > 2:
+                    names.add(f'{tokens[0]} {tokens[-1]}') # "Abdul Ivan Castillo" -> "abdul castillo"
+                keys |= names
+                keys.add(f'{tokens[0][0]} {tokens[-1]}') # "J. Cooper"
+                for name in names:
+                    name_grams = trigrams(name)
+                    self.variants.append((user_id, len(name_grams)))
+                    for gram in name_grams:
+                        self.grams[gram].add(len(self.variants) - 1)
+            if email:
+                keys.add(normalize(email))
+                keys.add(normalize(email.split('@')[0]))
+            for key in keys:
+                if key:
+                    self.exact[key].add(user_id)
+
+    def lookup(self, name):
+        """Returns ([user_id], None) for a match, ([], [candidate ids]) if ambiguous, ([], []) if unknown."""
+        key = normalize(name)
+        if not key:
+            return [], []
+        hits = self.exact.get(key)
+        if hits:
+            return (list(hits), None) if len(hits) == 1 else ([], sorted(hits))
+
+        grams = trigrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for variant in self.grams.get(gram, ()):
+                shared[variant] += 1
+        best = {} # user id -> similarity of their closest name variant
+        for variant, count in shared.items():
+            user_id, gram_count = self.variants[variant]
+            best[user_id] = max(best.get(user_id, 0), 2 * count / (len(grams) + gram_count))
+        scored = sorted(((score, user_id) for user_id, score in best.items()), reverse=True)
+        if not scored or scored[0][0] < MIN_SIMILARITY:
+            return [], []
+        best_score, best_id = scored[0]
+        close = [user_id for score, user_id in scored if best_score - score < MIN_MARGIN]
+        return ([best_id], None) if len(close) == 1 else ([], sorted(close))
+
+    def resolve(self, text):
+        resolution = Resolution()
+        for name in split_names(text):
+            user_ids, candidates = self.lookup(name)
+            if user_ids:
+                resolution.user_ids.extend(uid for uid in user_ids if uid not in resolution.user_ids)
+            elif candidates:
+                resolution.ambiguous.append((name, [self.usernames[uid] for uid in candidates]))
+            else:
+                resolution.unmatched.append(name)
+        return resolution
+
+
+@dataclass
+class LinkReport:
+    actions_linked: int = 0
+    links_created: int = 0
+    ambiguous: dict = field(default_factory=dict) # name -> [usernames]
+    unmatched: dict = field(default_factory=dict) # name -> number of actions
+
+    def add(self, other):
+        """Adds the results of another run (e.g. of the next batch) to this report."""
+        self.actions_linked += other.actions_linked
+        self.links_created += other.links_created
+        self.ambiguous.update(other.ambiguous)
+        for name, count in other.unmatched.items():
+            self.unmatched[name] = self.unmatched.get(name, 0) + count
+
+
+def link_responsible_users(actions=None, index=None, dry_run=False):
+    """
+    Fills action_responsible_users from action_responsible for every action in
+    `actions` (default: all) that has responsible text but no linked users yet.
+    Cells with an ambiguous or unknown name are left unlinked for a later run.
+    """
+    actions = Action.objects.all() if actions is None else actions
+    rows = list(
+        actions.filter(action_responsible_users__isnull=True)
+        .exclude(action_responsible__isnull=True).exclude(action_responsible='')
+        .order_by().values_list('id', 'deviation_id', 'action_responsible')
+    )
+    report = LinkReport()
+    if not rows:
+        return report
+
+    index = index or UserNameIndex()
+    resolutions = {text: index.resolve(text) for text in {text for _, _, text in rows}}
+
+    links, linked = [], []
+    for action_id, deviation_id, text in rows:
+        resolution = resolutions[text]
+        for name, usernames in resolution.ambiguous:
+            report.ambiguous[name] = usernames
+        for name in resolution.unmatched:
+            report.unmatched[name] = report.unmatched.get(name, 0) + 1
+        if resolution.user_ids and not resolution.ambiguous and not resolution.unmatched:
+            linked.append((action_id, deviation_id))
+            links.extend(Responsible(action_id=action_id, user_id=user_id) for user_id in resolution.user_ids)
+
+    report.actions_linked, report.links_created = len(linked), len(links)
+    if links and not dry_run:
+        Responsible.objects.bulk_create(links, batch_size=5000, ignore_conflicts=True)
+        # bulk_create bypasses the m2m_changed receivers and the version bump of save()
+        bump_versions(Action, [action_id for action_id, _ in linked])
+        record_changes(ChangeLogEntry.ACTION, linked, ChangeLogEntry.UPDATE)
+    return report
+
+
+def write_report(stdout, style, report, dry_run=False):
+    """Writes `report` for people: counts, then the ambiguous and unknown names to fix."""
+    verb = 'Would link' if dry_run else 'Linked'
+    stdout.write(style.SUCCESS(f'{verb} {report.actions_linked} action(s) ({report.links_created} responsible user link(s)).'))
+    if report.ambiguous:
+        stdout.write(style.WARNING(f'{len(report.ambiguous)} ambiguous name(s), left unlinked:'))
+        for name, usernames in sorted(report.ambiguous.items()):
+            stdout.write(f'  "{name}": {", ".join(usernames)}')
+    if report.unmatched:
+        stdout.write(style.WARNING(f'{len(report.unmatched)} name(s) matching no user:'))
+        for name, count in sorted(report.unmatched.items(), key=lambda item: (-item[1], item[0])):
+            stdout.write(f'  "{name}" ({count} action(s))')
@@ -1,18 +1,38 @@
 # deviation_tracker_app/deviation_backend/deviations/serializers.py (UPDATED - With Delayed Status)
 
 from rest_framework import serializers
-from .models import Deviation, Action
+from .models import ArchivedDeviation, Deviation, Action, Job
 from django.contrib.auth.models import User
+from django.urls import reverse
 from datetime import date
 
+from .instrumentation import timed
+from .jobs import live_state
+from .previews import version_tag
+from .reports import percent_done
 
-class UserSerializer(serializers.ModelSerializer):
+
+class TimedDataMixin:
+    """Reports the time spent building `.data` (including any SQL it triggers) as the 'serializer' phase."""
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class UserSerializer(TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = User
+        list_serializer_class = TimedListSerializer
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
 
-class ActionSerializer(serializers.ModelSerializer):
+class ActionSerializer(TimedDataMixin, serializers.ModelSerializer):
     action_responsible_users = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=User.objects.all(),
@@ -22,6 +42,7 @@ class ActionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Action
+        list_serializer_class = TimedListSerializer
         fields = [
             'id',
             'action_description',
@@ -31,7 +52,8 @@ class ActionSerializer(serializers.ModelSerializer):
             'reminder_sent',
             'deviation',
             'status',
-            'order'
+            'order',
+            'version',
         ]
         read_only_fields = ['deviation']
 
@@ -40,9 +62,10 @@ class ActionSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
 
         # For displaying, convert the list of user IDs to full names
-        if 'action_responsible_users' in representation and instance.action_responsible_users.exists():
+        users = instance.action_responsible_users.all() # Served from the prefetch cache when the view prefetched
+        if 'action_responsible_users' in representation and users:
             responsible_full_names = []
-            for user in instance.action_responsible_users.all():
+            for user in users:
                 full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
                 responsible_full_names.append(full_name if full_name else user.username) # Fallback to username if no full name
             
@@ -50,10 +73,11 @@ class ActionSerializer(serializers.ModelSerializer):
         return representation
 
 
-class DeviationSerializer(serializers.ModelSerializer):
+class DeviationSerializer(TimedDataMixin, serializers.ModelSerializer):
     actions = ActionSerializer(many=True, read_only=True)
     deviation_status = serializers.SerializerMethodField()
     completion_percentage = serializers.SerializerMethodField()
+    attachment_preview = serializers.SerializerMethodField()
 
     created_by_user = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
@@ -64,16 +88,24 @@ class DeviationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Deviation
+        list_serializer_class = TimedListSerializer
         fields = [
             'id', 'primary_column', 'year', 'dev_number', 'created_by', 'created_by_user',
             'owner_plant', 'affected_plant', 'sbu', 'release_date', 'effectivity_date', 'expiration_date',
             'drawing_number', 'back_to_back_deviation', 'defect_category',
-            'assembly_defect_type', 'molding_defect_type', 'actions', 'attachment',
+            'assembly_defect_type', 'molding_defect_type', 'actions', 'attachment', 'attachment_preview',
             'deviation_status',
-            'completion_percentage'
+            'completion_percentage',
+            'version',
         ]
         lookup_field = 'dev_number'
 
+    def validate_dev_number(self, value):
+        # Archived numbers stay taken (see archive.py)
+        if ArchivedDeviation.objects.filter(dev_number=value).exists():
+            raise serializers.ValidationError('This DEV number belongs to an archived deviation; restore it instead.')
+        return value
+
     def get_deviation_status(self, obj):
         all_actions = obj.actions.all()
 
@@ -113,5 +145,158 @@ class DeviationSerializer(serializers.ModelSerializer):
 
         done_actions = all_actions.filter(status="Done").count()
 
-        percentage = (done_actions / total_actions) * 100
-        return round(percentage)
\ No newline at end of file
+        return percent_done(done_actions, total_actions) # Same rounding as the SQL rollups
+
+    def get_attachment_preview(self, obj):
+        """Thumbnail URL (None for files without one), page count and size; None until rendered."""
+        preview = obj.attachment_preview # select_related by the views
+        if preview is None:
+            return None
+        url = None
+        if preview.thumbnail:
+            path = reverse('attachment-preview', kwargs={'dev_number': obj.dev_number}) + f'?v={version_tag(preview)}'
+            request = self.context.get('request')
+            url = request.build_absolute_uri(path) if request else path
+        return {
+            'url': url,
+            'page_count': preview.page_count,
+            'file_size': preview.file_size,
+            'width': preview.width,
+            'height': preview.height,
+        }
+
+
+class HotAndArchivedListSerializer(TimedListSerializer):
+    """Serializes a list mixing deviations and archived deviations (`?include_archived=true`), each with its serializer."""
+
+    def to_representation(self, data):
+        hot = DeviationSerializer(context=self.context)
+        return [(self.child if isinstance(item, ArchivedDeviation) else hot).to_representation(item) for item in data]
+
+
+class ArchivedDeviationSerializer(DeviationSerializer):
+    """An archived deviation (read-only): DeviationSerializer's fields plus `archived_at`."""
+
+    class Meta(DeviationSerializer.Meta):
+        model = ArchivedDeviation
+        list_serializer_class = HotAndArchivedListSerializer
+        fields = DeviationSerializer.Meta.fields + ['archived_at']
+
+
+class DeviationPreviewSerializer(DeviationSerializer):
+    """
+    Deviation with only its first actions embedded (`?actions_limit=` on the detail
+    endpoint) plus per-status action counts. Expects a deviation annotated by
+    reports.annotate_deviation_status and the actions in context['preview_actions'].
+    """
+    actions = serializers.SerializerMethodField()
+    action_counts = serializers.SerializerMethodField()
+    actions_next = serializers.SerializerMethodField()
+
+    class Meta(DeviationSerializer.Meta):
+        fields = DeviationSerializer.Meta.fields + ['action_counts', 'actions_next']
+
+    def get_actions(self, obj):
+        return ActionSerializer(self.context['preview_actions'], many=True, context=self.context).data
+
+    def get_action_counts(self, obj):
+        return {
+            'total': obj.action_count,
+            'Not Started': obj.action_count - obj.started_count,
+            'In Progress': obj.started_count - obj.done_count,
+            'Done': obj.done_count,
+        }
+
+    def get_actions_next(self, obj):
+        """URL of the next page of actions (keyset on `order`), None when all are embedded."""
+        actions = self.context['preview_actions']
+        if len(actions) >= obj.action_count:
+            return None
+        path = reverse('action-list-create', kwargs={'dev_number': obj.dev_number})
+        if actions:
+            path += f'?after={actions[-1].order}'
+        request = self.context.get('request')
+        return request.build_absolute_uri(path) if request else path
+
+    def get_deviation_status(self, obj):
+        return obj.deviation_status
+
+    def get_completion_percentage(self, obj):
+        return obj.completion_percentage
+
+
+class DeviationChangeSerializer(DeviationSerializer):
+    """Deviation payload for the change feed: everything but the nested actions (those come as their own changes)."""
+
+    class Meta(DeviationSerializer.Meta):
+        fields = [field for field in DeviationSerializer.Meta.fields if field != 'actions']
+
+
+class ActionUpsertSerializer(serializers.ModelSerializer):
+    """An action of a DeviationUpsertSerializer item; numbered in the order given."""
+
+    class Meta:
+        model = Action
+        fields = ['action_description', 'action_responsible', 'action_expiration_date', 'status', 'reminder_sent']
+
+
+class DeviationUpsertSerializer(serializers.ModelSerializer):
+    """
+    Validates one item of POST /api/deviations/bulk_upsert (written by bulk.upsert_deviations,
+    never saved through this serializer). Fields left out are not touched on existing
+    deviations; `actions`, if given, replace the deviation's actions; `version` is the
+    version the item is based on. No per-item queries, so thousands validate quickly.
+    """
+    dev_number = serializers.CharField(max_length=100) # The upsert key: no uniqueness check
+    version = serializers.IntegerField(required=False, min_value=1)
+    actions = ActionUpsertSerializer(many=True, required=False)
+
+    class Meta:
+        model = Deviation
+        fields = [
+            'primary_column', 'year', 'dev_number', 'created_by', 'owner_plant', 'affected_plant', 'sbu',
+            'release_date', 'effectivity_date', 'expiration_date', 'drawing_number', 'back_to_back_deviation',
+            'defect_category', 'assembly_defect_type', 'molding_defect_type', 'version', 'actions',
+        ]
+
+
+class JobSerializer(TimedDataMixin, serializers.ModelSerializer):
+    """Background job; while running, progress/counts come from the worker's live state."""
+    created_by = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    result_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        list_serializer_class = TimedListSerializer
+        fields = ['id', 'kind', 'status', 'params', 'progress', 'counts', 'error', 'created_by',
+                  'created_at', 'started_at', 'finished_at', 'result_url']
+        read_only_fields = [field for field in fields if field not in ('kind', 'params')]
+
+    def get_result_url(self, obj):
+        if not obj.result_file:
+            return None
+        request = self.context.get('request')
+        path = reverse('job-result', kwargs={'job_id': obj.pk})
+        return request.build_absolute_uri(path) if request else path
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.status == Job.RUNNING:
+            state = live_state(instance.pk)
+            if state:
+                data['progress'], data['counts'] = state['progress'], state['counts']
+        return data
+
+
+class JobDetailSerializer(JobSerializer):
+    """Single job, with its log."""
+    log = serializers.SerializerMethodField()
+
+    class Meta(JobSerializer.Meta):
+        fields = JobSerializer.Meta.fields + ['log']
+
+    def get_log(self, obj):
+        if obj.status == Job.RUNNING:
+            state = live_state(obj.pk)
+            return state['log'] if state else obj.log
+        return obj.log
@@ -0,0 +1,73 @@
+# deviation_tracker_app/deviation_backend/deviations/signals.py
+#
+# Feeds the change log (see changes.py) and the near-duplicate index (see
+# similarity.py) from single-object ORM writes, queues attachment previews (see
+# previews.py) and keeps the authenticated-user cache (see authentication.py) fresh.
+# Connected in DeviationsConfig.ready().
+
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .changes import record_action_changes, record_change
+from .models import Action, ChangeLogEntry, Deviation
+from .previews import schedule_previews
+from .similarity import schedule_index
+
+
+@receiver(post_save, sender=Deviation, dispatch_uid='changelog_deviation_saved')
+def deviation_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return # loaddata
+    operation = ChangeLogEntry.CREATE if created else ChangeLogEntry.UPDATE
+    record_change(ChangeLogEntry.DEVIATION, instance.pk, operation, instance.pk)
+    schedule_index(instance.pk)
+    schedule_previews(instance)
+
+
+@receiver(post_delete, sender=Deviation, dispatch_uid='changelog_deviation_deleted')
+def deviation_deleted(sender, instance, **kwargs):
+    record_change(ChangeLogEntry.DEVIATION, instance.pk, ChangeLogEntry.DELETE, instance.pk)
+
+
+@receiver(post_save, sender=Action, dispatch_uid='changelog_action_saved')
+def action_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    operation = ChangeLogEntry.CREATE if created else ChangeLogEntry.UPDATE
+    record_change(ChangeLogEntry.ACTION, instance.pk, operation, instance.deviation_id)
+    if update_fields is None or 'action_description' in update_fields: # Status/order-only saves keep the text
+        schedule_index(instance.deviation_id)
+
+
+@receiver(post_delete, sender=Action, dispatch_uid='changelog_action_deleted')
+def action_deleted(sender, instance, **kwargs):
+    record_change(ChangeLogEntry.ACTION, instance.pk, ChangeLogEntry.DELETE, instance.deviation_id)
+    schedule_index(instance.deviation_id)
+
+
+@receiver(m2m_changed, sender=Action.action_responsible_users.through, dispatch_uid='changelog_responsibles_changed')
+def responsible_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # action.action_responsible_users.add/remove/set/clear(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            record_change(ChangeLogEntry.ACTION, instance.pk, ChangeLogEntry.UPDATE, instance.deviation_id)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        # user.actions_responsible_multi.add/remove(...): pk_set holds action ids
+        record_action_changes(pk_set)
+    elif action == 'pre_clear':
+        # user.actions_responsible_multi.clear(): the action ids are gone after the clear
+        record_action_changes(list(instance.actions_responsible_multi.values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=User, dispatch_uid='auth_cache_user_saved')
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return # Login bookkeeping (UPDATE_LAST_LOGIN), nothing the cached copy needs
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='auth_cache_user_deleted')
+def user_deleted(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
@@ -0,0 +1,285 @@
+# deviation_tracker_app/deviation_backend/deviations/similarity.py
+#
+# Near-duplicate deviations: the same defect raised again, often by another plant,
+# with the same drawing number family, defect fields and near-identical actions.
+#
+# Each deviation's text is cut into shingles (drawing numbers and their family,
+# defect category/types, word pairs of the action descriptions) and summarised by
+# a MinHash signature of NUM_PERM values: the share of equal values between two
+# signatures estimates the Jaccard similarity of their shingle sets. The signature
+# is split into BANDS bands of ROWS values, and each band is hashed to one key in
+# SimilarityBucket (indexed). Deviations sharing any key are the candidates, so
+# finding the neighbours of one deviation reads its BANDS keys and the few rows
+# that share them instead of comparing it with every other deviation. With
+# 32 bands of 4 rows, pairs above ~0.5 similarity are found with >95% probability.
+#
+# The index follows writes: saving a deviation or an action (API, admin, imports)
+# adds the deviation to an `index_similarity` background job when the transaction
+# commits (see signals.py; the Excel import schedules its deviations itself), so
+# requests never pay for the MinHash. Paths that bypass both (bulk_create in
+# seed_load_data) are caught up with
+# `python manage.py find_duplicate_deviations --reindex`, which also reports clusters.
+
+import hashlib
+import logging
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .db import serialized_write
+from .models import Action, Deviation, Job, SimilarityBucket, SimilaritySignature
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+INDEX_VERSION = 1 # Part of every digest: bump when the shingling or the constants above change
+BATCH_SIZE = 500 # Deviations indexed per step
+MAX_BUCKET_SIZE = 1000 # Larger buckets (shared boilerplate) are left out of the clusters report
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed: stored signatures must keep meaning the same permutations
+_permutations = np.random.RandomState(1).randint(1, (1 << 61) - 1, size=(2, NUM_PERM), dtype=np.uint64)
+PERM_A, PERM_B = _permutations[0], _permutations[1]
+
+BUCKET_INSERT = 'INSERT INTO {} ({}, {}) VALUES (%s, %s)'.format(
+    SimilarityBucket._meta.db_table, SimilarityBucket._meta.get_field('deviation').column,
+    SimilarityBucket._meta.get_field('key').column)
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+DRAWING_RE = re.compile(r'[A-Za-z0-9-]+')
+
+
+def threshold():
+    return getattr(settings, 'SIMILARITY_THRESHOLD', 0.5)
+
+
+def drawing_family(drawing):
+    """177455 -> 1774: numbers drawn up together share all but their last two digits."""
+    digits = drawing.replace('-', '')
+    return drawing[:-2] if digits.isdigit() and len(digits) >= 5 else drawing
+
+
+def shingles(deviation, descriptions):
+    """The shingle set of a deviation (a dict of its fields) and its action descriptions."""
+    result = set()
+    for drawing in DRAWING_RE.findall(deviation.get('drawing_number') or ''):
+        drawing = drawing.lower()
+        result.add(f'drawing:{drawing}')
+        result.add(f'family:{drawing_family(drawing)}')
+    for field in ('defect_category', 'assembly_defect_type', 'molding_defect_type'):
+        value = (deviation.get(field) or '').strip().lower()
+        if value:
+            result.add(f'{field}:{value}')
+    for description in descriptions:
+        words = WORD_RE.findall(description.lower())
+        if len(words) == 1:
+            result.add(f'text:{words[0]}')
+        result.update(f'text:{first} {second}' for first, second in zip(words, words[1:]))
+    return result
+
+
+def signature(shingle_set):
+    """MinHash signature (NUM_PERM uint32 values) of a non-empty shingle set."""
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'little')
+                       for shingle in shingle_set], dtype=np.uint64)
+    # uint64 products wrap around like in the usual MinHash implementations; the low 32 bits are kept
+    permuted = ((np.outer(PERM_A, hashes) + PERM_B[:, None]) % MERSENNE_PRIME) & MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def band_keys(minhash):
+    """One signed 64-bit key per band (BANDS of them)."""
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + minhash[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                       digest_size=8).digest(), 'little', signed=True)
+        for band in range(BANDS)
+    ]
+
+
+def digest(shingle_set):
+    text = '\n'.join([str(INDEX_VERSION), *sorted(shingle_set)])
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def estimated_similarity(first, second):
+    return float(np.mean(first == second))
+
+
+def _shingle_sets(deviation_ids):
+    fields = ('id', 'drawing_number', 'defect_category', 'assembly_defect_type', 'molding_defect_type')
+    descriptions = defaultdict(list)
+    for deviation_id, description in Action.objects.filter(deviation_id__in=deviation_ids).order_by() \
+            .values_list('deviation_id', 'action_description'):
+        descriptions[deviation_id].append(description)
+    return {row['id']: shingles(row, descriptions[row['id']])
+            for row in Deviation.objects.filter(pk__in=deviation_ids).order_by().values(*fields)}
+
+
+def index_deviations(deviation_ids, batch_size=BATCH_SIZE):
+    """
+    (Re)indexes the given deviations. Deviations whose shingles did not change since
+    they were indexed are skipped; ones without any text are left out of the index.
+    Returns the number of deviations whose index entries were written.
+    """
+    deviation_ids = list(deviation_ids)
+    written = 0
+    for start in range(0, len(deviation_ids), batch_size):
+        batch = deviation_ids[start:start + batch_size]
+        sets = _shingle_sets(batch)
+        with serialized_write(), transaction.atomic():
+            stored = dict(SimilaritySignature.objects.filter(deviation_id__in=batch).values_list('deviation_id', 'digest'))
+            changed = {pk: shingle_set for pk, shingle_set in sets.items() if stored.get(pk) != digest(shingle_set)}
+            stale = [pk for pk in changed if pk in stored]
+            SimilarityBucket.objects.filter(deviation_id__in=stale).delete()
+            SimilaritySignature.objects.filter(deviation_id__in=stale).delete()
+
+            signatures, buckets = [], []
+            for pk, shingle_set in changed.items():
+                if not shingle_set:
+                    continue
+                minhash = signature(shingle_set)
+                signatures.append(SimilaritySignature(
+                    deviation_id=pk, minhash=minhash.tobytes(), digest=digest(shingle_set),
+                    shingle_count=len(shingle_set)))
+                buckets.extend((pk, key) for key in band_keys(minhash))
+            SimilaritySignature.objects.bulk_create(signatures, batch_size=5000)
+            # BANDS rows per deviation: a plain executemany, bulk_create's per-object overhead dominated indexing
+            with connection.cursor() as cursor:
+                cursor.executemany(BUCKET_INSERT, buckets)
+            written += len(changed)
+    return written
+
+
+# Deviations saved in this thread whose index is refreshed once the transaction commits
+_pending = threading.local()
+
+
+def queue_index(deviation_ids):
+    """Adds the deviations to the waiting `index_similarity` job, queueing one if there is none."""
+    from .jobs import enqueue # jobs.py imports this module
+
+    with serialized_write(), transaction.atomic():
+        job = Job.objects.filter(kind=Job.INDEX_SIMILARITY, status=Job.QUEUED).order_by('id').first()
+        if job is None:
+            enqueue(Job.INDEX_SIMILARITY, params={'deviation_ids': sorted(deviation_ids)})
+        else:
+            job.params['deviation_ids'] = sorted(set(job.params.get('deviation_ids', [])) | set(deviation_ids))
+            job.save(update_fields=['params'])
+
+
+def _flush_pending():
+    ids = getattr(_pending, 'ids', None)
+    if not ids:
+        return
+    _pending.ids = set()
+    queue_index(ids)
+
+
+def schedule_index(*deviation_ids):
+    """Queues the deviations for reindexing after the current transaction commits (right away outside one)."""
+    deviation_ids = [pk for pk in deviation_ids if pk is not None]
+    if not deviation_ids:
+        return
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.update(deviation_ids)
+    # One callback per call, so ids left over by a rolled back transaction still get flushed;
+    # the first callback to run takes all of them. robust: a failure must not fail the committed write.
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def _minhash(deviation):
+    row = SimilaritySignature.objects.filter(deviation=deviation).values_list('minhash', flat=True).first()
+    if row is not None:
+        return np.frombuffer(bytes(row), dtype=np.uint32), True
+    shingle_set = _shingle_sets([deviation.pk]).get(deviation.pk)
+    return (signature(shingle_set) if shingle_set else None), False
+
+
+def similar_deviations(deviation, min_similarity=None, limit=10):
+    """
+    [(deviation_id, estimated similarity)] of the deviations sharing an LSH bucket with
+    `deviation` and at least `min_similarity` alike, most similar first. Also returns
+    whether the deviation itself was indexed (if not, its signature is computed on the fly).
+    """
+    min_similarity = threshold() if min_similarity is None else min_similarity
+    minhash, indexed = _minhash(deviation)
+    if minhash is None:
+        return [], indexed
+    candidates = SimilarityBucket.objects.filter(key__in=band_keys(minhash)).exclude(deviation_id=deviation.pk) \
+        .values_list('deviation_id', flat=True).distinct()
+    found = []
+    for pk, other in SimilaritySignature.objects.filter(deviation_id__in=candidates).values_list('deviation_id', 'minhash'):
+        similarity = estimated_similarity(minhash, np.frombuffer(bytes(other), dtype=np.uint32))
+        if similarity >= min_similarity:
+            found.append((pk, similarity))
+    found.sort(key=lambda item: (-item[1], item[0]))
+    return found[:limit], indexed
+
+
+def duplicate_clusters(min_similarity=None, max_bucket_size=MAX_BUCKET_SIZE):
+    """
+    Groups of deviations (lists of ids, largest group first) linked by pairs at least
+    `min_similarity` alike. Only deviations sharing a bucket with another one are compared,
+    each pair once, and not at all once both are in the same group. Buckets of more than
+    `max_bucket_size` members are skipped.
+    """
+    min_similarity = threshold() if min_similarity is None else min_similarity
+    shared_keys = SimilarityBucket.objects.order_by().values('key').annotate(members=Count('id')) \
+        .filter(members__gt=1).values('key')
+    buckets = defaultdict(list)
+    for key, pk in SimilarityBucket.objects.filter(key__in=shared_keys).order_by('key', 'deviation_id') \
+            .values_list('key', 'deviation_id').iterator(chunk_size=10000):
+        buckets[key].append(pk)
+
+    minhashes = {}
+    members = sorted({pk for ids in buckets.values() for pk in ids})
+    for start in range(0, len(members), BATCH_SIZE):
+        for pk, minhash in SimilaritySignature.objects.filter(deviation_id__in=members[start:start + BATCH_SIZE]) \
+                .values_list('deviation_id', 'minhash'):
+            minhashes[pk] = np.frombuffer(bytes(minhash), dtype=np.uint32)
+
+    parent = {}
+
+    def find(pk):
+        parent.setdefault(pk, pk)
+        while parent[pk] != pk:
+            parent[pk] = parent[parent[pk]]
+            pk = parent[pk]
+        return pk
+
+    scored, oversized = set(), 0
+    for ids in buckets.values():
+        ids = [pk for pk in ids if pk in minhashes] # Ascending, so each pair is (smaller, larger)
+        if len(ids) < 2:
+            continue
+        if len(ids) > max_bucket_size:
+            oversized += 1
+            continue
+        matrix = np.stack([minhashes[pk] for pk in ids])
+        for i, pk in enumerate(ids[:-1]):
+            # Pairs already scored in another band, or already linked, need no score
+            others = [j for j in range(i + 1, len(ids))
+                      if (pk, ids[j]) not in scored and find(pk) != find(ids[j])]
+            if not others:
+                continue
+            scored.update((pk, ids[j]) for j in others)
+            scores = (matrix[others] == matrix[i]).mean(axis=1)
+            for j, score in zip(others, scores):
+                if score >= min_similarity:
+                    parent[find(ids[j])] = find(pk)
+    if oversized:
+        logger.warning('Skipped %d bucket(s) of more than %d deviations.', oversized, max_bucket_size)
+
+    clusters = defaultdict(list)
+    for pk in parent:
+        clusters[find(pk)].append(pk)
+    return sorted((sorted(ids) for ids in clusters.values() if len(ids) > 1), key=lambda ids: (-len(ids), ids[0]))
@@ -0,0 +1,225 @@
+# deviation_tracker_app/deviation_backend/deviations/snapshots.py
+#
+# Online snapshots of the SQLite database (`manage.py snapshot_db`, or a
+# `snapshot_db` job) and verified restores (`manage.py restore_db`).
+#
+# A snapshot copies the database with SQLite's online backup API a few hundred
+# pages at a time, pausing between steps. The source connection holds one read
+# transaction for the whole copy: in WAL mode writers carry on meanwhile, and the
+# backup sees a fixed view, so it is never restarted by their commits and its
+# duration only depends on the database size. The copy is integrity-checked,
+# gzipped and written next to a JSON manifest (checksum, row counts, migrations).
+# Only the newest SNAPSHOT_RETENTION snapshots are kept.
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+
+from .db import serialized_write
+from .models import Action, ChangeLogEntry, Deviation
+
+SNAPSHOT_SUFFIX = '.sqlite3.gz'
+COUNTED_MODELS = [Deviation, Action, ChangeLogEntry]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'SNAPSHOT_DIR', settings.BASE_DIR / 'snapshots'))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _describe(conn):
+    """Integrity check result, row counts and applied migrations of a raw sqlite3 connection."""
+    integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    rows = {model._meta.db_table: conn.execute(f'SELECT COUNT(*) FROM "{model._meta.db_table}"').fetchone()[0]
+            for model in COUNTED_MODELS}
+    migrations = sorted(f'{app}.{name}' for app, name in conn.execute('SELECT app, name FROM django_migrations'))
+    return integrity, rows, migrations
+
+
+def list_snapshots(directory=None):
+    """Manifests of the snapshots in `directory`, newest first."""
+    directory = Path(directory or snapshot_dir())
+    manifests = []
+    for path in sorted(directory.glob(f'*{SNAPSHOT_SUFFIX}'), reverse=True):
+        manifest_path = path.with_name(path.name[:-len(SNAPSHOT_SUFFIX)] + '.json')
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        manifests.append({**manifest, 'file': path.name, 'path': str(path), 'compressed_bytes': path.stat().st_size})
+    return manifests
+
+
+def prune_snapshots(keep, directory=None):
+    """Deletes all but the newest `keep` snapshots. Returns the deleted file names."""
+    deleted = []
+    for snapshot in list_snapshots(directory)[keep:]:
+        path = Path(snapshot['path'])
+        path.unlink()
+        path.with_name(snapshot['file'][:-len(SNAPSHOT_SUFFIX)] + '.json').unlink(missing_ok=True)
+        deleted.append(snapshot['file'])
+    return deleted
+
+
+def snapshot_database(directory=None, keep=None, alias='default', pages_per_step=None, step_sleep=None,
+                      progress=None):
+    """
+    Writes a compressed, verified snapshot of database `alias` and prunes old ones.
+    `progress(done_pages, total_pages)` is called after every backup step.
+    Returns the manifest.
+    """
+    directory = Path(directory or snapshot_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    keep = keep if keep is not None else getattr(settings, 'SNAPSHOT_RETENTION', 7)
+    pages_per_step = pages_per_step or getattr(settings, 'SNAPSHOT_PAGES_PER_STEP', 512)
+    step_sleep = getattr(settings, 'SNAPSHOT_STEP_SLEEP', 0.01) if step_sleep is None else step_sleep
+
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        raise SnapshotError('Snapshots need the SQLite backend.')
+    if connection.in_atomic_block:
+        raise SnapshotError('Cannot snapshot from inside a transaction.') # The backup would wait on itself
+    connection.ensure_connection()
+    source = connection.connection
+    name = f'snapshot-{datetime.now():%Y%m%d-%H%M%S-%f}'
+    start = time.perf_counter()
+
+    def step(status, remaining, total):
+        if progress is not None:
+            progress(total - remaining, total)
+        if remaining:
+            time.sleep(step_sleep) # Let other connections have the disk between steps
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        copy_path = Path(workdir) / f'{name}.sqlite3'
+        target = sqlite3.connect(copy_path)
+        try:
+            source.execute('BEGIN DEFERRED')
+            source.execute('SELECT 1 FROM django_migrations LIMIT 1') # Starts the read transaction
+            source.backup(target, pages=pages_per_step, progress=step)
+        finally:
+            if source.in_transaction:
+                source.execute('COMMIT')
+        try:
+            target.execute('PRAGMA journal_mode=DELETE') # Self-contained file, no -wal next to it
+            integrity, rows, migrations = _describe(target)
+        finally:
+            target.close()
+        if integrity != 'ok':
+            raise SnapshotError(f'The copy failed its integrity check: {integrity}')
+
+        manifest = {
+            'name': name,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'bytes': copy_path.stat().st_size,
+            'sha256': _sha256(copy_path),
+            'rows': rows,
+            'migrations': migrations,
+            'seconds': None,
+        }
+        partial = directory / f'{name}{SNAPSHOT_SUFFIX}.partial'
+        with open(copy_path, 'rb') as raw, gzip.open(partial, 'wb', compresslevel=6) as compressed:
+            shutil.copyfileobj(raw, compressed, 1 << 20)
+        os.replace(partial, directory / f'{name}{SNAPSHOT_SUFFIX}')
+
+    manifest['seconds'] = round(time.perf_counter() - start, 3)
+    (directory / f'{name}.json').write_text(json.dumps(manifest, indent=2))
+    manifest['pruned'] = prune_snapshots(keep, directory)
+    return manifest
+
+
+def resolve_snapshot(name_or_path, directory=None):
+    """A snapshot file from a path, a file name or a manifest name ('latest' for the newest)."""
+    directory = Path(directory or snapshot_dir())
+    if name_or_path == 'latest':
+        snapshots = list_snapshots(directory)
+        if not snapshots:
+            raise SnapshotError(f'No snapshots in {directory}.')
+        return Path(snapshots[0]['path'])
+    for candidate in (Path(name_or_path), directory / name_or_path, directory / f'{name_or_path}{SNAPSHOT_SUFFIX}'):
+        if candidate.is_file():
+            return candidate
+    raise SnapshotError(f'Snapshot "{name_or_path}" not found.')
+
+
+def verify_snapshot(path, workdir):
+    """
+    Decompresses snapshot `path` into `workdir` and checks it against its manifest
+    and the migrations in the code. Returns (database path, manifest, pending migrations).
+    """
+    path = Path(path)
+    manifest_path = path.with_name(path.name[:-len(SNAPSHOT_SUFFIX)] + '.json')
+    if not manifest_path.exists():
+        raise SnapshotError(f'Manifest {manifest_path.name} is missing.')
+    manifest = json.loads(manifest_path.read_text())
+
+    database = Path(workdir) / 'restore.sqlite3'
+    try:
+        with gzip.open(path, 'rb') as compressed, open(database, 'wb') as raw:
+            shutil.copyfileobj(compressed, raw, 1 << 20)
+    except (OSError, EOFError) as e: # Truncated file or CRC error
+        raise SnapshotError(f'Cannot decompress {path.name}: {e}')
+    if _sha256(database) != manifest['sha256']:
+        raise SnapshotError('Checksum mismatch, the snapshot is corrupt.')
+
+    conn = sqlite3.connect(database)
+    try:
+        integrity, rows, migrations = _describe(conn)
+    finally:
+        conn.close()
+    if integrity != 'ok':
+        raise SnapshotError(f'Integrity check failed: {integrity}')
+    if rows != manifest['rows']:
+        raise SnapshotError(f'Row counts {rows} do not match the manifest {manifest["rows"]}.')
+
+    known = {f'{app}.{name}' for app, name in MigrationLoader(None, ignore_no_migrations=True).disk_migrations}
+    unknown = sorted(set(migrations) - known)
+    if unknown:
+        raise SnapshotError(f'The snapshot has migrations this code does not know: {", ".join(unknown)}')
+    return database, manifest, sorted(known - set(migrations))
+
+
+def restore_database(path, alias='default'):
+    """
+    Verifies snapshot `path` and copies it over database `alias` in one backup step
+    (a single write transaction, so readers see either the old or the restored data).
+    Returns (manifest, pending migrations).
+    """
+    connection = connections[alias]
+    if connection.in_atomic_block:
+        raise SnapshotError('Cannot restore from inside a transaction.')
+    with tempfile.TemporaryDirectory() as workdir:
+        database, manifest, pending = verify_snapshot(path, workdir)
+        source = sqlite3.connect(database)
+        try:
+            with serialized_write():
+                connection.ensure_connection()
+                source.backup(connection.connection)
+        finally:
+            source.close()
+
+    integrity, rows, _ = _describe(connection.connection)
+    if integrity != 'ok' or rows != manifest['rows']:
+        raise SnapshotError(f'Restored database does not match the snapshot (integrity: {integrity}, rows: {rows}).')
+    caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')].clear() # Users may have changed
+    return manifest, pending
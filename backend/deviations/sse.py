@@ -0,0 +1,169 @@
+# deviation_tracker_app/deviation_backend/deviations/sse.py
+#
+# Server-Sent Events endpoint, mounted in front of Django by deviation_backend/asgi.py:
+#
+#   GET /api/events/?token=<JWT access token>&deviations=DEV24-0439,DEV25-0003
+#   GET /api/events/?token=<JWT access token>&mine=true
+#
+# Without `deviations`/`mine` the client receives events for every deviation.
+# EventSource cannot send an Authorization header, hence the `token` parameter
+# (a normal `Authorization: Bearer` header is accepted too). Reconnecting
+# clients send `Last-Event-ID` and get the events they missed replayed from
+# the change log.
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .events import Subscription, entry_to_event, get_broker, with_versions
+
+HEARTBEAT_SECONDS = 15
+MAX_REPLAY = 1000
+
+
+def _db(func):
+    """Runs ORM code off the event loop and tidies up the thread's connection afterwards."""
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=True)
+
+
+@_db
+def authenticate(raw_token):
+    from rest_framework.exceptions import APIException
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    from .authentication import CachedJWTAuthentication
+
+    if not raw_token:
+        return None
+    auth = CachedJWTAuthentication()
+    try:
+        user = auth.get_user(auth.get_validated_token(raw_token.encode()))
+    except (InvalidToken, TokenError, APIException):
+        return None
+    return user if user.is_active else None
+
+
+@_db
+def resolve_deviation_ids(user, dev_numbers, mine):
+    from .models import Deviation
+    if not dev_numbers and not mine:
+        return None # Everything
+    query = Q(dev_number__in=dev_numbers) if dev_numbers else Q(pk__in=[])
+    if mine:
+        query |= Q(created_by_user=user) | Q(actions__action_responsible_users=user)
+    return set(Deviation.objects.filter(query).values_list('id', flat=True).distinct())
+
+
+@_db
+def missed_events(since, deviation_ids):
+    from .models import ChangeLogEntry
+    entries = ChangeLogEntry.objects.filter(id__gt=since).order_by('id')
+    if deviation_ids is not None:
+        entries = entries.filter(deviation_id__in=deviation_ids)
+    return with_versions([entry_to_event(entry) for entry in entries[:MAX_REPLAY]])
+
+
+def format_event(event):
+    if event.get('op') == 'resync':
+        return b'event: resync\ndata: {}\n\n'
+    return f"id: {event['cursor']}\nevent: change\ndata: {json.dumps(event)}\n\n".encode()
+
+
+async def _send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+async def event_stream(scope, receive, send):
+    params = parse_qs(scope.get('query_string', b'').decode())
+    headers = {name.decode().lower(): value.decode() for name, value in scope.get('headers', [])}
+
+    token = params.get('token', [None])[0]
+    if token is None and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    user = await authenticate(token)
+    if user is None:
+        await _send_error(send, 401, 'Authentication credentials were not provided or are invalid.')
+        return
+
+    dev_numbers = [n for n in ','.join(params.get('deviations', [])).split(',') if n]
+    mine = params.get('mine', ['false'])[0].lower() == 'true'
+    deviation_ids = await resolve_deviation_ids(user, dev_numbers, mine)
+
+    subscription = Subscription(asyncio.get_running_loop(), deviation_ids)
+    broker = get_broker()
+    broker.subscribe(subscription) # Subscribe before replaying so nothing falls in between
+
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'), # Tell nginx not to buffer the stream
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+        last_event_id = headers.get('last-event-id') or params.get('since', [None])[0]
+        replayed_up_to = 0
+        if last_event_id and last_event_id.isdigit():
+            for event in await missed_events(int(last_event_id), deviation_ids):
+                await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+                replayed_up_to = event['cursor']
+
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            while not disconnected.done():
+                next_event = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait({next_event, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if next_event in done:
+                    event = next_event.result()
+                    if event.get('cursor', replayed_up_to + 1) <= replayed_up_to:
+                        continue # Already sent during the replay
+                    body = format_event(event)
+                else:
+                    next_event.cancel()
+                    if disconnected.done():
+                        break
+                    body = b': keep-alive\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            disconnected.cancel()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except OSError:
+        pass # Client went away mid-write
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class EventStreamRouter:
+    """ASGI app that serves /api/events/ itself and hands every other request to Django."""
+
+    def __init__(self, django_application, path='/api/events/'):
+        self.django_application = django_application
+        self.paths = {path, path.rstrip('/')}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in self.paths:
+            if scope['method'] != 'GET':
+                await _send_error(send, 405, f'Method "{scope["method"]}" not allowed.')
+                return
+            await event_stream(scope, receive, send)
+            return
+        await self.django_application(scope, receive, send)
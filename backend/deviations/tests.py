@@ -1,3 +1,2049 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import urls as deviation_urls
+from .analytics import list_files, load_table, read_state, snapshot_analytics
+from .archive import archive_deviations
+from .authentication import user_cache, user_cache_key
+from .benchmarks import benchmark_throttle, compare, run_benchmarks
+from .db import (
+    READ_DATABASE_ALIAS, ReadWriteRouter, WriteQueue, apply_sqlite_pragmas, get_sqlite_pragmas,
+    read_only_request, write_queue,
+)
+from .changes import latest_cursor
+from .coalescing import SingleFlight, coalescing_key, flights
+from .events import InProcessBackend, Subscription, reset_broker
+from .instrumentation import registry
+from .jobs import JobContext, claim_next_job, fail_stale_jobs
+from .profiling import SamplingProfiler, list_profiles
+from .reports import annotate_deviation_status
+from .responsibles import split_names
+from .excel_data_manager import import_workbooks
+from .similarity import duplicate_clusters, estimated_similarity, index_deviations, shingles, signature
+from .snapshots import SnapshotError, list_snapshots, snapshot_database, verify_snapshot
+from .sse import EventStreamRouter
+from .throttling import TokenBuckets, buckets as throttle_buckets
+from .models import (
+    ArchivedAction, ArchivedDeviation, AttachmentPreview, Deviation, Action, ChangeLogEntry, DevNumberCounter, Job, SimilarityBucket, SimilaritySignature,
+    parse_dev_number,
+)
+from .numbering import allocate_dev_number
+from .previews import render_previews
+from .serializers import DeviationSerializer
+from .views import DeviationListCreateAPIView
+
+
+def setUpModule():
+    # Keep the per-request JSON log lines out of the test output.
+    logging.getLogger('deviations.requests').setLevel(logging.WARNING)
+
+
+def tearDownModule():
+    logging.getLogger('deviations.requests').setLevel(logging.NOTSET)
+
+
+class WriteQueueTests(SimpleTestCase):
+    def test_writers_run_in_arrival_order(self):
+        queue = WriteQueue()
+        order = []
+        queue.acquire()
+
+        def writer(n):
+            with queue():
+                order.append(n)
+
+        threads = []
+        for n in range(5):
+            thread = threading.Thread(target=writer, args=(n,))
+            thread.start()
+            threads.append(thread)
+            while queue.pending < n + 2: # Wait until this writer holds a ticket
+                time.sleep(0.001)
+        queue.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    def test_same_thread_can_reenter(self):
+        queue = WriteQueue()
+        with queue():
+            with queue():
+                self.assertEqual(queue.pending, 1)
+        self.assertEqual(queue.pending, 0)
+
+    def test_timed_out_writer_does_not_block_the_next_one(self):
+        queue = WriteQueue()
+        queue.acquire()
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault('got', queue.acquire(timeout=0.05)))
+        thread.start()
+        thread.join()
+        self.assertFalse(result['got'])
+        queue.release()
+        self.assertTrue(queue.acquire(timeout=0.5))
+        queue.release()
+
+
+class ReadWriteRouterTests(TestCase):
+    def test_reads_stay_on_default_outside_read_only_requests(self):
+        self.assertIsNone(ReadWriteRouter().db_for_read(Deviation))
+
+    def test_reads_stay_on_default_inside_a_transaction(self):
+        # TestCase wraps every test in a transaction on 'default'.
+        with read_only_request():
+            self.assertIsNone(ReadWriteRouter().db_for_read(Deviation))
+
+    def test_read_only_request_uses_read_connection(self):
+        default = connections['default']
+        in_atomic_block = default.in_atomic_block
+        default.in_atomic_block = False
+        try:
+            with read_only_request():
+                self.assertEqual(ReadWriteRouter().db_for_read(Deviation), READ_DATABASE_ALIAS)
+        finally:
+            default.in_atomic_block = in_atomic_block
+
+    def test_writes_always_go_to_default(self):
+        with read_only_request():
+            self.assertEqual(ReadWriteRouter().db_for_write(Deviation), 'default')
+
+
+class ConcurrentReadDuringImportTests(SimpleTestCase):
+    """Parallel readers keep working while a long import holds the write lock."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        conn = self._connect()
+        conn.execute('CREATE TABLE deviation (id INTEGER PRIMARY KEY, dev_number TEXT)')
+        conn.executemany('INSERT INTO deviation (dev_number) VALUES (?)', [(f'DEV24-{i:04d}',) for i in range(100)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def _connect(self, alias=None):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        apply_sqlite_pragmas(conn.cursor(), get_sqlite_pragmas(alias))
+        return conn
+
+    def test_readers_are_not_blocked_by_import(self):
+        queue = WriteQueue()
+        import_started = threading.Event()
+        import_committing = threading.Event()
+        import_finished = threading.Event()
+        errors = []
+        reads_during_import = []
+
+        def long_import():
+            conn = self._connect()
+            with queue():
+                conn.execute('BEGIN IMMEDIATE')
+                import_started.set()
+                for i in range(100, 150):
+                    conn.execute('INSERT INTO deviation (dev_number) VALUES (?)', (f'DEV24-{i:04d}',))
+                    time.sleep(0.005)
+                import_committing.set()
+                conn.execute('COMMIT')
+            import_finished.set()
+            conn.close()
+
+        def reader():
+            conn = self._connect(READ_DATABASE_ALIAS)
+            import_started.wait()
+            try:
+                while not import_finished.is_set():
+                    count = conn.execute('SELECT COUNT(*) FROM deviation').fetchone()[0]
+                    if not import_committing.is_set():
+                        reads_during_import.append(count)
+            except sqlite3.OperationalError as exc:
+                errors.append(exc)
+            finally:
+                conn.close()
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        writer = threading.Thread(target=long_import)
+        writer.start()
+        writer.join()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(reads_during_import)
+        # Readers see the last committed snapshot, never a half-written import.
+        self.assertEqual(set(reads_during_import), {100})
+
+    def test_read_connection_is_query_only(self):
+        conn = self._connect(READ_DATABASE_ALIAS)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO deviation (dev_number) VALUES ('DEV24-9999')")
+        conn.close()
+
+    def test_connections_use_wal(self):
+        conn = self._connect()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        conn.close()
+
+
+class SeedLoadDataTests(TestCase):
+    def test_generates_numbered_deviations_with_ordered_actions(self):
+        call_command('seed_load_data', deviations=25, max_actions=5, users=4, seed=7, stdout=io.StringIO())
+
+        self.assertEqual(Deviation.objects.count(), 25)
+        self.assertEqual(User.objects.filter(username__startswith='loaduser').count(), 4)
+        for deviation in Deviation.objects.all():
+            self.assertRegex(deviation.dev_number, r'^DEV\d{2}-\d{4}$')
+            self.assertEqual(deviation.dev_number[3:5], f'{deviation.year % 100:02d}')
+            orders = list(deviation.actions.values_list('order', flat=True))
+            self.assertEqual(orders, list(range(1, len(orders) + 1)))
+        self.assertFalse(Action.objects.filter(action_responsible_users=None).exists())
+
+    def test_does_not_reuse_existing_dev_numbers(self):
+        Deviation.objects.create(dev_number='DEV24-0007', year=2024)
+        call_command('seed_load_data', deviations=3, max_actions=0, users=1, start_year=2024, end_year=2024,
+                     stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Deviation.objects.values_list('dev_number', flat=True)),
+            ['DEV24-0007', 'DEV24-0008', 'DEV24-0009', 'DEV24-0010'],
+        )
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('bench', 'bench@example.com', 'pw')
+        call_command('seed_load_data', deviations=5, min_actions=2, max_actions=4, users=2, seed=1, stdout=io.StringIO())
+
+    def test_every_deviation_endpoint_is_benchmarked(self):
+        report = run_benchmarks(iterations=2, include_import=False, include_throttle=False, username='bench',
+                                host='testserver')
+
+        benchmarked = {name.split(' ')[1].split('?')[0] for name in report['results']}
+        expected = {pattern.name for pattern in deviation_urls.urlpatterns}
+        self.assertEqual(benchmarked, expected)
+        for name, result in report['results'].items():
+            self.assertEqual(result['iterations'], 2)
+            if name not in ('GET current-user', 'GET metrics', 'GET analytics-list', 'GET analytics-file'):
+                # Served from the user cache / in-memory registry / analytics files
+                self.assertGreater(result['queries'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        # Benchmarked writes are rolled back.
+        self.assertEqual(Deviation.objects.count(), 5)
+        json.dumps(report)
+
+    def test_compare_reports_regressions(self):
+        baseline = {'results': {'GET x': {'p50_ms': 10, 'p95_ms': 20, 'queries': 5}}}
+        current = {'results': {'GET x': {'p50_ms': 11, 'p95_ms': 40, 'queries': 5}}}
+        self.assertEqual(compare(current, baseline, threshold_pct=20), [('GET x', 'p95_ms', 20, 40, 100.0)])
+
+
+class CompactActionOrdersTests(TestCase):
+    def setUp(self):
+        self.deviation = Deviation.objects.create(dev_number='DEV24-0439')
+        self.other = Deviation.objects.create(dev_number='DEV25-0003')
+        self.actions = [Action.objects.create(deviation=self.deviation, action_description=f'A{i}') for i in range(4)]
+        self.tidy = [Action.objects.create(deviation=self.other, action_description=f'B{i}') for i in range(2)]
+        # Drift: a delete leaves a hole, an import appended far past the end.
+        self.actions[1].delete()
+        Action.objects.filter(pk=self.actions[3].pk).update(order=40)
+
+    def _orders(self, deviation):
+        return list(Action.objects.filter(deviation=deviation).order_by('order').values_list('id', 'order'))
+
+    def test_renumbers_gaps_and_logs_the_changes(self):
+        cursor = ChangeLogEntry.objects.order_by('-id').first().pk
+        out = io.StringIO()
+        call_command('compact_action_orders', skip_vacuum=True, stdout=out)
+
+        self.assertIn('1 deviation(s) with gaps', out.getvalue())
+        self.assertEqual(self._orders(self.deviation),
+                         [(self.actions[0].pk, 1), (self.actions[2].pk, 2), (self.actions[3].pk, 3)])
+        self.assertEqual(self._orders(self.other), [(self.tidy[0].pk, 1), (self.tidy[1].pk, 2)])
+        logged = ChangeLogEntry.objects.filter(id__gt=cursor).values_list('object_id', flat=True)
+        self.assertEqual(sorted(logged), [self.actions[2].pk, self.actions[3].pk])
+        # Renumbered actions get a new version, so edits based on the old order conflict
+        versions = dict(Action.objects.values_list('id', 'version'))
+        self.assertEqual([versions[action.pk] for action in (self.actions[0], self.actions[2], self.actions[3])],
+                         [1, 2, 2])
+        self.assertEqual({versions[action.pk] for action in self.tidy}, {1})
+
+        out = io.StringIO()
+        call_command('compact_action_orders', skip_vacuum=True, stdout=out)
+        self.assertIn('Renumbered 0 action(s)', out.getvalue())
+
+    def test_dry_run_only_reports(self):
+        before = self._orders(self.deviation)
+        out = io.StringIO()
+        call_command('compact_action_orders', dry_run=True, stdout=out)
+        self.assertIn('1 deviation(s) with gaps', out.getvalue())
+        self.assertEqual(self._orders(self.deviation), before)
+
+
+class ResponsibleResolverTests(TestCase):
+    def setUp(self):
+        self.cooper = User.objects.create_user('jcooper', 'jcooper@rainbird.com', first_name='Jeffery', last_name='Cooper')
+        self.rivero = User.objects.create_user('jrivero', 'jrivero@rainbird.com', first_name='Jorge', last_name='Rivero')
+        self.castillo = User.objects.create_user('acastillo', 'acastillo@rainbird.com',
+                                                 first_name='Abdul', last_name='Ivan Castillo')
+        User.objects.create_user('lmontoya', 'lmontoya@rainbird.com', first_name='Luis', last_name='Montoya')
+        User.objects.create_user('lmontoya1', 'luis.montoya@rainbird.com', first_name='Luis', last_name='Montoya')
+        self.deviation = Deviation.objects.create(dev_number='DEV24-0439')
+
+    def _action(self, text):
+        return Action.objects.create(deviation=self.deviation, action_description='Fix', action_responsible=text)
+
+    def test_split_names(self):
+        self.assertEqual(split_names('Jorge Rivero / Jeffery Cooper'), ['Jorge Rivero', 'Jeffery Cooper'])
+        self.assertEqual(split_names('Cooper, Jeffery'), ['Jeffery Cooper'])
+        self.assertEqual(split_names('A. Castillo & J. Rivero; Luis Montoya'), ['A. Castillo', 'J. Rivero', 'Luis Montoya'])
+        self.assertEqual(split_names('Juan Perez y Maria Lopez'), ['Juan Perez', 'Maria Lopez'])
+        # "Y" as an initial is not the Spanish "and"
+        self.assertEqual(split_names('Y. Chen'), ['Y. Chen'])
+        self.assertEqual(split_names('Andy Y Wong'), ['Andy Y Wong'])
+        self.assertEqual(split_names('Jorge Y. Rivero / Y Chen'), ['Jorge Y. Rivero', 'Y Chen'])
+
+    def test_backfill_links_users_in_bulk(self):
+        exact = self._action('Jeffery Cooper')
+        multi = self._action('Jorge Rivero / Cooper, Jeffery')
+        fuzzy = self._action('Abdul Castiyo')
+        ambiguous = self._action('Luis Montoya')
+        unknown = self._action('Somebody Else')
+        already = self._action('Jorge Rivero')
+        already.action_responsible_users.set([self.castillo])
+        cursor = ChangeLogEntry.objects.order_by('-id').first().pk
+
+        out = io.StringIO()
+        with self.assertNumQueries(7): # Savepoint, candidate actions, users, one bulk_create, version bump, change log, release
+            call_command('link_responsible_users', stdout=out)
+
+        def linked(action):
+            return set(action.action_responsible_users.values_list('username', flat=True))
+        self.assertEqual(linked(exact), {'jcooper'})
+        self.assertEqual(linked(multi), {'jrivero', 'jcooper'})
+        self.assertEqual(linked(fuzzy), {'acastillo'})
+        self.assertEqual(linked(ambiguous), set())
+        self.assertEqual(linked(unknown), set())
+        self.assertEqual(linked(already), {'acastillo'}) # Existing links are left alone
+        self.assertIn('"Luis Montoya": lmontoya, lmontoya1', out.getvalue())
+        self.assertIn('"Somebody Else" (1 action(s))', out.getvalue())
+        logged = ChangeLogEntry.objects.filter(id__gt=cursor).values_list('object_id', flat=True)
+        self.assertEqual(sorted(logged), sorted([exact.pk, multi.pk, fuzzy.pk]))
+
+    def test_partly_resolved_cells_stay_unlinked_until_resolved(self):
+        action = self._action('Jeffery Cooper / Yolanda Chen')
+        out = io.StringIO()
+        call_command('link_responsible_users', stdout=out)
+        self.assertFalse(action.action_responsible_users.exists())
+        self.assertIn('"Yolanda Chen" (1 action(s))', out.getvalue())
+
+        User.objects.create_user('ychen', 'ychen@rainbird.com', first_name='Yolanda', last_name='Chen')
+        call_command('link_responsible_users', stdout=io.StringIO())
+        self.assertEqual(set(action.action_responsible_users.values_list('username', flat=True)), {'jcooper', 'ychen'})
+
+    def test_dry_run_writes_nothing(self):
+        action = self._action('Jeffery Cooper')
+        out = io.StringIO()
+        call_command('link_responsible_users', dry_run=True, stdout=out)
+        self.assertIn('Would link 1 action(s)', out.getvalue())
+        self.assertFalse(action.action_responsible_users.exists())
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.engineer = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.client.force_login(self.admin)
+        call_command('seed_load_data', deviations=20, min_actions=0, max_actions=4, users=3, seed=3, stdout=io.StringIO())
+
+    def test_changelist_query_count_does_not_depend_on_row_count(self):
+        for url in ('/admin/deviations/deviation/', '/admin/deviations/action/'):
+            with CaptureQueriesContext(connections['default']) as small:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            call_command('seed_load_data', deviations=20, min_actions=1, max_actions=4, users=3, seed=4,
+                         stdout=io.StringIO())
+            with CaptureQueriesContext(connections['default']) as large:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(len(small), len(large), url)
+
+    def test_status_and_completion_match_the_api(self):
+        expected = {item['dev_number']: (item['deviation_status'], item['completion_percentage'])
+                    for item in DeviationSerializer(Deviation.objects.all(), many=True).data}
+        annotated = {d.dev_number: (d.deviation_status, d.completion_percentage)
+                     for d in annotate_deviation_status(Deviation.objects.all())}
+        self.assertEqual(annotated, expected)
+
+    def test_halves_round_the_same_in_sql_and_python(self):
+        for done, expected in ((1, 13), (5, 63)): # 12.5% and 62.5%: round() would give 12 and 62
+            deviation = Deviation.objects.create(dev_number=f'RND25-{done:04d}')
+            Action.objects.bulk_create([Action(deviation=deviation, action_description='Step', order=order,
+                                               status='Done' if order <= done else 'Not Started')
+                                        for order in range(1, 9)])
+            self.assertEqual(DeviationSerializer(deviation).data['completion_percentage'], expected)
+            self.assertEqual(annotate_deviation_status(Deviation.objects.filter(pk=deviation.pk)).get()
+                             .completion_percentage, expected)
+
+    def test_filters(self):
+        response = self.client.get('/admin/deviations/deviation/', {'deviation_status': 'Done', 'open_actions': 'no'})
+        self.assertEqual(response.status_code, 200)
+        shown = {d.dev_number for d in response.context['cl'].result_list}
+        self.assertTrue(all(d.deviation_status == 'Done' for d in annotate_deviation_status(
+            Deviation.objects.filter(dev_number__in=shown))))
+        self.assertEqual(self.client.get('/admin/deviations/action/', {'status__exact': 'Done'}).status_code, 200)
+
+    def test_bulk_actions(self):
+        deviation = Deviation.objects.annotate(n=Count('actions')).filter(n__gt=1).first()
+        action_ids = list(deviation.actions.values_list('id', flat=True))
+        response = self.client.post('/admin/deviations/deviation/', {
+            'action': 'mark_all_actions_done', '_selected_action': [deviation.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(deviation.actions.values_list('status', flat=True)), {'Done'})
+
+        cursor = ChangeLogEntry.objects.order_by('-id').first().pk
+        self.client.post('/admin/deviations/action/', {
+            'action': 'reassign', '_selected_action': action_ids, 'username': 'engineer',
+        })
+        for action in Action.objects.filter(id__in=action_ids):
+            self.assertEqual(list(action.action_responsible_users.values_list('username', flat=True)), ['engineer'])
+        self.assertEqual(sorted(ChangeLogEntry.objects.filter(id__gt=cursor).values_list('object_id', flat=True)),
+                         sorted(action_ids))
+
+    def test_autocomplete_for_users(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'deviations', 'model_name': 'action', 'field_name': 'action_responsible_users', 'term': 'engi',
+        })
+        self.assertEqual([r['text'] for r in response.json()['results']], ['engineer'])
+
+
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.client.force_login(self.user)
+        deviation = Deviation.objects.create(dev_number='DEV24-0001')
+        Action.objects.create(deviation=deviation, action_description='Sort parts', action_responsible='Luis')
+
+    def _server_timing(self, response):
+        return dict(
+            (part.split(';')[0].strip(), part) for part in response['Server-Timing'].split(',')
+        )
+
+    def test_server_timing_reports_db_serializer_and_render(self):
+        response = self.client.get('/api/deviations/')
+        self.assertEqual(response.status_code, 200)
+        timing = self._server_timing(response)
+        self.assertIn('db', timing)
+        self.assertRegex(timing['db'], r'desc="\d+ queries"')
+        self.assertIn('serializer', timing)
+        self.assertIn('render', timing)
+        self.assertIn('total', timing)
+
+    def test_request_is_logged_as_json(self):
+        logger = logging.getLogger('deviations.requests')
+        with self.assertLogs(logger, level='INFO') as logs:
+            self.client.get('/api/deviations/DEV24-0001/')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'deviation-detail-update-delete')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+
+    def test_metrics_endpoint_exports_histograms_for_staff(self):
+        self.client.get('/api/deviations/')
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        body = self.client.get('/api/_metrics').content.decode()
+        self.assertIn(
+            'deviations_request_duration_seconds_count{view="deviation-list-create",method="GET",status="2xx"} 1', body
+        )
+        self.assertIn('deviations_request_queries_total{view="deviation-list-create"', body)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint_accepts_scrape_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/_metrics', HTTP_X_METRICS_TOKEN='wrong').status_code, 401)
+        response = self.client.get('/api/_metrics', HTTP_X_METRICS_TOKEN='scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        override = override_settings(PROFILER_DIR=self.profile_dir.name, PROFILER_INTERVAL_MS=1)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = User.objects.create_user('lead', 'lead@example.com', 'pw', is_staff=True)
+        self.engineer = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        Deviation.objects.create(dev_number='DEV24-0001')
+
+    def test_sampler_produces_folded_stacks(self):
+        profiler = SamplingProfiler(interval=0.001).start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        profiler.stop()
+        self.assertGreater(profiler.samples, 0)
+        for line in profiler.folded().strip().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn('test_sampler_produces_folded_stacks', stack)
+            self.assertTrue(count.isdigit())
+
+    def test_staff_can_request_a_profile_with_a_jwt(self):
+        token = AccessToken.for_user(self.staff)
+        response = self.client.get('/api/deviations/DEV24-0001/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir.name, f'{profile_id}.folded')))
+        [meta] = list_profiles()
+        self.assertEqual(meta['view'], 'deviation-detail-update-delete')
+        self.assertEqual(meta['trigger'], 'requested')
+        self.assertEqual(meta['user'], 'lead')
+
+    def test_non_staff_profile_flag_is_ignored(self):
+        self.client.force_login(self.engineer)
+        response = self.client.get('/api/deviations/?_profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+    @override_settings(PROFILER_SAMPLE_RATE=1.0)
+    def test_sampled_requests_are_profiled(self):
+        self.client.force_login(self.engineer)
+        self.client.get('/api/deviations/')
+        self.assertEqual([p['trigger'] for p in list_profiles()], ['sampled'])
+
+    def test_admin_page_lists_and_serves_profiles(self):
+        self.client.force_login(self.staff)
+        profile_id = self.client.get('/api/deviations/', HTTP_X_PROFILE='1')['X-Profile-Id']
+
+        page = self.client.get('/admin/profiles/')
+        self.assertContains(page, profile_id)
+        download = self.client.get(f'/admin/profiles/{profile_id}/')
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(self.client.get('/admin/profiles/..%2Fsettings/').status_code, 404)
+
+        self.client.force_login(self.engineer)
+        self.assertEqual(self.client.get('/admin/profiles/').status_code, 302) # Redirect to admin login
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def _changes(self, since=0, **params):
+        response = self.client.get('/api/changes', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_returns_only_changes_after_cursor(self):
+        deviation = Deviation.objects.create(dev_number='DEV24-0001')
+        first = self._changes()
+        self.assertEqual([d['dev_number'] for d in first['deviations']['upserted']], ['DEV24-0001'])
+        self.assertNotIn('actions', first['deviations']['upserted'][0])
+
+        action = Action.objects.create(deviation=deviation, action_description='Sort parts')
+        action.action_responsible_users.add(self.user)
+        second = self._changes(first['cursor'])
+        self.assertEqual(second['deviations']['upserted'], [])
+        [payload] = second['actions']['upserted']
+        self.assertEqual(payload['id'], action.pk)
+        self.assertEqual(payload['action_responsible_users'], ['engineer'])
+
+        self.assertEqual(self._changes(second['cursor'])['actions']['upserted'], [])
+
+    def test_deletes_are_reported_by_id(self):
+        deviation = Deviation.objects.create(dev_number='DEV24-0001')
+        action = Action.objects.create(deviation=deviation, action_description='Sort parts')
+        cursor = self._changes()['cursor']
+        deviation_id = deviation.pk
+        deviation.delete()
+        changes = self._changes(cursor)
+        self.assertEqual(changes['deviations']['deleted'], [deviation_id])
+        self.assertEqual(changes['actions']['deleted'], [action.pk])
+        self.assertEqual(changes['deviations']['upserted'], [])
+
+    def test_pages_are_bounded(self):
+        for i in range(5):
+            Deviation.objects.create(dev_number=f'DEV24-{i:04d}')
+        page = self._changes(limit=2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(len(page['deviations']['upserted']), 2)
+        seen = [d['dev_number'] for d in page['deviations']['upserted']]
+        while page['has_more']:
+            page = self._changes(page['cursor'], limit=2)
+            seen += [d['dev_number'] for d in page['deviations']['upserted']]
+        self.assertEqual(seen, [f'DEV24-{i:04d}' for i in range(5)])
+
+        for params in ({'limit': -1}, {'limit': 0}, {'limit': 10 ** 6}, {'since': -5}, {'since': 10 ** 30},
+                       {'since': 'x'}):
+            self.assertEqual(self.client.get('/api/changes', params).status_code, 400, params)
+
+    def test_reorder_and_bulk_paths_are_logged(self):
+        call_command('seed_load_data', deviations=2, min_actions=2, max_actions=2, users=1, seed=3, stdout=io.StringIO())
+        changes = self._changes()
+        self.assertEqual(len(changes['deviations']['upserted']), 2)
+        self.assertEqual(len(changes['actions']['upserted']), 4)
+
+        deviation = Deviation.objects.first()
+        first, second = deviation.actions.order_by('order')
+        response = self.client.patch(
+            f'/api/deviations/{deviation.dev_number}/reorder_actions/',
+            {'new_order': [{'id': first.id, 'order': 2}, {'id': second.id, 'order': 1}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        changes = self._changes(changes['cursor'])
+        self.assertEqual({a['id']: a['order'] for a in changes['actions']['upserted']}, {first.id: 2, second.id: 1})
+
+    def test_pruned_cursor_requires_reload(self):
+        Deviation.objects.create(dev_number='DEV24-0001')
+        cursor = self._changes()['cursor']
+        Deviation.objects.create(dev_number='DEV24-0002')
+        Deviation.objects.create(dev_number='DEV24-0003')
+        ChangeLogEntry.objects.filter(id__lte=cursor + 1).delete() # Pruned before the client caught up
+        response = self.client.get('/api/changes', {'since': cursor})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['cursor'], cursor + 1)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache().clear()
+        self.user = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_repeat_requests_skip_the_user_query(self):
+        with self.assertNumQueries(1): # User lookup
+            self.assertEqual(self.client.get('/api/users/me/', **self.auth).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/', **self.auth)
+        self.assertEqual(response.json()['username'], 'engineer')
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.client.get('/api/users/me/', **self.auth)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(user_cache().get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get('/api/users/me/', **self.auth).status_code, 401)
+
+    def test_profile_changes_are_picked_up(self):
+        self.client.get('/api/users/me/', **self.auth)
+        self.user.first_name = 'Ada'
+        self.user.save(update_fields=['first_name'])
+        self.assertEqual(self.client.get('/api/users/me/', **self.auth).json()['first_name'], 'Ada')
+
+    def test_last_login_updates_keep_the_cache_warm(self):
+        self.client.get('/api/users/me/', **self.auth)
+        response = self.client.post('/api/token/', {'username': 'engineer', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(user_cache().get(user_cache_key(self.user.pk)))
+
+
+class OverdueActionsTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.client.force_login(self.alice)
+        arimex = Deviation.objects.create(dev_number='DEV24-0439', owner_plant='Arimex')
+        other = Deviation.objects.create(dev_number='DEV25-0003', owner_plant='Tredegar')
+
+        def action(deviation, days_ago, status='Not Started', users=(), text=None):
+            action = Action.objects.create(deviation=deviation, action_description='Fix', status=status,
+                                           action_expiration_date=today - timedelta(days=days_ago),
+                                           action_responsible=text)
+            action.action_responsible_users.set(users)
+            return action
+
+        self.shared = action(arimex, 10, users=[self.alice, self.bob])
+        self.alice_only = action(other, 2, status='In Progress', users=[self.alice])
+        action(arimex, 30, status='Done', users=[self.alice]) # Closed
+        action(arimex, 0, users=[self.bob]) # Due today, not overdue yet
+        self.legacy = action(other, 5, text='Carla Legacy')
+
+    def _report(self, **params):
+        response = self.client.get('/api/actions/overdue', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_groups_overdue_actions_by_owner(self):
+        report = self._report()
+        self.assertEqual(report['count'], 3)
+        groups = {group['owner']: group for group in report['results']}
+        self.assertEqual(report['results'][0]['owner'], 'alice') # Most overdue actions first
+        self.assertEqual([a['id'] for a in groups['alice']['actions']], [self.shared.pk, self.alice_only.pk])
+        self.assertEqual(groups['alice']['overdue_count'], 2)
+        self.assertEqual([a['id'] for a in groups['bob']['actions']], [self.shared.pk])
+        self.assertEqual(groups['bob']['actions'][0]['days_overdue'], 10)
+        self.assertIsNone(groups['Carla Legacy']['user_id'])
+        self.assertEqual([a['dev_number'] for a in groups['Carla Legacy']['actions']], ['DEV25-0003'])
+
+    def test_filters(self):
+        self.assertEqual([g['owner'] for g in self._report(user='bob')['results']], ['bob'])
+        self.assertEqual({g['owner'] for g in self._report(plant='arimex')['results']}, {'alice', 'bob'})
+        report = self._report(days_overdue=6)
+        self.assertEqual({g['owner']: g['overdue_count'] for g in report['results']}, {'alice': 1, 'bob': 1})
+        self.assertEqual(self.client.get('/api/actions/overdue', {'user': 'nobody'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/actions/overdue', {'days_overdue': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/actions/overdue', {'days_overdue': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/actions/overdue', {'days_overdue': 10 ** 7}).status_code, 400)
+
+    def test_user_filter_matches_legacy_full_names(self):
+        carla = User.objects.create_user('clegacy', 'carla.legacy@example.com', 'pw', first_name='Carla', last_name='Legacy')
+        reversed_name = Action.objects.create(deviation=self.legacy.deviation, action_description='Audit',
+                                              action_expiration_date=date.today() - timedelta(days=3),
+                                              action_responsible='Legacy, Carla / Bob Other')
+        report = self._report(user='clegacy')
+        self.assertEqual({group['owner']: [a['id'] for a in group['actions']] for group in report['results']},
+                         {'Carla Legacy': [self.legacy.pk], 'Legacy, Carla / Bob Other': [reversed_name.pk]})
+        self.assertEqual(self._report(user=carla.pk)['count'], 2)
+        self.assertEqual(self._report(user='alice')['count'], 1) # Not matched by anyone else's name
+
+    def test_query_count_does_not_grow_with_owners(self):
+        # Session + user, then owner count, owner page, M2M owners' actions, legacy owners' actions
+        with self.assertNumQueries(6):
+            self._report(page_size=2)
+        self.assertEqual(len(self._report(page_size=2)['results']), 2)
+        self.assertEqual(len(self._report(page_size=2, page=2)['results']), 1)
+
+    def test_uses_the_status_expiry_index(self):
+        from .reports import overdue_actions
+        sql, params = overdue_actions().values('id').query.sql_with_params()
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('action_status_expiry_idx', plan)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'jobs': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'job-tests'},
+})
+class JobQueueTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.staff = User.objects.create_user('planner', 'planner@example.com', 'pw', is_staff=True)
+        self.engineer = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.client.force_login(self.staff)
+
+    def _run(self, job_id):
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        return self.client.get(f'/api/jobs/{job_id}/').json()
+
+    def test_export_round_trips_through_the_import(self):
+        call_command('seed_load_data', deviations=8, min_actions=1, max_actions=3, users=3, seed=5, stdout=io.StringIO())
+        created = self.client.post('/api/jobs/', {'kind': 'export_deviations'})
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(created.json()['status'], 'queued')
+        job = self._run(created.json()['id'])
+        self.assertEqual(job['status'], 'succeeded', job['log'])
+        self.assertEqual(job['counts']['deviations'], 8)
+
+        response = self.client.get(f'/api/jobs/{job["id"]}/result')
+        self.assertEqual(response.status_code, 200)
+        workbook = b''.join(response.streaming_content)
+        upload = SimpleUploadedFile('export.xlsx', workbook)
+        created = self.client.post('/api/jobs/', {'kind': 'import_deviations', 'file': upload})
+        self.assertEqual(created.status_code, 201)
+        job = self._run(created.json()['id'])
+        self.assertEqual(job['status'], 'succeeded', job['log'])
+        self.assertEqual(job['progress'], 100)
+        self.assertEqual(job['counts']['deviations_updated'], 8)
+        self.assertIn('Excel Import Summary', job['log'])
+
+    def test_failed_job_keeps_error_and_log(self):
+        upload = SimpleUploadedFile('broken.xlsx', b'not a workbook')
+        job_id = self.client.post('/api/jobs/', {'kind': 'import_deviations', 'file': upload}).json()['id']
+        job = self._run(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'Import failed, see the log.')
+        self.assertIn('Error', job['log'])
+
+    def test_permissions_and_visibility(self):
+        self.client.force_login(self.engineer)
+        self.assertEqual(self.client.post('/api/jobs/', {'kind': 'import_users'}).status_code, 403)
+        self.assertEqual(self.client.post('/api/jobs/', {'kind': 'nonsense'}).status_code, 400)
+        own = self.client.post('/api/jobs/', {'kind': 'export_deviations'}).json()['id']
+        other = Job.objects.create(kind=Job.LINK_RESPONSIBLES, created_by=self.staff)
+        self.assertEqual([job['id'] for job in self.client.get('/api/jobs/').json()], [own])
+        self.assertEqual(self.client.get(f'/api/jobs/{other.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/jobs/{own}/result').status_code, 404) # Not run yet
+
+        self.client.force_login(self.staff)
+        self.assertEqual({job['id'] for job in self.client.get('/api/jobs/').json()}, {own, other.pk})
+
+    def test_writing_jobs_run_one_at_a_time(self):
+        first = Job.objects.create(kind=Job.IMPORT_DEVIATIONS)
+        Job.objects.create(kind=Job.LINK_RESPONSIBLES)
+        export = Job.objects.create(kind=Job.EXPORT_DEVIATIONS)
+        self.assertEqual(claim_next_job().pk, first.pk)
+        self.assertEqual(claim_next_job().pk, export.pk) # Skips the second writer while the first runs
+        self.assertIsNone(claim_next_job())
+
+    def test_live_progress_and_stale_jobs(self):
+        job = Job.objects.create(kind=Job.IMPORT_DEVIATIONS, status=Job.RUNNING, created_by=self.staff,
+                                 heartbeat_at=timezone.now())
+        context = JobContext(job)
+        context.log('Importing...')
+        context.progress(5, 20)
+        context.count(deviations_created=5)
+        context.flush(force=True)
+        data = self.client.get(f'/api/jobs/{job.pk}/').json()
+        self.assertEqual((data['progress'], data['counts'], data['log']), (25, {'deviations_created': 5}, 'Importing...'))
+
+        self.assertEqual(fail_stale_jobs(), 0)
+        with override_settings(JOB_STALE_SECONDS=-1):
+            self.assertEqual(fail_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+
+    def test_send_reminders_emails_each_user_once(self):
+        deviation = Deviation.objects.create(dev_number='DEV25-0100')
+        due = Action.objects.create(deviation=deviation, action_description='Replace gasket',
+                                    action_expiration_date=date.today() + timedelta(days=1))
+        due.action_responsible_users.set([self.engineer, self.staff])
+        Action.objects.create(deviation=deviation, action_description='Later', order=2,
+                              action_expiration_date=date.today() + timedelta(days=30))
+        Job.objects.create(kind=Job.SEND_REMINDERS)
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['engineer@example.com', 'planner@example.com'])
+        self.assertIn('DEV25-0100', mail.outbox[0].body)
+        self.assertTrue(Action.objects.get(pk=due.pk).reminder_sent)
+
+        Job.objects.create(kind=Job.SEND_REMINDERS)
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class SnapshotTests(TransactionTestCase):
+    # The backup API cannot read from a connection with an open write transaction, so no TestCase
+    databases = {'default', 'read'}
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        call_command('seed_load_data', deviations=6, min_actions=1, max_actions=3, users=2, seed=7, stdout=io.StringIO())
+
+    def test_snapshot_is_compressed_verified_and_pruned(self):
+        steps = []
+        manifest = snapshot_database(self.directory, pages_per_step=4, step_sleep=0,
+                                     progress=lambda done, total: steps.append((done, total)))
+        self.assertEqual(manifest['rows']['deviations_deviation'], 6)
+        self.assertEqual(manifest['rows']['deviations_action'], Action.objects.count())
+        self.assertGreater(len(steps), 1) # Copied in several steps
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        with tempfile.TemporaryDirectory() as workdir:
+            _, verified, pending = verify_snapshot(list_snapshots(self.directory)[0]['path'], workdir)
+        self.assertEqual((verified['sha256'], pending), (manifest['sha256'], []))
+
+        for _ in range(2):
+            snapshot_database(self.directory, keep=2, step_sleep=0)
+        snapshots = list_snapshots(self.directory)
+        self.assertEqual(len(snapshots), 2)
+        self.assertNotIn(manifest['name'], [snapshot['name'] for snapshot in snapshots])
+
+    def test_corrupt_snapshot_is_rejected(self):
+        snapshot_database(self.directory, step_sleep=0)
+        path = list_snapshots(self.directory)[0]['path']
+        with open(path, 'r+b') as file:
+            file.seek(-8, os.SEEK_END)
+            file.write(b'garbage!')
+        with tempfile.TemporaryDirectory() as workdir, self.assertRaises(SnapshotError):
+            verify_snapshot(path, workdir)
+        with self.assertRaisesMessage(CommandError, 'Cannot decompress'):
+            call_command('restore_db', 'latest', dir=self.directory, interactive=False, stdout=io.StringIO())
+
+    def test_snapshot_job(self):
+        staff = User.objects.create_user('ops', 'ops@example.com', 'pw', is_staff=True)
+        self.client.force_login(staff)
+        with override_settings(SNAPSHOT_DIR=self.directory):
+            job_id = self.client.post('/api/jobs/', {'kind': 'snapshot_db'}).json()['id']
+            call_command('run_jobs', once=True, stdout=io.StringIO())
+        job = self.client.get(f'/api/jobs/{job_id}/').json()
+        self.assertEqual(job['status'], 'succeeded', job['log'])
+        self.assertEqual(job['counts']['deviations_deviation'], 6)
+        self.assertEqual(len(list_snapshots(self.directory)), 1)
+
+    def test_restore_brings_back_the_snapshot(self):
+        expected = set(Deviation.objects.values_list('dev_number', flat=True))
+        snapshot_database(self.directory, step_sleep=0)
+        Deviation.objects.all().delete()
+        Deviation.objects.create(dev_number='DEV25-0002')
+        call_command('restore_db', 'latest', dir=self.directory, interactive=False, stdout=io.StringIO())
+        self.assertEqual(set(Deviation.objects.values_list('dev_number', flat=True)), expected)
+        self.assertEqual(Action.objects.filter(deviation__dev_number__in=expected).count(),
+                         list_snapshots(self.directory)[0]['rows']['deviations_action'])
+
+
+class ActionPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.big = Deviation.objects.create(dev_number='DEV25-0500', expiration_date=date.today() + timedelta(days=30))
+        statuses = ['Not Started', 'In Progress', 'Done']
+        Action.objects.bulk_create([
+            Action(deviation=self.big, action_description=f'Step {n}', order=n, status=statuses[n % 3])
+            for n in range(1, 121)
+        ])
+        self.small = Deviation.objects.create(dev_number='DEV25-0501')
+        for n in range(1, 4):
+            Action.objects.create(deviation=self.small, action_description=f'Step {n}', order=n)
+        Action.objects.get(deviation=self.big, order=7).action_responsible_users.set([self.user])
+
+    def _actions(self, deviation, **params):
+        response = self.client.get(f'/api/deviations/{deviation.dev_number}/actions/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_keyset_pages_cover_every_action_in_order(self):
+        orders, params, pages = [], {'limit': 50}, 0
+        while True:
+            page = self._actions(self.big, **params)
+            orders += [action['order'] for action in page['results']]
+            pages += 1
+            if not page['has_more']:
+                self.assertIsNone(page['next'])
+                break
+            self.assertIn(f'after={page["next_after"]}', page['next'])
+            params['after'] = page['next_after']
+        self.assertEqual((orders, pages), (list(range(1, 121)), 3))
+        self.assertEqual(self._actions(self.big, after=10, until=15)['results'][-1]['order'], 15)
+        self.assertEqual(len(self._actions(self.big, after=10, until=15)['results']), 5)
+
+    def test_status_filter(self):
+        page = self._actions(self.big, status='Done', limit=500)
+        self.assertEqual(len(page['results']), 40)
+        self.assertEqual({action['status'] for action in page['results']}, {'Done'})
+        self.assertEqual(len(self._actions(self.big, status='Done,In Progress', limit=500)['results']), 80)
+        url = f'/api/deviations/{self.big.dev_number}/actions/'
+        self.assertEqual(self.client.get(url, {'status': 'Finished'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'many'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+
+    def test_deep_pages_cost_the_same_queries(self):
+        with CaptureQueriesContext(connections['default']) as first:
+            self._actions(self.big, limit=10)
+        with CaptureQueriesContext(connections['default']) as deep:
+            self._actions(self.big, limit=10, after=100)
+        self.assertEqual(len(first), len(deep))
+        self.assertEqual(self._actions(self.big, after=6, limit=1)['results'][0]['action_responsible_users'],
+                         ['alice'])
+
+    def test_detail_can_embed_only_the_first_actions(self):
+        url = f'/api/deviations/{self.big.dev_number}/'
+        full = self.client.get(url).json()
+        preview = self.client.get(url, {'actions_limit': 10}).json()
+        self.assertEqual([action['order'] for action in preview['actions']], list(range(1, 11)))
+        self.assertEqual(preview['action_counts'], {'total': 120, 'Not Started': 40, 'In Progress': 40, 'Done': 40})
+        self.assertTrue(preview['actions_next'].endswith(f'/api/deviations/{self.big.dev_number}/actions/?after=10'))
+        self.assertEqual((preview['deviation_status'], preview['completion_percentage']),
+                         (full['deviation_status'], full['completion_percentage']))
+        self.assertEqual(len(full['actions']), 120)
+
+        small = self.client.get(f'/api/deviations/{self.small.dev_number}/', {'actions_limit': 10}).json()
+        self.assertEqual((len(small['actions']), small['actions_next']), (3, None))
+        self.assertEqual(self.client.get(url, {'actions_limit': 'all'}).status_code, 400)
+
+    def test_detail_preview_queries_do_not_grow_with_actions(self):
+        with CaptureQueriesContext(connections['default']) as big:
+            self.client.get(f'/api/deviations/{self.big.dev_number}/', {'actions_limit': 20})
+        with CaptureQueriesContext(connections['default']) as small:
+            self.client.get(f'/api/deviations/{self.small.dev_number}/', {'actions_limit': 20})
+        self.assertEqual(len(big), len(small))
+
+
+class DevNumberTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('alice', 'alice@example.com', 'pw'))
+        for dev_number in ['DEV24-10', 'DEV24-9', 'DEV24-0400', 'DEV24-0500', 'DEV24-0501', 'DEV25-0003', 'DEV23-0777',
+                           'LEGACY-A']:
+            Deviation.objects.create(dev_number=dev_number)
+
+    def _list(self, **params):
+        response = self.client.get('/api/deviations/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [deviation['dev_number'] for deviation in response.json()]
+
+    def test_parse(self):
+        self.assertEqual(parse_dev_number('DEV24-0439'), ('DEV', 24, 439))
+        self.assertEqual(parse_dev_number(' dev 24-439 '), ('DEV', 24, 439))
+        self.assertEqual(parse_dev_number('LEGACY-A'), ('', None, None))
+        deviation = Deviation.objects.get(dev_number='DEV24-9')
+        deviation.dev_number = 'DEV26-0042'
+        deviation.save(update_fields=['dev_number'])
+        deviation.refresh_from_db()
+        self.assertEqual((deviation.dev_prefix, deviation.dev_year, deviation.dev_sequence), ('DEV', 26, 42))
+
+    def test_natural_order_and_range_filters(self):
+        self.assertEqual(self._list(), ['LEGACY-A', 'DEV23-0777', 'DEV24-9', 'DEV24-10', 'DEV24-0400', 'DEV24-0500',
+                                        'DEV24-0501', 'DEV25-0003'])
+        self.assertEqual(self._list(ordering='-dev_number')[0], 'DEV25-0003')
+        self.assertEqual(self._list(dev_year=2024), ['DEV24-9', 'DEV24-10', 'DEV24-0400', 'DEV24-0500', 'DEV24-0501'])
+        self.assertEqual(self._list(dev_from='DEV24-0400', dev_to='DEV24-0500'), ['DEV24-0400', 'DEV24-0500'])
+        self.assertEqual(self._list(dev_from='DEV24-0500', dev_to='DEV25-9999'), ['DEV24-0500', 'DEV24-0501', 'DEV25-0003'])
+        self.assertEqual(self._list(dev_to='DEV23-9999', dev_prefix='dev'), ['DEV23-0777'])
+        self.assertEqual(self.client.get('/api/deviations/', {'dev_from': 'nonsense'}).status_code, 400)
+
+    def test_range_filter_uses_the_dev_key_index(self):
+        from .views import filter_dev_number_range
+        queryset = filter_dev_number_range(Deviation.objects.all(), ('DEV', 24, 400), ('DEV', 24, 500))
+        sql, params = queryset.values('id').query.sql_with_params()
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('deviation_dev_key_idx', plan)
+
+    def test_allocator(self):
+        self.assertEqual(allocate_dev_number('DEV', 2024), 'DEV24-0502')
+        self.assertEqual(allocate_dev_number('dev', 24), 'DEV24-0503') # Reserved numbers are not handed out again
+        Deviation.objects.create(dev_number='DEV24-0900') # Typed in by hand
+        self.assertEqual(allocate_dev_number('DEV', 2024), 'DEV24-0901')
+        self.assertEqual(allocate_dev_number('QA', 2030), 'QA30-0001')
+        self.assertEqual(DevNumberCounter.objects.get(prefix='DEV', year=24).last_sequence, 901)
+
+        response = self.client.post('/api/deviation-numbers/next', {'year': 2025}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'dev_number': 'DEV25-0004', 'prefix': 'DEV', 'year': 25, 'sequence': 4})
+        self.assertEqual(self.client.post('/api/deviation-numbers/next', {'prefix': 'D-1'},
+                                          content_type='application/json').status_code, 400)
+
+
+class ConcurrentDevNumberAllocationTests(TransactionTestCase):
+    def test_parallel_allocations_never_collide(self):
+        Deviation.objects.create(dev_number='DEV25-0010')
+        numbers, errors = [], []
+
+        def allocate():
+            try:
+                for _ in range(10):
+                    numbers.append(allocate_dev_number('DEV', 2025))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=allocate) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(numbers), [f'DEV25-{n:04d}' for n in range(11, 71)])
+
+
+TIGHT_THROTTLE_RATES = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'read': '3/min', 'write': '1/min', 'heavy': '1/min'}}
+
+
+@override_settings(REST_FRAMEWORK=TIGHT_THROTTLE_RATES)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        throttle_buckets.clear()
+        self.addCleanup(throttle_buckets.clear)
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.client.force_login(self.alice)
+
+    def test_token_bucket(self):
+        bucket = TokenBuckets()
+        self.assertEqual(bucket.take('k', 2, 1.0, now=0), 0)
+        self.assertEqual(bucket.take('k', 2, 1.0, now=0), 0)
+        self.assertEqual(bucket.take('k', 2, 1.0, now=0), 1.0)
+        self.assertEqual(bucket.take('k', 2, 1.0, now=0.5), 0.5)
+        self.assertEqual(bucket.take('k', 2, 1.0, now=1.0), 0)
+        self.assertEqual(bucket.take('other', 2, 1.0, now=1.0), 0) # Buckets are independent
+
+    def test_refilled_buckets_are_pruned(self):
+        bucket = TokenBuckets(max_buckets=2)
+        bucket.take('a', 1, 1.0, now=0)
+        bucket.take('b', 1, 1.0, now=0.5)
+        bucket.take('c', 1, 1.0, now=1.2) # 'a' is full again, 'b' is not
+        self.assertEqual(len(bucket), 2)
+        self.assertAlmostEqual(bucket.take('b', 1, 1.0, now=1.2), 0.3)
+
+    def test_reads_and_writes_have_separate_per_user_budgets(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/deviations/').status_code, 200)
+        response = self.client.get('/api/deviations/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertIn('throttled_requests_total{scope="read"}', registry.render_prometheus())
+
+        self.assertEqual(self.client.post('/api/deviations/', {'dev_number': 'DEV24-0001'},
+                                          content_type='application/json').status_code, 201)
+        self.assertEqual(self.client.post('/api/deviations/', {'dev_number': 'DEV24-0002'},
+                                          content_type='application/json').status_code, 429)
+
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get('/api/deviations/').status_code, 200)
+
+    def test_jobs_use_the_heavy_budget(self):
+        self.assertEqual(self.client.post('/api/jobs/', {'kind': 'export_deviations'},
+                                          content_type='application/json').status_code, 201)
+        self.assertEqual(self.client.post('/api/jobs/', {'kind': 'export_deviations'},
+                                          content_type='application/json').status_code, 429)
+        self.assertEqual(self.client.get('/api/jobs/').status_code, 200) # Listing is a plain read
+
+    def test_logins_are_keyed_by_ip(self):
+        self.client.logout()
+        self.assertEqual(self.client.post('/api/token/', {'username': 'alice', 'password': 'wrong'}).status_code, 401)
+        self.assertEqual(self.client.post('/api/token/', {'username': 'bob', 'password': 'guess'}).status_code, 429)
+
+    def test_check_costs_microseconds(self):
+        result = benchmark_throttle(5, self.alice)['throttle-check']
+        self.assertLess(result['us_per_check'], 200)
+        self.assertEqual(result['queries'], 0)
+
+
+class OptimisticConcurrencyTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('alice', 'alice@example.com', 'pw'))
+        self.deviation = Deviation.objects.create(dev_number='DEV24-0001')
+        self.first = Action.objects.create(deviation=self.deviation, action_description='First', action_responsible='A')
+        self.second = Action.objects.create(deviation=self.deviation, action_description='Second', action_responsible='B')
+        self.action_url = f'/api/deviations/DEV24-0001/actions/{self.first.pk}/'
+
+    def _patch(self, url, data, **headers):
+        return self.client.patch(url, data, content_type='application/json', **headers)
+
+    def test_every_save_bumps_the_version(self):
+        self.assertEqual(self.first.version, 1)
+        self.first.status = 'Done'
+        self.first.save(update_fields=['status'])
+        self.assertEqual(self.first.version, 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.version, 2)
+
+    def test_saves_from_stale_instances_still_bump_the_version(self):
+        stale = Action.objects.get(pk=self.first.pk)
+        self.first.save()
+        self.first.save()
+        stale.action_description = 'Stale'
+        stale.save() # Unconditional: writes, but never lowers or reuses a version
+        self.assertEqual(stale.version, 4)
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.action_description, self.first.version), ('Stale', 4))
+
+    def test_stale_patch_is_rejected_with_one_conditional_update(self):
+        response = self.client.get(self.action_url)
+        self.assertEqual(response['ETag'], '"1"')
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self._patch(self.action_url, {'status': 'Done'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['version'], response['ETag']), (2, '"2"'))
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "deviations_action"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"version" = 1', updates[0])
+
+        response = self._patch(self.action_url, {'status': 'In Progress'}, HTTP_IF_MATCH='"1"') # Lost update
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['current_version'], 2)
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.status, self.first.version), ('Done', 2))
+
+        self.assertEqual(self._patch(self.action_url, {'status': 'In Progress', 'version': 2}).status_code, 200)
+        self.assertEqual(self._patch(self.action_url, {'status': 'Done'}).status_code, 200) # No version: last write wins
+        self.assertEqual(self._patch(self.action_url, {'status': 'Done'}, HTTP_IF_MATCH='abc').status_code, 400)
+
+    def test_deviation_edit_and_delete(self):
+        url = '/api/deviations/DEV24-0001/'
+        self.assertEqual(self._patch(url, {'sbu': 'LND'}, HTTP_IF_MATCH='"1"').status_code, 200)
+        self.assertEqual(self._patch(url, {'sbu': 'BRK'}, HTTP_IF_MATCH='"1"').status_code, 409)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, 409)
+        self.assertTrue(Deviation.objects.filter(pk=self.deviation.pk).exists())
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"2"').status_code, 204)
+        self.assertFalse(Deviation.objects.filter(pk=self.deviation.pk).exists())
+
+    def test_bulk_paths_bump_versions(self):
+        from .admin import mark_actions_done
+        mark_actions_done(Action.objects.filter(pk=self.first.pk))
+        self.assertEqual(Action.objects.get(pk=self.first.pk).version, 2)
+        self.assertEqual(self._patch(self.action_url, {'status': 'Not Started'}, HTTP_IF_MATCH='"1"').status_code, 409)
+
+    def test_reorder_checks_versions(self):
+        url = '/api/deviations/DEV24-0001/reorder_actions/'
+        stale = [{'id': self.first.pk, 'order': 2, 'version': 1}, {'id': self.second.pk, 'order': 1, 'version': 7}]
+        response = self._patch(url, {'new_order': stale})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['action_id'], self.second.pk)
+        self.assertEqual(response.json()['current_version'], 1)
+        self.assertEqual(list(Action.objects.order_by('order').values_list('id', 'version')),
+                         [(self.first.pk, 1), (self.second.pk, 1)])
+
+        current = [{'id': self.first.pk, 'order': 2, 'version': 1}, {'id': self.second.pk, 'order': 1, 'version': 1}]
+        self.assertEqual(self._patch(url, {'new_order': current}).status_code, 200)
+        self.assertEqual(list(Action.objects.order_by('order').values_list('id', 'version')),
+                         [(self.second.pk, 2), (self.first.pk, 2)])
+
+    def test_reorder_rejects_malformed_items(self):
+        url = '/api/deviations/DEV24-0001/reorder_actions/'
+        for items in ([{'id': self.first.pk}], [{'order': 1}], ['x'], [{'id': str(self.first.pk), 'order': 1}],
+                      [{'id': self.first.pk, 'order': 1, 'version': 'abc'}]):
+            self.assertEqual(self._patch(url, {'new_order': items}).status_code, 400, items)
+        self.assertEqual(list(Action.objects.order_by('order').values_list('id', 'version')),
+                         [(self.first.pk, 1), (self.second.pk, 1)])
+
+
+class BulkActionStatusTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.client.force_login(self.alice)
+        self.first = Deviation.objects.create(dev_number='DEV24-0439')
+        self.second = Deviation.objects.create(dev_number='DEV24-0440')
+        self.mine = [Action.objects.create(deviation=self.first, action_description=f'Mine {n}') for n in range(3)]
+        self.theirs = Action.objects.create(deviation=self.first, action_description='Theirs')
+        self.other = Action.objects.create(deviation=self.second, action_description='Other', status='In Progress')
+        for action in self.mine:
+            action.action_responsible_users.add(self.alice)
+        self.theirs.action_responsible_users.add(self.bob)
+
+    def _post(self, data):
+        return self.client.post('/api/actions/bulk_status', data, content_type='application/json')
+
+    def test_filter_by_deviation_and_assignee(self):
+        cursor = latest_cursor()
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self._post({'status': 'Done', 'dev_number': 'DEV24-0439', 'assigned_to_me': True})
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual(body['updated'], 3)
+        self.assertEqual(sorted(action['id'] for action in body['actions']), sorted(action.pk for action in self.mine))
+        self.assertEqual({action['version'] for action in body['actions']}, {2}) # Bumped from 1
+        self.assertEqual(body['deviations'], [{
+            'dev_number': 'DEV24-0439', 'deviation_status': 'In Progress', 'completion_percentage': 75,
+            'action_counts': {'total': 4, 'Not Started': 1, 'In Progress': 0, 'Done': 3},
+        }])
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "deviations_action"') for query in queries), 1)
+        self.assertEqual(Action.objects.get(pk=self.theirs.pk).status, 'Not Started')
+        self.assertEqual(ChangeLogEntry.objects.filter(id__gt=cursor, model=ChangeLogEntry.ACTION).count(), 3)
+
+    def test_ids_across_deviations_and_rollups_match_the_serializer(self):
+        response = self._post({'status': 'Done', 'ids': [self.theirs.pk, self.other.pk, *[a.pk for a in self.mine]]})
+        rollups = {row['dev_number']: row for row in response.json()['deviations']}
+        for deviation in (self.first, self.second):
+            data = DeviationSerializer(Deviation.objects.get(pk=deviation.pk)).data
+            self.assertEqual(rollups[deviation.dev_number]['deviation_status'], data['deviation_status'])
+            self.assertEqual(rollups[deviation.dev_number]['completion_percentage'], data['completion_percentage'])
+        self.assertEqual(self._post({'status': 'Done', 'ids': [self.other.pk]}).json()['updated'], 0) # Already Done
+
+    def test_validation(self):
+        self.assertEqual(self._post({'status': 'Closed', 'ids': [1]}).status_code, 400)
+        self.assertEqual(self._post({'status': 'Done'}).status_code, 400)
+        self.assertEqual(self._post({'status': 'Done', 'ids': 'all'}).status_code, 400)
+        self.assertEqual(self._post({'status': 'Done', 'ids': [True]}).status_code, 400) # Not action 1
+        self.assertFalse(Action.objects.filter(pk__in=[action.pk for action in self.mine], status='Done').exists())
+        self.assertEqual(self._post({'status': 'Done', 'dev_number': 'DEV99-0001'}).status_code, 404)
+
+
+class AnalyticsSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        analytics_settings = override_settings(ANALYTICS_DIR=self.directory)
+        analytics_settings.enable()
+        self.addCleanup(analytics_settings.disable)
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw', is_staff=True)
+        self.client.force_login(self.user)
+        self.kept = Deviation.objects.create(dev_number='DEV24-0001', year=2024, owner_plant='Arimex')
+        self.moved = Deviation.objects.create(dev_number='DEV24-0002', year=2024, owner_plant='Arimex')
+        self.removed = Deviation.objects.create(dev_number='DEV23-0001', year=2023, owner_plant='Plant A/B')
+        self.done = Action.objects.create(deviation=self.kept, action_description='Done', status='Done')
+        self.open = Action.objects.create(deviation=self.kept, action_description='Late',
+                                          action_expiration_date=date(2020, 1, 1))
+        self.open.action_responsible_users.add(self.user)
+        Action.objects.create(deviation=self.removed, action_description='Gone')
+
+    def test_full_then_incremental(self):
+        summary = snapshot_analytics(chunk_size=2)
+        self.assertEqual((summary['mode'], summary['deviations_written']), ('full', 3))
+        self.assertEqual(summary['rows'], {'deviations': 3, 'actions': 3, 'responsibles': 1})
+        paths = [file['path'] for file in list_files()]
+        self.assertTrue(any(path.startswith('deviations/year=2024/owner_plant=Arimex/') for path in paths))
+
+        deviations = load_table('deviations').set_index('dev_number')
+        self.assertEqual(deviations.loc['DEV24-0001', 'deviation_status'], 'In Progress')
+        self.assertEqual(deviations.loc['DEV24-0001', 'completion_percentage'], 50)
+        self.assertEqual(deviations.loc['DEV23-0001', 'owner_plant'], 'Plant A/B')
+        actions = load_table('actions').set_index('id')
+        self.assertTrue(actions.loc[self.open.pk, 'is_overdue'])
+        self.assertFalse(actions.loc[self.done.pk, 'is_open'])
+        self.assertEqual(load_table('responsibles')['username'].tolist(), ['alice'])
+
+        self.assertEqual(snapshot_analytics()['deviations_written'], 0) # Nothing changed
+        self.moved.owner_plant = 'Brakes'
+        self.moved.save()
+        self.removed.delete()
+        Action.objects.create(deviation=self.kept, action_description='New')
+        summary = snapshot_analytics()
+        self.assertEqual((summary['mode'], summary['deviations_written']), ('incremental', 3))
+
+        deviations = load_table('deviations').set_index('dev_number')
+        self.assertEqual(sorted(deviations.index), ['DEV24-0001', 'DEV24-0002'])
+        self.assertEqual(deviations.loc['DEV24-0002', 'owner_plant'], 'Brakes')
+        self.assertEqual(deviations.loc['DEV24-0001', 'completion_percentage'], 33)
+        self.assertEqual(len(load_table('actions')), 3)
+        self.assertEqual(read_state()['runs'], 2)
+
+        files_before = len(list_files())
+        self.assertEqual(snapshot_analytics(full=True)['mode'], 'full')
+        self.assertLess(len(list_files()), files_before) # Superseded copies are dropped
+        self.assertEqual(len(load_table('deviations')), 2)
+
+    def test_pruned_change_log_forces_a_full_run(self):
+        snapshot_analytics()
+        self.kept.save()
+        ChangeLogEntry.objects.filter(id__lte=read_state()['cursor'] + 1).delete()
+        self.kept.save()
+        self.assertEqual(snapshot_analytics()['mode'], 'full')
+
+    def test_download_endpoints_and_job(self):
+        created = self.client.post('/api/jobs/', {'kind': 'snapshot_analytics'}, content_type='application/json')
+        self.assertEqual(created.status_code, 201)
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        self.assertEqual(Job.objects.get(pk=created.json()['id']).status, Job.SUCCEEDED)
+
+        listing = self.client.get('/api/analytics/').json()
+        self.assertEqual(listing['state']['last_run']['mode'], 'full')
+        file = listing['files'][0] # year=2023/owner_plant=Plant%20A%2FB: the url keeps the escapes
+        response = self.client.get(file['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), file['bytes'])
+        self.assertEqual(self.client.get('/api/analytics/../_state.json').status_code, 404)
+        self.assertEqual(self.client.get('/api/analytics/_state.json').status_code, 404)
+
+
+class SimilarityIndexTests(TestCase):
+    ACTIONS = ['Sort all parts in stock at the supplier', 'Rework the molding tool cavity 3',
+               'Update the control plan and the PFMEA']
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.original = self._deviation('DEV24-0001', 'Arimex', '177455', self.ACTIONS)
+        self.repeat = self._deviation('DEV24-0002', 'Plant B', '177455', self.ACTIONS[:2] + ['Update the control plan'])
+        self.other = self._deviation('DEV24-0003', 'Arimex', '213784', ['Replace the damaged connector housing'],
+                                     category='Assembly')
+
+    def _deviation(self, dev_number, plant, drawing, actions, category='Molding'):
+        with self.captureOnCommitCallbacks(execute=True):
+            deviation = Deviation.objects.create(dev_number=dev_number, owner_plant=plant, drawing_number=drawing,
+                                                 defect_category=category, molding_defect_type='Flash')
+            for description in actions:
+                Action.objects.create(deviation=deviation, action_description=description)
+        self._run_jobs()
+        return deviation
+
+    def _run_jobs(self):
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+    def _similar(self, dev_number, **params):
+        response = self.client.get(f'/api/deviations/{dev_number}/similar', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_minhash_estimates_jaccard_similarity(self):
+        first = {f'text:{n}' for n in range(200)}
+        second = {f'text:{n}' for n in range(50, 250)} # Jaccard 150 / 250 = 0.6
+        self.assertAlmostEqual(estimated_similarity(signature(first), signature(second)), 0.6, delta=0.12)
+        self.assertEqual(estimated_similarity(signature(first), signature(set(first))), 1.0)
+        self.assertIn('family:1774', shingles({'drawing_number': '177455, 177449'}, []))
+
+    def test_saves_keep_the_index_current(self):
+        self.assertEqual(SimilaritySignature.objects.count(), 3)
+        self.assertEqual(SimilarityBucket.objects.filter(deviation=self.original).count(), 32)
+        body = self._similar('DEV24-0001')
+        self.assertTrue(body['indexed'])
+        self.assertEqual([row['dev_number'] for row in body['results']], ['DEV24-0002'])
+        self.assertGreater(body['results'][0]['similarity'], 0.5)
+
+        # A new action text makes the repeat less alike; a status change does not touch the index
+        action = self.repeat.actions.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            action.status = 'Done'
+            action.save(update_fields=['status'])
+        self.assertEqual(index_deviations([self.repeat.pk]), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            action.action_description = 'Scrap the whole lot and notify the customer'
+            action.save()
+        self._run_jobs()
+        self.assertLess(self._similar('DEV24-0001', min_similarity=0.1)['results'][0]['similarity'],
+                        body['results'][0]['similarity'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.repeat.delete()
+        self._run_jobs()
+        self.assertEqual(self._similar('DEV24-0001', min_similarity=0.1)['results'], [])
+        self.assertFalse(SimilarityBucket.objects.filter(deviation_id=self.repeat.pk).exists())
+
+    def test_lookup_only_reads_the_candidates(self):
+        for n in range(4, 40):
+            self._deviation(f'DEV24-{n:04d}', 'Arimex', str(100000 + n * 1000), [f'Unrelated step {n} for lot {n * 7}'],
+                            category=f'Category {n}')
+        # Session + user, deviation, its signature, candidates with their signatures, candidate rows
+        with self.assertNumQueries(6):
+            body = self._similar('DEV24-0002')
+        self.assertEqual([row['dev_number'] for row in body['results']], ['DEV24-0001'])
+        self.assertEqual(self.client.get('/api/deviations/DEV24-0002/similar', {'min_similarity': 2}).status_code, 400)
+        self.assertEqual(self.client.get('/api/deviations/DEV99-0001/similar').status_code, 404)
+
+    def test_unindexed_deviation_and_clusters_report(self):
+        # bulk_create skips the signals: the endpoint still answers, the command catches up
+        Deviation.objects.bulk_create([Deviation(dev_number='DEV24-0100', owner_plant='Plant C',
+                                                 drawing_number='177455', defect_category='Molding',
+                                                 molding_defect_type='Flash')])
+        added = Deviation.objects.get(dev_number='DEV24-0100')
+        Action.objects.bulk_create([Action(deviation=added, action_description=text, order=n)
+                                    for n, text in enumerate(self.ACTIONS, start=1)])
+        body = self._similar('DEV24-0100')
+        self.assertFalse(body['indexed'])
+        self.assertEqual([row['dev_number'] for row in body['results']], ['DEV24-0001', 'DEV24-0002'])
+
+        out = io.StringIO()
+        call_command('find_duplicate_deviations', reindex=True, stdout=out)
+        self.assertIn('Indexed 1 deviation(s)', out.getvalue())
+        self.assertIn('DEV24-0001, DEV24-0002, DEV24-0100', out.getvalue())
+        self.assertEqual(duplicate_clusters(), [[self.original.pk, self.repeat.pk, added.pk]])
+        self.assertEqual(duplicate_clusters(min_similarity=1.0), [[self.original.pk, added.pk]])
+        with self.assertLogs('deviations.similarity', 'WARNING'): # Buckets of all three are skipped
+            self.assertEqual([len(ids) for ids in duplicate_clusters(max_bucket_size=2)], [2])
+
+    def test_saves_are_indexed_by_one_background_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.repeat.drawing_number = '213784'
+            self.repeat.save()
+            self.other.drawing_number = '177455'
+            self.other.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Action.objects.create(deviation=self.original, action_description='Contain the lot')
+        # Nothing is indexed in the saving request; the saves share one queued job
+        job = Job.objects.get(kind=Job.INDEX_SIMILARITY, status=Job.QUEUED)
+        self.assertEqual(job.params['deviation_ids'], sorted([self.original.pk, self.repeat.pk, self.other.pk]))
+        before = dict(SimilaritySignature.objects.values_list('deviation_id', 'digest'))
+        self._run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.counts['indexed']), (Job.SUCCEEDED, 3))
+        after = dict(SimilaritySignature.objects.values_list('deviation_id', 'digest'))
+        self.assertTrue(all(after[pk] != before[pk] for pk in job.params['deviation_ids']))
+
+
+class MultiWorkbookImportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = User.objects.create_user('jcooper', 'jcooper@example.com', 'pw', first_name='Jeffery', last_name='Cooper')
+
+    def _rows(self, dev_number, plant, actions):
+        return [{'DEV NUMBER': dev_number if n == 0 else None, 'Owner Plant': plant if n == 0 else None,
+                 'Release Date': '2024-03-01' if n == 0 else None, 'Actions': text,
+                 'Action Responsible': 'Jeffery Cooper', 'Action Expiration Date': '2024-04-01'}
+                for n, text in enumerate(actions)]
+
+    def _workbook(self, name, sheets):
+        import pandas as pd
+        path = os.path.join(self.directory, name)
+        with pd.ExcelWriter(path) as writer:
+            for sheet, rows in sheets.items():
+                pd.DataFrame(rows).to_excel(writer, sheet_name=sheet, index=False)
+        return path
+
+    def test_only_imported_actions_are_linked(self):
+        untouched = Action.objects.create(deviation=Deviation.objects.create(dev_number='DEV23-0001'),
+                                          action_description='Entered by hand', action_responsible='Jeffery Cooper')
+        self._workbook('a_arimex.xlsx', {'Open': self._rows('DEV24-0001', 'Arimex', ['Sort parts'])})
+        counts = import_workbooks([self.directory], log=lambda message: None)
+        self.assertEqual(counts['actions_linked_to_users'], 1)
+        self.assertEqual(list(Action.objects.get(action_description='Sort parts').action_responsible_users.all()),
+                         [self.user])
+        self.assertFalse(untouched.action_responsible_users.exists()) # Left to link_responsible_users
+
+    def test_workbooks_are_parsed_in_parallel_and_conflicts_resolved(self):
+        self._workbook('a_arimex.xlsx', {
+            'Open': self._rows('DEV24-0001', 'Arimex', ['Sort parts']) + self._rows('DEV24-0002', 'Arimex', ['Rework', 'Audit']),
+            'Plants': [{'Plant': 'Arimex'}],
+        })
+        self._workbook('b_plant.xlsx', {
+            'Open': self._rows('DEV24-0001', 'Plant B', ['Sort parts', 'Notify customer'])
+                    + self._rows('DEV24-0002', 'Plant B', ['Rework again', 'Audit again']),
+            'Closed': self._rows('DEV24-0003', 'Plant B', ['Scrap']),
+        })
+        logs = []
+        counts = import_workbooks([self.directory], sheets='*', workers=2, batch_size=2, log=logs.append)
+        self.assertEqual(counts, {'deviations_created': 3, 'deviations_updated': 0, 'actions_imported': 5,
+                                  'actions_linked_to_users': 5, 'workbooks': 2, 'conflicts': 2}, logs)
+        self.assertIn('Skipped a_arimex.xlsx:Plants: no "DEV NUMBER" column.', logs)
+        # More actions win; on a tie the earlier workbook does
+        self.assertEqual(Deviation.objects.get(dev_number='DEV24-0001').owner_plant, 'Plant B')
+        tied = Deviation.objects.get(dev_number='DEV24-0002')
+        self.assertEqual((tied.owner_plant, tied.dev_sequence, tied.release_date), ('Arimex', 2, date(2024, 3, 1)))
+        self.assertEqual(list(tied.actions.values_list('order', 'action_description')), [(1, 'Rework'), (2, 'Audit')])
+        self.assertIn('Conflict: DEV24-0002 taken from a_arimex.xlsx:Open (also in b_plant.xlsx:Open).', logs)
+        self.assertEqual(ChangeLogEntry.objects.filter(model='action', operation='create').count(), 5)
+
+        # Re-importing one sheet replaces the actions of its deviations only
+        cursor = latest_cursor()
+        counts = import_workbooks([os.path.join(self.directory, 'b_plant.xlsx')], sheets=['Closed'], log=logs.append)
+        self.assertEqual((counts['deviations_created'], counts['deviations_updated'], counts['actions_imported']), (0, 1, 1))
+        scrapped = Deviation.objects.get(dev_number='DEV24-0003')
+        self.assertEqual(scrapped.version, 2)
+        self.assertEqual(list(scrapped.actions.values_list('action_description', flat=True)), ['Scrap'])
+        self.assertEqual(Action.objects.count(), 5)
+        self.assertEqual(
+            sorted(ChangeLogEntry.objects.filter(id__gt=cursor).values_list('model', 'operation').distinct()),
+            [('action', 'create'), ('action', 'delete'), ('action', 'update'), ('deviation', 'update')])
+
+    def test_command_reports_missing_files_without_writing(self):
+        out = io.StringIO()
+        call_command('import_deviations', os.path.join(self.directory, 'missing.xlsx'), stdout=out)
+        self.assertIn('Excel file not found', out.getvalue())
+        self.assertIn('nothing was changed', out.getvalue())
+        self.assertFalse(Deviation.objects.exists())
+
+
+class AttachmentPreviewTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.staff = User.objects.create_user('planner', 'planner@example.com', 'pw', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def _pdf(self, pages=3):
+        import pypdfium2 as pdfium
+        document = pdfium.PdfDocument.new()
+        for _ in range(pages):
+            document.new_page(612, 792) # Letter, in points
+        buffer = io.BytesIO()
+        document.save(buffer)
+        document.close()
+        return buffer.getvalue()
+
+    def _deviation(self, dev_number, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Deviation.objects.create(dev_number=dev_number,
+                                            attachment=SimpleUploadedFile(name, content, content_type='application/pdf'))
+
+    def test_identical_files_are_rendered_once(self):
+        pdf = self._pdf()
+        first = self._deviation('DEV24-0001', 'DEV24-0001.pdf', pdf)
+        second = self._deviation('DEV24-0002', 'DEV24-0002.pdf', pdf)
+        broken = self._deviation('DEV24-0003', 'DEV24-0003.pdf', b'%PDF-1.7 truncated')
+        # Saving deviations with attachments queued one job, not one per deviation
+        self.assertEqual(Job.objects.filter(kind=Job.RENDER_PREVIEWS, status=Job.QUEUED).count(), 1)
+
+        counts = render_previews()
+        self.assertEqual((counts['rendered'], counts['reused'], counts['failed']), (2, 1, 1))
+        self.assertEqual(AttachmentPreview.objects.count(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.attachment_preview_id, second.attachment_preview_id)
+        preview = first.attachment_preview
+        self.assertEqual((preview.page_count, preview.file_size, preview.width), (3, len(pdf), 320))
+        self.assertAlmostEqual(preview.height, 320 * 792 / 612, delta=1)
+        broken.refresh_from_db()
+        self.assertIn('Could not render', broken.attachment_preview.error)
+        self.assertEqual(render_previews()['deviations'], 0)
+        # Derived data: previews neither bump versions nor feed the change log
+        self.assertEqual(first.version, 1)
+
+        # A new file drops the preview until it is rendered again
+        first.attachment = SimpleUploadedFile('DEV24-0001.pdf', self._pdf(pages=1))
+        first.save(update_fields=['attachment'])
+        first.refresh_from_db()
+        self.assertIsNone(first.attachment_preview)
+        render_previews()
+        first.refresh_from_db()
+        self.assertEqual(first.attachment_preview.page_count, 1)
+
+    def test_preview_endpoint_is_cacheable(self):
+        self._deviation('DEV24-0001', 'DEV24-0001.pdf', self._pdf())
+        self.assertEqual(self.client.get('/api/deviations/DEV24-0001/attachment/preview').status_code, 404)
+        render_previews()
+
+        data = self.client.get('/api/deviations/DEV24-0001/').json()['attachment_preview']
+        self.assertEqual(data['page_count'], 3)
+        response = self.client.get(data['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['X-Page-Count'], '3')
+
+        unversioned = self.client.get('/api/deviations/DEV24-0001/attachment/preview')
+        self.assertEqual(unversioned['Cache-Control'], 'private, no-cache')
+        revalidated = self.client.get('/api/deviations/DEV24-0001/attachment/preview',
+                                      HTTP_IF_NONE_MATCH=unversioned['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_job_and_command_render_the_backlog(self):
+        self._deviation('DEV24-0001', 'DEV24-0001.pdf', self._pdf())
+        # Attachments linked without save(), like before previews existed
+        Deviation.objects.create(dev_number='DEV24-0002')
+        Deviation.objects.filter(dev_number='DEV24-0002').update(attachment='deviation_attachments/missing.pdf')
+
+        job = Job.objects.get(kind=Job.RENDER_PREVIEWS)
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED, job.log)
+        self.assertEqual((job.counts['rendered'], job.counts['missing']), (1, 1))
+
+        out = io.StringIO()
+        call_command('render_attachment_previews', force=True, stdout=out)
+        self.assertIn('0 rendered', out.getvalue())
+        self.assertIn('1 reused', out.getvalue())
+
+
+class BulkDeviationUpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('jcooper', 'jcooper@example.com', 'pw', first_name='Jeffery', last_name='Cooper')
+        self.client.force_login(self.user)
+        self.existing = Deviation.objects.create(dev_number='DEV24-0001', owner_plant='Arimex', sbu='LND')
+        self.old_action = Action.objects.create(deviation=self.existing, action_description='Old action')
+
+    def _upsert(self, body):
+        return self.client.post('/api/deviations/bulk_upsert', body if isinstance(body, str) else json.dumps(body),
+                                content_type='application/json')
+
+    def test_items_are_upserted_on_dev_number(self):
+        cursor = latest_cursor()
+        response = self._upsert([
+            {'dev_number': 'DEV24-0001', 'owner_plant': 'Plant B',
+             'actions': [{'action_description': 'Sort parts', 'action_responsible': 'Jeffery Cooper'},
+                         {'action_description': 'Audit', 'status': 'Done'}]},
+            {'dev_number': 'DEV24-0002', 'release_date': '2024-03-01', 'version': 1}, # Based on a version it never had
+            {'dev_number': 'DEV24-0003', 'release_date': 'not a date'},
+            {'owner_plant': 'Arimex'},
+            {'dev_number': 'DEV24-0004', 'drawing_number': '177455', 'actions': []},
+            {'dev_number': 'DEV24-0004'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual({key: body[key] for key in ('received', 'created', 'updated', 'conflict', 'invalid')},
+                         {'received': 6, 'created': 1, 'updated': 1, 'conflict': 1, 'invalid': 3})
+        self.assertEqual([result['result'] for result in body['results']],
+                         ['updated', 'conflict', 'invalid', 'invalid', 'created', 'invalid'])
+        self.assertEqual(body['results'][0], {'dev_number': 'DEV24-0001', 'result': 'updated',
+                                              'id': self.existing.pk, 'version': 2})
+        self.assertIn('release_date', body['results'][2]['errors'])
+
+        # Only the fields given are written; the actions were replaced and linked
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.owner_plant, self.existing.sbu, self.existing.version), ('Plant B', 'LND', 2))
+        self.assertEqual(list(self.existing.actions.values_list('order', 'action_description', 'status')),
+                         [(1, 'Sort parts', 'Not Started'), (2, 'Audit', 'Done')])
+        self.assertEqual(list(self.existing.actions.get(order=1).action_responsible_users.all()), [self.user])
+        created = Deviation.objects.get(dev_number='DEV24-0004')
+        self.assertEqual((created.pk, created.dev_sequence, created.version), (body['results'][4]['id'], 4, 1))
+        self.assertFalse(Deviation.objects.filter(dev_number__in=['DEV24-0002', 'DEV24-0003']).exists())
+        self.assertEqual(
+            sorted(ChangeLogEntry.objects.filter(id__gt=cursor).values_list('model', 'operation', 'object_id')),
+            sorted([('deviation', 'update', self.existing.pk), ('deviation', 'create', created.pk),
+                    ('action', 'delete', self.old_action.pk)]
+                   + [('action', 'create', pk) for pk in self.existing.actions.values_list('id', flat=True)]
+                   + [('action', 'update', self.existing.actions.get(order=1).pk)])) # Linking its responsible user
+
+    def test_large_bodies_stream_in_batches(self):
+        items = [{'dev_number': f'DEV25-{n:04d}', 'owner_plant': 'Arimex' if n % 2 else 'Plant B',
+                  'actions': [{'action_description': f'Step {step}'} for step in range(2)]} for n in range(1, 1201)]
+        with self.settings(BULK_UPSERT_BATCH_SIZE=500), CaptureQueriesContext(connections['default']) as queries:
+            response = self._upsert(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1200)
+        self.assertEqual(Action.objects.filter(deviation__dev_prefix='DEV', deviation__dev_year=25).count(), 2400)
+        self.assertLess(len(queries), 100) # A few statements per batch, not per item
+
+        # Malformed JSON and oversized requests change nothing
+        self.assertEqual(self._upsert('[{"dev_number": "DEV26-0001"}, {"dev_number": ').status_code, 400)
+        with self.settings(BULK_UPSERT_BATCH_SIZE=1, BULK_UPSERT_MAX_ITEMS=2):
+            response = self._upsert([{'dev_number': f'DEV26-{n:04d}'} for n in range(1, 4)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Deviation.objects.filter(dev_year=26).exists())
+
+    def test_other_writers_are_not_blocked_while_the_body_arrives(self):
+        body = json.dumps([{'dev_number': 'DEV24-0002'}]).encode()
+        other_writer_got_in = []
+
+        class SlowUpload(io.BytesIO):
+            def read(self, size=-1):
+                if not other_writer_got_in: # Mid-upload, another request wants to write
+                    def write():
+                        acquired = write_queue.acquire(timeout=2)
+                        other_writer_got_in.append(acquired)
+                        if acquired:
+                            write_queue.release()
+                    thread = threading.Thread(target=write)
+                    thread.start()
+                    thread.join(5)
+                return super().read(size)
+
+        response = self.client.post('/api/deviations/bulk_upsert', body, content_type='application/json',
+                                    **{'wsgi.input': SlowUpload(body)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(other_writer_got_in, [True])
+        self.assertTrue(Deviation.objects.filter(dev_number='DEV24-0002').exists())
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        single_flight = SingleFlight()
+        started, release, calls, results = threading.Event(), threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'rows': [1, 2, 3]}
+
+        def call():
+            results.append(single_flight.run('key', compute, timeout=5))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=call) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05) # Let the followers reach the wait
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(role for _, role in results), ['follower'] * 5 + ['leader'])
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertEqual(single_flight.in_flight, 0)
+        # Nothing is cached once the flight has landed
+        self.assertEqual(single_flight.run('key', lambda: 'fresh'), ('fresh', 'leader'))
+
+    def test_waiters_fall_back_on_timeout_and_failure(self):
+        single_flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            raise RuntimeError('leader failed')
+
+        def lead():
+            with self.assertRaises(RuntimeError):
+                single_flight.run('key', slow)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        self.assertEqual(single_flight.run('key', lambda: 'own', timeout=0.01), ('own', 'fallback'))
+        waiter = []
+        thread = threading.Thread(target=lambda: waiter.append(single_flight.run('key', lambda: 'own', timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        release.set()
+        for t in (leader, thread):
+            t.join(5)
+        self.assertEqual(waiter, [('own', 'fallback')])
+
+
+class CoalescedDeviationListTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw', is_staff=True)
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        Deviation.objects.create(dev_number='DEV24-0001', created_by_user=self.bob)
+
+    def _key(self, user, path):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=user)
+        view = DeviationListCreateAPIView()
+        request = view.initialize_request(request)
+        return coalescing_key(request, view.coalesce_scope(request))
+
+    def test_key_is_normalized_and_scoped(self):
+        self.assertEqual(self._key(self.alice, '/api/deviations/?dev_prefix=DEV&dev_year=24'),
+                         self._key(self.bob, '/api/deviations/?dev_year=24&dev_prefix=DEV'))
+        self.assertNotEqual(self._key(self.alice, '/api/deviations/?my_deviations=true'),
+                            self._key(self.bob, '/api/deviations/?my_deviations=true'))
+        before = self._key(self.alice, '/api/deviations/')
+        Deviation.objects.create(dev_number='DEV24-0002') # Requests after a write never join an older flight
+        self.assertNotEqual(self._key(self.alice, '/api/deviations/'), before)
+
+    def test_identical_requests_get_the_shared_result(self):
+        self.client.force_login(self.alice)
+        key = self._key(self.alice, '/api/deviations/')
+        shared = [{'dev_number': 'SHARED-0001'}]
+        started, release = threading.Event(), threading.Event()
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return shared
+
+        thread = threading.Thread(target=flights.run, args=(key, leader))
+        thread.start()
+        started.wait(5)
+        threading.Timer(0.1, release.set).start()
+        response = self.client.get('/api/deviations/')
+        thread.join(5)
+        self.assertEqual(response.json(), shared)
+        self.assertIn('coalesce;dur=', response['Server-Timing'])
+
+        self.assertEqual([row['dev_number'] for row in self.client.get('/api/deviations/').json()], ['DEV24-0001'])
+        metrics = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('deviations_coalesced_requests_total{view="deviation-list-create",role="follower"} 1', metrics)
+        self.assertIn('deviations_coalesced_requests_total{view="deviation-list-create",role="leader"} 1', metrics)
+
+
+class EventBrokerTests(TestCase):
+    def test_in_process_backend_filters_by_deviation(self):
+        async def scenario():
+            broker = InProcessBackend()
+            loop = asyncio.get_running_loop()
+            watching_one = Subscription(loop, deviation_ids={1})
+            watching_all = Subscription(loop)
+            broker.subscribe(watching_one)
+            broker.subscribe(watching_all)
+            await sync_to_async(broker.publish)([ # Looks the versions up, as on commit
+                ChangeLogEntry(pk=10, model='action', object_id=5, deviation_id=1, operation='update'),
+                ChangeLogEntry(pk=11, model='deviation', object_id=2, deviation_id=2, operation='create'),
+            ])
+            await asyncio.sleep(0) # Let call_soon_threadsafe callbacks run
+            return [e['cursor'] for e in self._drain(watching_one)], [e['cursor'] for e in self._drain(watching_all)]
+
+        self.assertEqual(asyncio.run(scenario()), ([10], [10, 11]))
+
+    def _drain(self, subscription):
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.user = User.objects.create_user('engineer', 'engineer@example.com', 'pw')
+        self.token = str(AccessToken.for_user(self.user))
+        self.deviation = Deviation.objects.create(dev_number='DEV24-0439')
+        self.other = Deviation.objects.create(dev_number='DEV25-0003')
+
+    def _scope(self, query):
+        return {'type': 'http', 'method': 'GET', 'path': '/api/events/', 'query_string': query.encode(), 'headers': []}
+
+    async def _open(self, query):
+        app = EventStreamRouter(django_application=None)
+        communicator = ApplicationCommunicator(app, self._scope(query))
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(2)
+        return communicator, start
+
+    async def _next_event(self, communicator):
+        while True:
+            body = (await communicator.receive_output(2))['body']
+            if body.startswith(b'id:'):
+                return json.loads(body.split(b'data: ', 1)[1])
+
+    async def test_requires_a_valid_token(self):
+        communicator, start = await self._open('token=not-a-jwt')
+        self.assertEqual(start['status'], 401)
+
+    async def test_pushes_committed_changes_for_subscribed_deviation(self):
+        communicator, start = await self._open(f'token={self.token}&deviations=DEV24-0439')
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+
+        def edit():
+            with self.captureOnCommitCallbacks(execute=True):
+                Action.objects.create(deviation=self.other, action_description='Not for us')
+                return Action.objects.create(deviation=self.deviation, action_description='Sort parts').pk
+        action_id = await sync_to_async(edit)()
+
+        event = await self._next_event(communicator)
+        self.assertEqual(event['model'], 'action')
+        self.assertEqual(event['id'], action_id)
+        self.assertEqual(event['deviation_id'], self.deviation.pk)
+        self.assertEqual(event['op'], 'create')
+        self.assertEqual(event['version'], 1) # Lets the client skip changes it already holds
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(2)
+
+    async def test_replays_missed_events_from_last_event_id(self):
+        def edit():
+            cursor = ChangeLogEntry.objects.order_by('-id').first().pk
+            self.deviation.drawing_number = '177455'
+            self.deviation.save()
+            return cursor
+        cursor = await sync_to_async(edit)()
+
+        communicator, _ = await self._open(f'token={self.token}&mine=false&since={cursor}')
+        event = await self._next_event(communicator)
+        self.assertEqual((event['model'], event['op'], event['id'], event['version']),
+                         ('deviation', 'update', self.deviation.pk, 2))
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(2)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.client.force_login(self.alice)
+        self.closed = Deviation.objects.create(dev_number='DEV20-0009', drawing_number='177455',
+                                               expiration_date=date(2020, 6, 30))
+        first = Action.objects.create(deviation=self.closed, action_description='Sort parts', status='Done')
+        first.action_responsible_users.add(self.bob)
+        Action.objects.create(deviation=self.closed, action_description='Audit', status='Done')
+        self.open = Deviation.objects.create(dev_number='DEV20-0002', expiration_date=date(2020, 6, 30))
+        Action.objects.create(deviation=self.open, action_description='Still open')
+        recent = Deviation.objects.create(dev_number='DEV20-0010', expiration_date=date.today())
+        Action.objects.create(deviation=recent, action_description='Done', status='Done')
+        Deviation.objects.create(dev_number='DEV20-0001', expiration_date=date(2020, 6, 30)) # No actions: never Done
+        index_deviations([self.closed.pk])
+
+    def _dev_numbers(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [row['dev_number'] for row in response.json()]
+
+    def test_moves_closed_deviations_that_expired_long_ago(self):
+        action_ids = sorted(self.closed.actions.values_list('pk', flat=True))
+        self.assertEqual(archive_deviations(dry_run=True)['candidates'], 1)
+        self.assertEqual(archive_deviations(batch_size=1), {'candidates': 1, 'deviations': 1, 'actions': 2})
+
+        self.assertFalse(Deviation.objects.filter(pk=self.closed.pk).exists())
+        self.assertFalse(Action.objects.filter(pk__in=action_ids).exists())
+        self.assertFalse(SimilaritySignature.objects.filter(deviation_id=self.closed.pk).exists())
+        self.assertEqual(Deviation.objects.count(), 3)
+        archived = ArchivedDeviation.objects.get(dev_number='DEV20-0009')
+        self.assertEqual((archived.pk, archived.drawing_number, archived.dev_sequence), (self.closed.pk, '177455', 9))
+        self.assertEqual(sorted(archived.actions.values_list('pk', flat=True)), action_ids)
+        self.assertEqual(list(ArchivedAction.objects.get(pk=action_ids[0]).action_responsible_users.all()), [self.bob])
+        self.assertEqual(annotate_deviation_status(ArchivedDeviation.objects.all()).get().deviation_status, 'Done')
+        self.assertTrue(ChangeLogEntry.objects.filter(model=ChangeLogEntry.DEVIATION, object_id=self.closed.pk,
+                                                      operation=ChangeLogEntry.DELETE).exists())
+        self.assertEqual(archive_deviations()['candidates'], 0)
+
+    def test_archived_deviations_are_only_read_on_request(self):
+        archive_deviations()
+        self.assertEqual(self._dev_numbers('/api/deviations/'), ['DEV20-0001', 'DEV20-0002', 'DEV20-0010'])
+        self.assertEqual(self._dev_numbers('/api/deviations/?include_archived=true'),
+                         ['DEV20-0001', 'DEV20-0002', 'DEV20-0009', 'DEV20-0010'])
+        self.assertEqual(self._dev_numbers('/api/deviations/?include_archived=true&ordering=-dev_number'),
+                         ['DEV20-0010', 'DEV20-0009', 'DEV20-0002', 'DEV20-0001'])
+        self.client.force_login(self.bob)
+        self.assertEqual(self._dev_numbers('/api/deviations/?include_archived=true&my_deviations=true'), ['DEV20-0009'])
+
+        rows = self.client.get('/api/deviations/?include_archived=true&dev_from=DEV20-0009&dev_to=DEV20-0009').json()
+        self.assertEqual(rows[0]['deviation_status'], 'Done')
+        self.assertEqual(rows[0]['actions'][0]['action_responsible_users'], ['bob'])
+        self.assertIsNotNone(rows[0]['archived_at'])
+        response = self.client.get('/api/deviations/DEV20-0009/?actions_limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['id'], len(response.json()['actions'])), (self.closed.pk, 2))
+        self.assertEqual(self.client.patch('/api/deviations/DEV20-0009/', {'sbu': 'LND'},
+                                           content_type='application/json').status_code, 404)
+
+    def test_archived_list_pages_are_cut_in_sql(self):
+        for n in range(11, 41):
+            closed = Deviation.objects.create(dev_number=f'DEV20-{n:04d}', expiration_date=date(2020, 6, 30))
+            Action.objects.create(deviation=closed, action_description='Done', status='Done')
+        archive_deviations()
+        self.assertEqual(ArchivedDeviation.objects.count(), 31)
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            page = self._dev_numbers('/api/deviations/?include_archived=true&limit=3&offset=2')
+        self.assertEqual(page, ['DEV20-0009', 'DEV20-0010', 'DEV20-0011'])
+        # One UNION ALL of the sort keys cut to the page, then only the page's rows are loaded
+        union = [query['sql'] for query in queries if 'UNION ALL' in query['sql']]
+        self.assertEqual(len(union), 1)
+        self.assertIn('LIMIT 3 OFFSET 2', union[0])
+        for sql in [query['sql'] for query in queries]:
+            if 'FROM "deviations_deviation"' in sql or 'FROM "deviations_archiveddeviation"' in sql:
+                self.assertTrue(sql in union or ' IN (' in sql, sql)
+        self.assertEqual(self._dev_numbers('/api/deviations/?include_archived=true&ordering=-dev_number&limit=2'),
+                         ['DEV20-0040', 'DEV20-0039'])
+        self.assertEqual(self._dev_numbers('/api/deviations/?limit=2&offset=1'), ['DEV20-0002', 'DEV20-0010'])
+        self.assertEqual(self.client.get('/api/deviations/?include_archived=true&limit=0').status_code, 400)
+
+    def test_archived_numbers_stay_taken(self):
+        archive_deviations()
+        self.assertEqual(allocate_dev_number('DEV', 2020), 'DEV20-0011')
+        DevNumberCounter.objects.all().delete()
+        Deviation.objects.filter(dev_number='DEV20-0010').delete()
+        self.assertEqual(allocate_dev_number('DEV', 2020), 'DEV20-0010') # The archived DEV20-0009 is still counted
+
+        response = self.client.post('/api/deviations/', {'dev_number': 'DEV20-0009'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dev_number', response.json())
+        response = self.client.post('/api/deviations/bulk_upsert', json.dumps([{'dev_number': 'DEV20-0009'}]),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['result'], 'invalid')
+        self.assertFalse(Deviation.objects.filter(dev_number='DEV20-0009').exists())
+
+    def test_restore_moves_deviations_back(self):
+        archive_deviations()
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('restore_deviations', 'DEV20-0009', 'DEV99-0001', stdout=stdout, stderr=stderr)
+        call_command('run_jobs', once=True, stdout=io.StringIO()) # Reindexes the restored deviation
+        self.assertIn('Restored 1 deviation(s) and 2 action(s)', stdout.getvalue())
+        self.assertIn('DEV99-0001 is not archived', stderr.getvalue())
+
+        deviation = Deviation.objects.get(dev_number='DEV20-0009')
+        self.assertEqual((deviation.pk, deviation.dev_sequence), (self.closed.pk, 9))
+        self.assertEqual(list(deviation.actions.values_list('status', flat=True)), ['Done', 'Done'])
+        self.assertEqual(list(deviation.actions.first().action_responsible_users.all()), [self.bob])
+        self.assertFalse(ArchivedDeviation.objects.exists())
+        self.assertFalse(ArchivedAction.objects.exists())
+        self.assertTrue(SimilaritySignature.objects.filter(deviation=deviation).exists())
+        self.assertTrue(ChangeLogEntry.objects.filter(model=ChangeLogEntry.DEVIATION, object_id=deviation.pk,
+                                                      operation=ChangeLogEntry.CREATE).exists())
+        with self.assertRaises(CommandError):
+            call_command('restore_deviations', stdout=stdout)
+
+    def test_analytics_keep_archived_deviations(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshot_analytics(directory.name)
+        archive_deviations()
+        self.assertEqual(snapshot_analytics(directory.name)['mode'], 'incremental')
+        deviations = load_table('deviations', directory.name).set_index('dev_number')
+        self.assertEqual(deviations.loc['DEV20-0009', 'deviation_status'], 'Done')
+        self.assertEqual(len(load_table('responsibles', directory.name)), 1)
+        summary = snapshot_analytics(directory.name, full=True)
+        self.assertEqual(summary['rows'], {'deviations': 4, 'actions': 4, 'responsibles': 1})
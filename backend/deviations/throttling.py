@@ -0,0 +1,105 @@
+# deviation_tracker_app/deviation_backend/deviations/throttling.py
+#
+# Per-user API rate limits, so one runaway script or retry loop cannot keep the
+# single SQLite writer busy for everyone else.
+#
+# Every request takes a token from the bucket of its (scope, user) pair; anonymous
+# requests are keyed by client IP. Buckets hold up to N tokens and refill at N per
+# period, for the rates in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] ('1200/min').
+# They live in process memory behind one lock: a check is a dict lookup and a few
+# float operations, no cache round trip. Each worker process has its own buckets.
+
+import threading
+import time
+from functools import lru_cache
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .instrumentation import registry
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+MAX_BUCKETS = 10000 # Above this, buckets that have refilled completely are dropped
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'120/min' -> (120, 2.0): bucket capacity and tokens refilled per second."""
+    num, period = rate.split('/')
+    num = int(num)
+    return num, num / PERIODS[period[0]]
+
+
+class TokenBuckets:
+    """Token buckets keyed by any hashable, e.g. ('write', user_id)."""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.max_buckets = max_buckets
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, capacity, refill_rate, now=None):
+        """Takes one token from bucket `key`. Returns 0.0 if it had one, else the seconds until it will."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = [float(capacity), now, capacity, refill_rate]
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / refill_rate
+
+    def _prune(self, now):
+        # A bucket that has refilled completely behaves exactly like a new one.
+        full = [key for key, (tokens, stamp, capacity, rate) in self._buckets.items()
+                if tokens + (now - stamp) * rate >= capacity]
+        for key in full:
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+buckets = TokenBuckets()
+
+
+class ScopedTokenBucketThrottle(BaseThrottle):
+    """
+    Throttles each user per scope: 'read' for GET/HEAD/OPTIONS, 'write' for the rest,
+    unless the view's `throttle_scopes` maps the method (or '*') to another scope such
+    as 'heavy'. Scopes without a rate in DEFAULT_THROTTLE_RATES are not limited.
+    Throttled requests get a 429 with a Retry-After header.
+    """
+
+    def get_scope(self, request, view):
+        scopes = getattr(view, 'throttle_scopes', None) or {}
+        return scopes.get(request.method) or scopes.get('*') or ('read' if request.method in SAFE_METHODS else 'write')
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        user = request.user
+        ident = user.pk if user is not None and user.is_authenticated else f'ip:{self.get_ident(request)}'
+        wait = buckets.take((scope, ident), *parse_rate(rate))
+        if wait:
+            self.wait_seconds = wait
+            registry.increment('throttled_requests', (('scope', scope),))
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
@@ -4,18 +4,36 @@ from django.urls import path
 from .views import (
     DeviationListCreateAPIView,
     DeviationDetailUpdateDeleteAPIView,
+    BulkDeviationUpsertAPIView,
     ActionListCreateAPIView,
     ActionDetailUpdateDeleteAPIView,
     UserListAPIView,        # <--- NEW: Import UserListAPIView
     CurrentUserAPIView,     # <--- NEW: Import CurrentUserAPIView
-    ReorderActionsAPIView   # <--- NEW: Import ReorderActionsAPIView
+    ReorderActionsAPIView,  # <--- NEW: Import ReorderActionsAPIView
+    SimilarDeviationsAPIView,
+    AttachmentPreviewAPIView,
+    MetricsAPIView,
+    ChangeFeedAPIView,
+    OverdueActionsAPIView,
+    BulkActionStatusAPIView,
+    NextDevNumberAPIView,
+    JobListCreateAPIView,
+    JobDetailAPIView,
+    JobResultAPIView,
+    AnalyticsListAPIView,
+    AnalyticsFileAPIView,
 )
 
 urlpatterns = [
     # Deviation URLs
     path('deviations/', DeviationListCreateAPIView.as_view(), name='deviation-list-create'),
+    # Many deviations (with their actions) in one streamed JSON array, keyed on dev_number
+    path('deviations/bulk_upsert', BulkDeviationUpsertAPIView.as_view(), name='deviation-bulk-upsert'),
     path('deviations/<str:dev_number>/', DeviationDetailUpdateDeleteAPIView.as_view(), name='deviation-detail-update-delete'),
 
+    # Reserve the next free DEV number (DEV25-0193)
+    path('deviation-numbers/next', NextDevNumberAPIView.as_view(), name='next-dev-number'),
+
     # Action URLs (nested under deviation)
     path('deviations/<str:dev_number>/actions/', ActionListCreateAPIView.as_view(), name='action-list-create'),
     path('deviations/<str:dev_number>/actions/<int:action_id>/', ActionDetailUpdateDeleteAPIView.as_view(), name='action-detail-update-delete'),
@@ -24,7 +42,34 @@ urlpatterns = [
     # This path will be accessed by the frontend as /api/deviations/{dev_number}/reorder_actions/
     path('deviations/<str:dev_number>/reorder_actions/', ReorderActionsAPIView.as_view(), name='reorder-actions'),
 
+    # Likely duplicates of a deviation (MinHash/LSH index, see similarity.py)
+    path('deviations/<str:dev_number>/similar', SimilarDeviationsAPIView.as_view(), name='similar-deviations'),
+
+    # First-page thumbnail of the attachment (see previews.py)
+    path('deviations/<str:dev_number>/attachment/preview', AttachmentPreviewAPIView.as_view(), name='attachment-preview'),
+
+    # Open actions past their expiration date, grouped by owner
+    path('actions/overdue', OverdueActionsAPIView.as_view(), name='overdue-actions'),
+
+    # Move many actions to one status: {"status", "ids"} or {"status", "dev_number", "assigned_to_me"}
+    path('actions/bulk_status', BulkActionStatusAPIView.as_view(), name='bulk-action-status'),
+
     # User API URLs (assuming these are part of your 'api/' namespace)
     path('users/', UserListAPIView.as_view(), name='user-list'),
     path('users/me/', CurrentUserAPIView.as_view(), name='current-user'),
-]
\ No newline at end of file
+
+    # Background jobs (imports, exports, linking, reminders), run by `manage.py run_jobs`
+    path('jobs/', JobListCreateAPIView.as_view(), name='job-list-create'),
+    path('jobs/<int:job_id>/', JobDetailAPIView.as_view(), name='job-detail'),
+    path('jobs/<int:job_id>/result', JobResultAPIView.as_view(), name='job-result'),
+
+    # Parquet copy for reporting (`manage.py snapshot_analytics`)
+    path('analytics/', AnalyticsListAPIView.as_view(), name='analytics-list'),
+    path('analytics/<path:path>', AnalyticsFileAPIView.as_view(), name='analytics-file'),
+
+    # Incremental sync: /api/changes?since=<cursor>
+    path('changes', ChangeFeedAPIView.as_view(), name='change-feed'),
+
+    # Prometheus scrape endpoint (staff or X-Metrics-Token)
+    path('_metrics', MetricsAPIView.as_view(), name='metrics'),
+]
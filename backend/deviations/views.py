@@ -1,27 +1,215 @@
 # deviation_tracker_app/deviation_backend/deviations/views.py (FINAL, FULLY MODIFIED CODE - ManyToMany Responsibles)
 
+import codecs
+import json
+import time
+
 from rest_framework import generics, status
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import APIException, NotFound, ParseError, PermissionDenied, ValidationError
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.http import FileResponse, Http404, HttpResponse
 from django.db import transaction, models # Import transaction and models for Max
 from django.shortcuts import get_object_or_404
-from django.db.models import Q # Import Q for complex queries
+from django.urls import reverse
+from django.db.models import F, Q # Import Q for complex queries
+
+from .models import ArchivedDeviation, ChangeLogEntry, Deviation, Action, Job, VersionConflict, parse_dev_number
+from .serializers import (
+    DeviationSerializer, ActionSerializer, UserSerializer, DeviationChangeSerializer, DeviationPreviewSerializer,
+    DeviationUpsertSerializer, JobSerializer, JobDetailSerializer, ArchivedDeviationSerializer,
+)
+from .changes import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, changed_querysets, collect_changes, oldest_cursor, record_action_changes,
+)
+from .instrumentation import registry
+from .permissions import IsStaffOrMetricsToken
+from .reports import annotate_deviation_status, deviation_rollups, overdue_actions, overdue_groups, owner_counts
+from .jobs import STAFF_ONLY_KINDS, enqueue
+from .numbering import DEFAULT_PREFIX, allocate_dev_number
+from .bulk import set_actions_status, upsert_deviations
+from .db import serialized_write
+from .responsibles import UserNameIndex
+from .analytics import analytics_dir, list_files, read_state
+from .similarity import similar_deviations
+from .previews import version_tag
+from .coalescing import CoalescedListMixin
+from .archive import archived_dev_numbers, natural_page
+
+
+def parse_int_param(request, name, default=None, minimum=0, maximum=None):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ParseError(f'`{name}` must be an integer.')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ParseError(f'`{name}` must be between {minimum} and {maximum}.' if maximum is not None
+                         else f'`{name}` must be at least {minimum}.')
+    return value
+
+
+def dev_number_bound(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    prefix, year, sequence = parse_dev_number(value)
+    if prefix == '':
+        raise ParseError(f'`{name}` must look like DEV24-0400.')
+    return prefix, year, sequence
+
+
+def filter_dev_number_range(queryset, low=None, high=None):
+    """Deviations whose parsed DEV number lies in [low, high] (either bound optional), using deviation_dev_key_idx."""
+    prefixes = {bound[0] for bound in (low, high) if bound}
+    if len(prefixes) > 1:
+        raise ParseError('`dev_from` and `dev_to` must have the same prefix.')
+    if prefixes:
+        queryset = queryset.filter(dev_prefix=prefixes.pop())
+    if low:
+        _, year, sequence = low
+        queryset = queryset.filter(Q(dev_year__gt=year) | Q(dev_year=year, dev_sequence__gte=sequence))
+    if high:
+        _, year, sequence = high
+        queryset = queryset.filter(Q(dev_year__lt=year) | Q(dev_year=year, dev_sequence__lte=sequence))
+    return queryset
+
+
+class VersionConflictError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This was changed by someone else in the meantime. Reload it and try again.'
+    default_code = 'conflict'
+
+    def __init__(self, current_version):
+        super().__init__()
+        self.detail = {'detail': self.detail, 'current_version': current_version} # Keep the version an integer
+
+
+def conflict(model, pk):
+    current = model.objects.filter(pk=pk).values_list('version', flat=True).first()
+    if current is None:
+        raise NotFound('This was deleted by someone else in the meantime.')
+    raise VersionConflictError(current)
+
+
+def expected_version(request):
+    """The version a write was based on: `If-Match: "3"` or `"version": 3` in the body. None if not given."""
+    value = request.headers.get('If-Match')
+    if value is None and isinstance(request.data, dict):
+        value = request.data.get('version')
+    if value in (None, '', '*'):
+        return None
+    value = str(value).strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise ParseError('`If-Match` / `version` must be the object version, e.g. "3".')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
 
-from .models import Deviation, Action
-from .serializers import DeviationSerializer, ActionSerializer, UserSerializer
+class OptimisticConcurrencyMixin:
+    """
+    PATCH/PUT/DELETE sent with the version they are based on (If-Match or `version`)
+    only apply if the object is still at that version. The check is part of the
+    write itself (`UPDATE ... WHERE id = ? AND version = ?`), so nothing is locked
+    between reading and writing; a stale write gets a 409 with `current_version`.
+    Without a version the write applies as before. Responses carry the version as ETag.
+    """
+
+    def perform_update(self, serializer):
+        serializer.instance.expected_version = expected_version(self.request)
+        try:
+            with transaction.atomic(): # The row and its responsible users together; a conflict rolls back both
+                serializer.save()
+        except VersionConflict:
+            conflict(type(serializer.instance), serializer.instance.pk)
+
+    def perform_destroy(self, instance):
+        expected = expected_version(self.request)
+        if expected is None:
+            return super().perform_destroy(instance)
+        with transaction.atomic():
+            deleted, _ = type(instance).objects.filter(pk=instance.pk, version=expected).delete()
+        if not deleted:
+            conflict(type(instance), instance.pk)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        data = getattr(response, 'data', None)
+        if response.status_code < 300 and isinstance(data, dict) and data.get('version') is not None:
+            response['ETag'] = f'"{data["version"]}"'
+        return response
+
+
+MAX_DEVIATIONS_PAGE_SIZE = 1000
 
 
 # Existing: Deviation List/Create API View
-class DeviationListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Deviation.objects.all().order_by('dev_number')
+class DeviationListCreateAPIView(CoalescedListMixin, generics.ListCreateAPIView):
+    """
+    GET /api/deviations/ in natural DEV number order (DEV24-9 before DEV24-10; `?ordering=-dev_number`
+    reverses it). Filters: `my_deviations=true`, `dev_prefix=DEV`, `dev_year=24` (or 2024) and
+    `dev_from=DEV24-0400&dev_to=DEV24-0500` (inclusive, either bound optional).
+    `limit=N&offset=M` returns a slice of the list (still a plain array).
+    Archived deviations (see archive.py) are left out unless `include_archived=true`;
+    they then come in the same order, with an `archived_at`.
+    Identical concurrent GETs share one computation (see coalescing.py).
+    """
+    queryset = Deviation.objects.select_related('attachment_preview').order_by(*Deviation.NATURAL_ORDERING)
     serializer_class = DeviationSerializer
     permission_classes = [IsAuthenticated]
 
-    # UPDATED: get_queryset to filter by current user (for 'View My Deviations')
+    def coalesce_scope(self, request):
+        # Every authenticated user sees the same list, except their own deviations
+        if request.query_params.get('my_deviations', 'false').lower() == 'true':
+            return f'user:{request.user.pk}'
+        return 'authenticated'
+
+    def include_archived(self):
+        return self.request.query_params.get('include_archived', 'false').lower() == 'true'
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET' and self.include_archived():
+            return ArchivedDeviationSerializer # Its list serializer serializes hot rows with DeviationSerializer
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = self.filter_deviations(super().get_queryset())
+        limit = parse_int_param(self.request, 'limit', minimum=1, maximum=MAX_DEVIATIONS_PAGE_SIZE)
+        offset = parse_int_param(self.request, 'offset', 0)
+        if not self.include_archived():
+            return queryset[offset:offset + limit] if limit is not None else queryset[offset:]
+        archived = self.filter_deviations(
+            ArchivedDeviation.objects.select_related('attachment_preview')
+            .prefetch_related('actions__action_responsible_users').order_by(*ArchivedDeviation.NATURAL_ORDERING))
+        return natural_page(queryset, archived, offset, limit,
+                            reverse=self.request.query_params.get('ordering') == '-dev_number')
+
+    # UPDATED: filter by current user (for 'View My Deviations'); applied to the archive too
+    def filter_deviations(self, queryset):
+        params = self.request.query_params
+        if params.get('ordering') == '-dev_number':
+            queryset = queryset.order_by(*[f'-{field}' for field in Deviation.NATURAL_ORDERING])
+        if params.get('dev_prefix'):
+            queryset = queryset.filter(dev_prefix=params['dev_prefix'].upper())
+        dev_year = parse_int_param(self.request, 'dev_year', maximum=9999)
+        if dev_year is not None:
+            queryset = queryset.filter(dev_year=dev_year % 100)
+        queryset = filter_dev_number_range(
+            queryset, dev_number_bound(self.request, 'dev_from'), dev_number_bound(self.request, 'dev_to'))
+
         my_deviations_param = self.request.query_params.get('my_deviations', 'false').lower()
         
         if my_deviations_param == 'true':
@@ -34,21 +222,115 @@ class DeviationListCreateAPIView(generics.ListCreateAPIView):
         return queryset
 
 
+MAX_ACTIONS_PAGE_SIZE = 500
+
+
 # Existing: Deviation Detail/Update/Delete API View
-class DeviationDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Deviation.objects.all()
+class DeviationDetailUpdateDeleteAPIView(OptimisticConcurrencyMixin, generics.RetrieveUpdateDestroyAPIView):
+    """
+    GET /api/deviations/<dev_number>/ embeds every action. With `?actions_limit=N`
+    only the first N (by order) are embedded, with per-status `action_counts` and an
+    `actions_next` link to the rest, so a deviation with hundreds of actions costs
+    the same as a small one.
+
+    Edits and deletes can be made conditional on `version` (see OptimisticConcurrencyMixin).
+    An archived deviation (see archive.py) is returned by GET, whole and with its
+    `archived_at`, but cannot be edited or deleted (404) until it is restored.
+    """
+    queryset = Deviation.objects.select_related('attachment_preview').prefetch_related('actions__action_responsible_users')
     serializer_class = DeviationSerializer
     lookup_field = 'dev_number'
     permission_classes = [IsAuthenticated]
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return self.retrieve_hot(request, *args, **kwargs)
+        except Http404:
+            # Only looked up on a miss: the archive costs nothing to the deviations in use
+            archived = ArchivedDeviation.objects.select_related('attachment_preview') \
+                .prefetch_related('actions__action_responsible_users').filter(dev_number=kwargs['dev_number']).first()
+            if archived is None:
+                raise
+            return Response(ArchivedDeviationSerializer(archived, context=self.get_serializer_context()).data)
+
+    def retrieve_hot(self, request, *args, **kwargs):
+        limit = parse_int_param(request, 'actions_limit', maximum=MAX_ACTIONS_PAGE_SIZE)
+        if limit is None:
+            return super().retrieve(request, *args, **kwargs)
+        deviation = get_object_or_404(annotate_deviation_status(Deviation.objects.select_related('attachment_preview')),
+                                      dev_number=kwargs['dev_number'])
+        actions = list(deviation.actions.order_by('order', 'id').prefetch_related('action_responsible_users')[:limit])
+        context = {**self.get_serializer_context(), 'preview_actions': actions}
+        return Response(DeviationPreviewSerializer(deviation, context=context).data)
+
+
+class ActionKeysetPagination(BasePagination):
+    """
+    Keyset pagination on Action.order: `?after=<order>&limit=<n>` returns the next
+    `limit` actions with a greater order, `until=<order>` caps the range. Each page is
+    an index range scan on (deviation, order), however deep into the list it is.
+    """
+    default_limit = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = parse_int_param(request, 'limit', self.default_limit, minimum=1, maximum=MAX_ACTIONS_PAGE_SIZE)
+        after = parse_int_param(request, 'after', minimum=-2**31)
+        until = parse_int_param(request, 'until', minimum=-2**31)
+        if after is not None:
+            queryset = queryset.filter(order__gt=after)
+        if until is not None:
+            queryset = queryset.filter(order__lte=until)
+        page = list(queryset[:limit + 1])
+        self.has_more = len(page) > limit
+        page = page[:limit]
+        self.next_after = page[-1].order if self.has_more else None
+        return page
+
+    def get_paginated_response(self, data):
+        next_url = None
+        if self.has_more:
+            next_url = replace_query_param(self.request.build_absolute_uri(), 'after', self.next_after)
+        return Response({
+            'next': next_url,
+            'next_after': self.next_after,
+            'has_more': self.has_more,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_after': {'type': 'integer', 'nullable': True},
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+
 # Existing: Action List/Create API View
 class ActionListCreateAPIView(generics.ListCreateAPIView):
+    """
+    GET /api/deviations/<dev_number>/actions/?after=<order>&limit=<n>&status=<status>[,<status>]
+
+    Actions ordered by `order`, paginated by keyset (see ActionKeysetPagination).
+    """
     serializer_class = ActionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ActionKeysetPagination
 
     def get_queryset(self):
         dev_number = self.kwargs['dev_number']
-        return Action.objects.filter(deviation__dev_number=dev_number).order_by('order', 'id')
+        actions = Action.objects.filter(deviation__dev_number=dev_number).order_by('order', 'id')
+        statuses = [value.strip() for value in self.request.query_params.get('status', '').split(',') if value.strip()]
+        if statuses:
+            unknown = set(statuses) - {choice for choice, _ in Action.STATUS_CHOICES}
+            if unknown:
+                raise ParseError(f'Unknown status: {", ".join(sorted(unknown))}.')
+            actions = actions.filter(status__in=statuses)
+        return actions.prefetch_related('action_responsible_users')
 
     def perform_create(self, serializer):
         dev_number = self.kwargs['dev_number']
@@ -56,7 +338,8 @@ class ActionListCreateAPIView(generics.ListCreateAPIView):
         serializer.save(deviation=deviation)
 
 # Existing: Action Detail/Update/Delete API View
-class ActionDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ActionDetailUpdateDeleteAPIView(OptimisticConcurrencyMixin, generics.RetrieveUpdateDestroyAPIView):
+    """Edits and deletes can be made conditional on `version` (see OptimisticConcurrencyMixin)."""
     queryset = Action.objects.all()
     serializer_class = ActionSerializer
     lookup_url_kwarg = 'action_id'
@@ -76,8 +359,40 @@ class CurrentUserAPIView(APIView):
         serializer = UserSerializer(request.user)
         return Response(serializer.data)
 
+class NextDevNumberAPIView(APIView):
+    """
+    POST /api/deviation-numbers/next {"prefix": "DEV", "year": 2025} (both optional)
+
+    Reserves the next free DEV number for the prefix and year (default: DEV, this year).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        prefix = str(request.data.get('prefix') or DEFAULT_PREFIX).strip()
+        if not prefix.isalpha() or len(prefix) > 20:
+            return Response({'detail': '`prefix` must be letters only.'}, status=status.HTTP_400_BAD_REQUEST)
+        year = request.data.get('year')
+        if year not in (None, ''):
+            try:
+                year = int(year)
+            except (TypeError, ValueError):
+                return Response({'detail': '`year` must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            year = None
+        dev_number = allocate_dev_number(prefix, year)
+        prefix, year, sequence = parse_dev_number(dev_number)
+        return Response({'dev_number': dev_number, 'prefix': prefix, 'year': year, 'sequence': sequence},
+                        status=status.HTTP_201_CREATED)
+
+
 # --- Action Reordering API View ---
 class ReorderActionsAPIView(APIView):
+    """
+    PATCH /api/deviations/<dev_number>/reorder_actions/ {"new_order": [{"id", "order", "version"?}, ...]}
+
+    Items that carry the action's `version` are only moved if it is unchanged; otherwise
+    nothing is reordered and the response is a 409.
+    """
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, dev_number):
@@ -87,6 +402,11 @@ class ReorderActionsAPIView(APIView):
         if not isinstance(new_order_data, list):
             return Response({'detail': 'Invalid data format. Expected a list of action objects.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not all(isinstance(item, dict) and _is_int(item.get('id')) and _is_int(item.get('order'))
+                   and (item.get('version') is None or _is_int(item['version'])) for item in new_order_data):
+            return Response({'detail': 'Every item needs an integer "id" and "order" (and "version", if given).'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
         new_order_map = {item['id']: item['order'] for item in new_order_data}
         actions_to_update_qs = Action.objects.filter(id__in=new_order_map.keys(), deviation=deviation)
 
@@ -98,15 +418,467 @@ class ReorderActionsAPIView(APIView):
             max_current_order = Action.objects.filter(deviation=deviation).aggregate(models.Max('order'))['order__max'] or 0
             temp_offset = max_current_order + 1000
 
+            expected_versions = {item['id']: item['version'] for item in new_order_data if item.get('version') is not None}
             for action_instance in actions_to_update_qs:
-                Action.objects.filter(id=action_instance.id).update(order=temp_offset + action_instance.order)
+                moved = Action.objects.filter(id=action_instance.id)
+                if action_instance.id in expected_versions:
+                    moved = moved.filter(version=expected_versions[action_instance.id])
+                if not moved.update(order=temp_offset + action_instance.order):
+                    # The version read above may be stale too: report the one in the table now
+                    current_version = Action.objects.filter(id=action_instance.id).values_list('version', flat=True).first()
+                    transaction.set_rollback(True) # Nothing moves if one action changed meanwhile
+                    return Response({'detail': VersionConflictError.default_detail, 'action_id': action_instance.id,
+                                     'current_version': current_version}, status=status.HTTP_409_CONFLICT)
 
             # Step 2: Set the final, correct order values.
             for item in new_order_data:
                 action_id = item['id']
                 final_order_value = item['order']
-                Action.objects.filter(id=action_id).update(order=final_order_value)
+                Action.objects.filter(id=action_id).update(order=final_order_value, version=F('version') + 1)
+
+            # update() bypasses the change log signals
+            record_action_changes(list(new_order_map.keys()))
 
         deviation.refresh_from_db()
         serializer = DeviationSerializer(deviation, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+# --- Change Feed API View ---
+MAX_CURSOR = 2 ** 63 - 1 # Largest SQLite integer
+
+
+class ChangeFeedAPIView(APIView):
+    """
+    GET /api/changes?since=<cursor>&limit=<n>
+
+    Returns the deviations and actions created, updated or deleted after `cursor`
+    (collapsed to their current state) and the cursor to pass next time. Keep
+    calling while `has_more` is true. A cursor older than the retained log gets a
+    410, meaning the client must reload everything and start from `cursor`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        since = parse_int_param(request, 'since', 0, maximum=MAX_CURSOR)
+        limit = parse_int_param(request, 'limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+
+        oldest = oldest_cursor()
+        if since and oldest is not None and since < oldest - 1:
+            return Response(
+                {'detail': 'Cursor is older than the retained change log, a full reload is required.',
+                 'cursor': oldest - 1},
+                status=status.HTTP_410_GONE,
+            )
+
+        cursor, has_more, changes = collect_changes(since, limit)
+        deviations, actions = changed_querysets(changes)
+        context = {'request': request}
+        deviation_data = DeviationChangeSerializer(deviations, many=True, context=context).data
+        action_data = ActionSerializer(actions, many=True, context=context).data
+
+        # Rows that vanished after their last logged change count as deleted.
+        found_deviations = {item['id'] for item in deviation_data}
+        found_actions = {item['id'] for item in action_data}
+        deviation_changes = changes[ChangeLogEntry.DEVIATION]
+        action_changes = changes[ChangeLogEntry.ACTION]
+        return Response({
+            'cursor': cursor,
+            'has_more': has_more,
+            'deviations': {
+                'upserted': deviation_data,
+                'deleted': sorted(set(deviation_changes['deleted']) | (set(deviation_changes['upserted']) - found_deviations)),
+            },
+            'actions': {
+                'upserted': action_data,
+                'deleted': sorted(set(action_changes['deleted']) | (set(action_changes['upserted']) - found_actions)),
+            },
+        })
+
+
+# --- Near-duplicate Deviations API View ---
+MAX_SIMILAR_RESULTS = 100
+
+
+class SimilarDeviationsAPIView(APIView):
+    """
+    GET /api/deviations/<dev_number>/similar?min_similarity=0.5&limit=10
+
+    Deviations that look like the same defect raised again (drawing number family,
+    defect fields, action texts), with their estimated similarity, most similar first.
+    Looked up in the LSH index (similarity.py), so only candidates sharing a bucket are compared.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dev_number):
+        deviation = get_object_or_404(Deviation, dev_number=dev_number)
+        limit = parse_int_param(request, 'limit', default=10, minimum=1, maximum=MAX_SIMILAR_RESULTS)
+        min_similarity = request.query_params.get('min_similarity')
+        if min_similarity not in (None, ''):
+            try:
+                min_similarity = float(min_similarity)
+            except ValueError:
+                raise ParseError('`min_similarity` must be a number.')
+            if not 0 < min_similarity <= 1:
+                raise ParseError('`min_similarity` must be between 0 and 1.')
+        else:
+            min_similarity = None
+
+        found, indexed = similar_deviations(deviation, min_similarity=min_similarity, limit=limit)
+        rows = Deviation.objects.in_bulk([pk for pk, _ in found])
+        return Response({
+            'dev_number': deviation.dev_number,
+            'indexed': indexed,
+            'results': [{
+                'dev_number': rows[pk].dev_number,
+                'owner_plant': rows[pk].owner_plant,
+                'drawing_number': rows[pk].drawing_number,
+                'defect_category': rows[pk].defect_category,
+                'similarity': round(similarity, 3),
+            } for pk, similarity in found if pk in rows],
+        })
+
+
+# --- Attachment Preview API View ---
+class AttachmentPreviewAPIView(APIView):
+    """
+    GET /api/deviations/<dev_number>/attachment/preview: PNG of the attachment's first
+    page (rendered in the background, see previews.py), with its page count and size in
+    X-Page-Count / X-File-Size. The ETag is the file's hash, so revalidation costs a 304;
+    with `?v=` matching the current preview (the URL DeviationSerializer hands out) the
+    response never changes and is cached for a year.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dev_number):
+        deviation = (Deviation.objects.select_related('attachment_preview').filter(dev_number=dev_number).first()
+                     or ArchivedDeviation.objects.select_related('attachment_preview').filter(dev_number=dev_number).first())
+        if deviation is None:
+            raise Http404('No deviation matches the given query.')
+        if not deviation.attachment:
+            raise Http404('This deviation has no attachment.')
+        preview = deviation.attachment_preview
+        if preview is None:
+            raise Http404('The preview of this attachment is not rendered yet.')
+        if not preview.thumbnail:
+            raise Http404(preview.error or 'This attachment has no preview.')
+
+        etag = f'"{preview.sha256}"'
+        if request.query_params.get('v') == version_tag(preview):
+            cache_control = 'private, max-age=31536000, immutable'
+        else:
+            cache_control = 'private, no-cache' # An unversioned URL must follow attachment changes
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = FileResponse(preview.thumbnail.open('rb'), content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        response['X-Page-Count'] = preview.page_count
+        response['X-File-Size'] = preview.file_size
+        return response
+
+
+# --- Overdue Actions Report API View ---
+class OverdueActionsPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+MAX_DAYS_OVERDUE = 100 * 365
+
+
+class OverdueActionsAPIView(APIView):
+    """
+    GET /api/actions/overdue?user=<username or id>&plant=<plant>&days_overdue=<n>
+
+    Open actions at least `days_overdue` (default 1) days past their expiration
+    date, grouped by responsible user (or the legacy `action_responsible` text).
+    Paginated by owner, most overdue actions first.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        days_overdue = parse_int_param(request, 'days_overdue', 1, minimum=1, maximum=MAX_DAYS_OVERDUE)
+
+        user = None
+        user_param = request.query_params.get('user')
+        if user_param:
+            lookup = Q(username=user_param) | (Q(pk=int(user_param)) if user_param.isdigit() else Q(pk__in=[]))
+            user = User.objects.filter(lookup).first()
+            if user is None:
+                return Response({'detail': f'User "{user_param}" not found.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        actions = overdue_actions(days_overdue, plant=request.query_params.get('plant'))
+        paginator = OverdueActionsPagination()
+        owners = paginator.paginate_queryset(owner_counts(actions, user=user), request, view=self)
+        return paginator.get_paginated_response(overdue_groups(actions, owners))
+
+
+MAX_BULK_ACTION_IDS = 5000
+
+
+class BulkActionStatusAPIView(APIView):
+    """
+    POST /api/actions/bulk_status moves many actions to one status:
+      {"status": "Done", "ids": [12, 13, 14]}
+      {"status": "Done", "dev_number": "DEV24-0439", "assigned_to_me": true}
+    (`ids`, `dev_number` and `assigned_to_me` can be combined; one of the first two is required).
+    One UPDATE for all the actions. The response lists the changed actions with their
+    new versions and the new status/completion of each affected deviation.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        new_status = request.data.get('status')
+        if new_status not in {choice for choice, _ in Action.STATUS_CHOICES}:
+            return Response({'detail': f'`status` must be one of: {", ".join(choice for choice, _ in Action.STATUS_CHOICES)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        ids, dev_number = request.data.get('ids'), request.data.get('dev_number')
+        if ids is None and not dev_number:
+            return Response({'detail': 'Give `ids` or `dev_number`.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        actions = Action.objects.all()
+        if ids is not None:
+            if (not isinstance(ids, list) or len(ids) > MAX_BULK_ACTION_IDS
+                    or not all(_is_int(action_id) for action_id in ids)):
+                return Response({'detail': f'`ids` must be a list of at most {MAX_BULK_ACTION_IDS} action ids.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            actions = actions.filter(pk__in=ids)
+        if dev_number:
+            actions = actions.filter(deviation=get_object_or_404(Deviation, dev_number=dev_number))
+        if str(request.data.get('assigned_to_me', '')).lower() == 'true':
+            actions = actions.filter(pk__in=Action.action_responsible_users.through.objects
+                                     .filter(user=request.user).values('action_id'))
+
+        changed = set_actions_status(actions, new_status)
+        return Response({
+            'status': new_status,
+            'updated': len(changed),
+            'actions': [{'id': action_id, 'version': version} for action_id, _, version in changed],
+            'deviations': deviation_rollups({deviation_id for _, deviation_id, _ in changed}),
+        })
+
+
+# --- Bulk Deviation Upsert API View ---
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields the items of the JSON array in `stream` as they are read, chunk by chunk,
+    so a large request body is never held (or parsed) whole.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer, eof = '', False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        try:
+            buffer += utf8.decode(chunk, final=eof)
+        except UnicodeDecodeError:
+            raise ParseError('The request body is not valid UTF-8.')
+
+    def next_token():
+        """First character after any whitespace ('' at the end of the body)."""
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip()
+            if buffer or eof:
+                return buffer[:1]
+            fill()
+
+    if next_token() != '[':
+        raise ParseError('Expected a JSON array of deviations.')
+    buffer = buffer[1:]
+    if next_token() == ']':
+        buffer = buffer[1:]
+    else:
+        while True:
+            next_token()
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ParseError(f'Invalid JSON: {e.msg}.')
+                fill() # The item continues in the next chunk
+                continue
+            if end == len(buffer) and not eof:
+                fill() # A number or literal cut at the chunk boundary would parse short
+                continue
+            buffer = buffer[end:]
+            yield item
+            token = next_token()
+            buffer = buffer[1:]
+            if token == ']':
+                break
+            if token != ',':
+                raise ParseError('Expected "," or "]" after an item of the array.')
+    if next_token():
+        raise ParseError('Unexpected data after the JSON array.')
+
+
+class BulkDeviationUpsertAPIView(APIView):
+    """
+    POST /api/deviations/bulk_upsert: creates or updates many deviations, keyed on
+    dev_number, for system integrations (MES/ERP syncs). The body is a JSON array:
+      [{"dev_number": "DEV24-0439", "owner_plant": "Arimex", "actions": [{"action_description": "..."}]}, ...]
+    Fields left out are kept; `actions` replace the existing ones; `version` makes an item
+    conditional (see DeviationUpsertSerializer). The body is parsed as it streams in,
+    before the write queue is taken, so a slow upload holds up no other writer; then the
+    items are written BULK_UPSERT_BATCH_SIZE at a time (bulk.upsert_deviations) in one
+    transaction: malformed JSON or more than BULK_UPSERT_MAX_ITEMS items change nothing.
+    Invalid items, and items of archived deviations (see archive.py), are skipped.
+    The response has one compact result per item, in order:
+      {"dev_number", "result": "created" | "updated" | "conflict" | "invalid", "id", "version" | "errors"}
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'POST': 'heavy'} # Each request is a whole sync
+    queue_whole_request = False # Takes the write queue only once the body is in
+
+    def post(self, request):
+        start = time.perf_counter()
+        batch_size = getattr(settings, 'BULK_UPSERT_BATCH_SIZE', 500)
+        max_items = getattr(settings, 'BULK_UPSERT_MAX_ITEMS', 20000)
+        items = []
+        for item in iter_json_array(request):
+            if len(items) >= max_items:
+                raise ParseError(f'At most {max_items} deviations per request.')
+            items.append(item)
+
+        self.serializer = DeviationUpsertSerializer() # Fields built once, then validates every item
+        self.name_index = UserNameIndex()
+        self.seen = set()
+        results = []
+        try:
+            with serialized_write(getattr(settings, 'SQLITE_WRITE_QUEUE_TIMEOUT', None)), transaction.atomic():
+                for offset in range(0, len(items), batch_size):
+                    results.extend(self.upsert_batch(items[offset:offset + batch_size]))
+        except TimeoutError: # As SQLiteConcurrencyMiddleware answers when the queue is too long
+            return Response({'detail': 'The database is busy, please retry.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
+        summary = {outcome: 0 for outcome in ('created', 'updated', 'conflict', 'invalid')}
+        for result in results:
+            summary[result['result']] += 1
+        return Response({'received': len(results), **summary,
+                         'seconds': round(time.perf_counter() - start, 3), 'results': results})
+
+    def upsert_batch(self, items):
+        results, valid = [None] * len(items), []
+        archived = archived_dev_numbers(item['dev_number'].strip() for item in items
+                                        if isinstance(item, dict) and isinstance(item.get('dev_number'), str))
+        for position, item in enumerate(items):
+            try:
+                data = self.serializer.run_validation(item)
+            except ValidationError as e:
+                dev_number = item.get('dev_number') if isinstance(item, dict) else None
+                results[position] = {'dev_number': dev_number, 'result': 'invalid', 'errors': e.detail}
+                continue
+            if data['dev_number'] in archived:
+                results[position] = {'dev_number': data['dev_number'], 'result': 'invalid',
+                                     'errors': {'dev_number': ['Belongs to an archived deviation; restore it first.']}}
+                continue
+            if data['dev_number'] in self.seen:
+                results[position] = {'dev_number': data['dev_number'], 'result': 'invalid',
+                                     'errors': {'dev_number': ['Given more than once in this request.']}}
+                continue
+            self.seen.add(data['dev_number'])
+            valid.append((position, data))
+        if valid:
+            for (position, _), result in zip(valid, upsert_deviations([data for _, data in valid], self.name_index)):
+                results[position] = result
+        return results
+
+
+# --- Background Job API Views ---
+def visible_jobs(user):
+    jobs = Job.objects.select_related('created_by')
+    return jobs if user.is_staff else jobs.filter(created_by=user)
+
+
+class JobListCreateAPIView(generics.ListCreateAPIView):
+    """
+    GET /api/jobs/ lists your jobs (staff: all jobs).
+    POST /api/jobs/ queues one: `kind`, optional `params` and an optional `file` upload
+    (multipart) for the imports. Only staff may queue jobs that write data.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'POST': 'heavy'} # Each job is a whole import or export
+
+    def get_queryset(self):
+        return visible_jobs(self.request.user)
+
+    def perform_create(self, serializer):
+        kind = serializer.validated_data['kind']
+        if kind in STAFF_ONLY_KINDS and not self.request.user.is_staff:
+            raise PermissionDenied(f'Only staff can run "{kind}" jobs.')
+        serializer.instance = enqueue(kind, user=self.request.user, params=serializer.validated_data.get('params'),
+                                      input_file=self.request.FILES.get('file'))
+
+
+class JobDetailAPIView(generics.RetrieveAPIView):
+    """GET /api/jobs/<id>/: status, progress, counts and log of a job."""
+    serializer_class = JobDetailSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        return visible_jobs(self.request.user)
+
+
+class JobResultAPIView(APIView):
+    """GET /api/jobs/<id>/result: downloads the file a job produced (e.g. an export)."""
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'*': 'heavy'}
+
+    def get(self, request, job_id):
+        job = get_object_or_404(visible_jobs(request.user), pk=job_id)
+        if not job.result_file:
+            raise Http404('This job has no result file.')
+        return FileResponse(job.result_file.open('rb'), as_attachment=True,
+                            filename=job.result_file.name.rsplit('/', 1)[-1])
+
+
+# --- Analytics (Parquet) API Views ---
+class AnalyticsListAPIView(APIView):
+    """
+    GET /api/analytics/: state of the Parquet copy (last change cursor, last run) and its
+    files. Download them from /api/analytics/<path>; reading them never touches the database.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({
+            'state': read_state(),
+            'files': [{**file, 'url': request.build_absolute_uri(reverse('analytics-file', kwargs={'path': file['path']}))}
+                      for file in list_files()],
+        })
+
+
+class AnalyticsFileAPIView(APIView):
+    """GET /api/analytics/<path>: one Parquet file of the analytics copy."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, path):
+        root = analytics_dir().resolve()
+        file = (root / path).resolve()
+        if root not in file.parents or file.suffix != '.parquet' or not file.is_file():
+            raise Http404('No such analytics file.')
+        return FileResponse(open(file, 'rb'), as_attachment=True, filename=file.name,
+                            content_type='application/vnd.apache.parquet')
+
+
+# --- Metrics API View ---
+class MetricsAPIView(APIView):
+    """Per-view latency histograms and SQL/serializer/render totals in Prometheus text format."""
+    permission_classes = [IsStaffOrMetricsToken]
+    throttle_classes = [] # Scraped on a fixed interval
+
+    def get(self, request):
+        return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
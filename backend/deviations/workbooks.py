@@ -0,0 +1,155 @@
+# deviation_tracker_app/deviation_backend/deviations/workbooks.py
+#
+# Parsing half of the Excel import (excel_data_manager.py does the writing).
+# Every plant keeps its own copy of the deviation matrix, so an import can read
+# many workbooks and sheets. Each workbook is parsed by parse_workbook() in a
+# worker process of its own; this module must therefore not import Django
+# (worker processes are spawned, without settings) and returns plain, picklable
+# records:
+#   {'dev_number': 'DEV24-0439', 'fields': {...model field: value},
+#    'actions': [(description, responsible, expiration_date), ...], 'source': 'Plant_B.xlsx:Sheet1'}
+#
+# The same dev_number can appear in several copies; resolve_conflicts() keeps one
+# per number (see there), the same one whatever order the workers finish in.
+
+import os
+from pathlib import Path
+
+import pandas as pd
+
+WORKBOOK_SUFFIXES = ('.xlsx', '.xlsm') # Read with openpyxl; legacy .xls would need xlrd
+
+# Excel headers -> model fields (Deviation) or action columns (the *_excel ones)
+COLUMN_MAPPING = {
+    'Primary Column': 'primary_column',
+    'Year': 'year',
+    'DEV NUMBER': 'dev_number',
+    'Created By': 'created_by',
+    'Owner Plant': 'owner_plant',
+    'Affected Plant': 'affected_plant',
+    'SBU': 'sbu',
+    'Release Date': 'release_date',
+    'Effectivity Date': 'effectivity_date',
+    'Expiration Date': 'expiration_date',
+    'Drawing Number': 'drawing_number',
+    'Back to Back Deviation': 'back_to_back_deviation',
+    'Defect Category': 'defect_category',
+    'Assembly Defect Type': 'assembly_defect_type',
+    'Molding Defect Type': 'molding_defect_type',
+    'Actions': 'action_description_excel',
+    'Action Responsible': 'action_responsible_excel',
+    'Action Expiration Date': 'action_expiration_date_excel',
+}
+DEVIATION_FIELDS = [field for field in COLUMN_MAPPING.values() if not field.endswith('_excel')]
+DATE_COLUMNS = [field for field in COLUMN_MAPPING.values() if 'date' in field]
+
+
+def expand_paths(paths):
+    """Workbook files from files and directories (a directory contributes its workbooks, sorted)."""
+    workbooks = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            workbooks.extend(sorted(child for child in path.iterdir()
+                                    if child.suffix.lower() in WORKBOOK_SUFFIXES and not child.name.startswith('~$')))
+        else:
+            workbooks.append(path)
+    return [str(path) for path in workbooks]
+
+
+def _dates(column):
+    """Cells (datetimes, Timestamps or text) to dates; blanks and unparseable text to None."""
+    parsed = pd.to_datetime(column, errors='coerce', format='mixed') # Cell by cell, 'coerce' invalid dates to NaT
+    return parsed.dt.date.astype(object).where(parsed.notna(), None)
+
+
+def _text(value):
+    """Stripped cell text, or None for blanks (NaN, '', the string 'nan' of an empty cell)."""
+    if value is None or pd.isna(value):
+        return None
+    text = str(value).strip()
+    return text if text and text != 'nan' else None
+
+
+def parse_sheet(df, source):
+    """Records of one sheet, in dev_number order."""
+    df.columns = df.columns.astype(str).str.strip()
+    df = df.rename(columns=COLUMN_MAPPING)
+    # A deviation spans several rows (one per action): carry its details down
+    detail_columns = [column for column in DEVIATION_FIELDS if column in df.columns]
+    df[detail_columns] = df[detail_columns].ffill()
+    df = df.dropna(subset=['dev_number'])
+    # Whole columns at once; the rows are then walked as plain dicts
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = _dates(df[column])
+    for column in ('action_description_excel', 'action_responsible_excel', 'action_expiration_date_excel'):
+        if column not in df.columns:
+            df[column] = None
+
+    records = {}
+    for row in df.to_dict('records'):
+        dev_number = row['dev_number']
+        record = records.get(dev_number)
+        if record is None:
+            # The deviation's details come from its first row
+            fields = {column: row[column] for column in detail_columns if pd.notna(row[column])}
+            if 'back_to_back_deviation' in fields:
+                fields['back_to_back_deviation'] = str(fields['back_to_back_deviation']).strip().lower() == 'true'
+            fields['dev_number'] = str(dev_number).strip()
+            record = records[dev_number] = {'dev_number': fields['dev_number'], 'fields': fields, 'actions': [],
+                                            'source': source}
+        description = _text(row['action_description_excel'])
+        responsible = _text(row['action_responsible_excel'])
+        # Only rows with both a description and a responsible are actions
+        if description and responsible:
+            record['actions'].append((description, responsible, row['action_expiration_date_excel']))
+    return [records[dev_number] for dev_number in sorted(records, key=str)]
+
+
+def parse_workbook(path, sheets=None):
+    """
+    Parses the given sheets of a workbook (names; None: the first sheet, '*': all of them).
+    Returns (records, messages). Sheets without a "DEV NUMBER" column are skipped with a message.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'Excel file not found at: {path}')
+    name = os.path.basename(path)
+    if sheets is None:
+        frames = {0: pd.read_excel(path)}
+    else:
+        frames = pd.read_excel(path, sheet_name=None if sheets == '*' else list(sheets))
+
+    records, messages = [], []
+    for sheet, df in frames.items():
+        source = name if sheet == 0 else f'{name}:{sheet}'
+        if 'DEV NUMBER' not in df.columns.astype(str).str.strip():
+            messages.append(f'Skipped {source}: no "DEV NUMBER" column.')
+            continue
+        sheet_records = parse_sheet(df, source)
+        messages.append(f'Read {len(sheet_records)} deviations from {source}.')
+        records.extend(sheet_records)
+    return records, messages
+
+
+def resolve_conflicts(record_lists):
+    """
+    One record per dev_number from the records of every workbook and sheet (given in
+    priority order). Of several copies, the one with the most actions wins (plants add
+    actions as they work on a deviation), then the one with the most filled-in fields,
+    then the earliest in priority order. Returns (records in dev_number order, conflicts),
+    conflicts being [(dev_number, winning source, [other sources])].
+    """
+    copies = {}
+    for priority, records in enumerate(record_lists):
+        for record in records:
+            copies.setdefault(record['dev_number'], []).append((priority, record))
+
+    winners, conflicts = [], []
+    for dev_number in sorted(copies):
+        ranked = sorted(copies[dev_number],
+                        key=lambda item: (-len(item[1]['actions']), -len(item[1]['fields']), item[0]))
+        winner = ranked[0][1]
+        winners.append(winner)
+        if len(ranked) > 1:
+            conflicts.append((dev_number, winner['source'], [record['source'] for _, record in ranked[1:]]))
+    return winners, conflicts
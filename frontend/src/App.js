@@ -31,6 +31,7 @@ const AppContent = () => {
   const [deviationDataLoading, setDeviationDataLoading] = useState(true);
   const [deviationDataError, setDeviationDataError] = useState(null);
   const [filterMode, setFilterMode] = useState('all'); // 'all' or 'my'
+  const [includeArchived, setIncludeArchived] = useState(false); // Also list archived (closed, long expired) deviations
 
   // Function to fetch deviation data - Wrapped in useCallback
   const fetchDeviations = useCallback(async () => {
@@ -42,10 +43,15 @@ const AppContent = () => {
     setDeviationDataLoading(true);
     setDeviationDataError(null);
 
-    let url = '/api/deviations/';
+    const params = new URLSearchParams();
     if (filterMode === 'my') {
-      url += '?my_deviations=true';
+      params.set('my_deviations', 'true');
     }
+    if (includeArchived) {
+      params.set('include_archived', 'true');
+    }
+    const query = params.toString();
+    const url = query ? `/api/deviations/?${query}` : '/api/deviations/';
 
     try {
       const response = await fetch(url, {
@@ -67,7 +73,7 @@ const AppContent = () => {
     } finally {
       setDeviationDataLoading(false);
     }
-  }, [isAuthenticated, accessToken, filterMode]);
+  }, [isAuthenticated, accessToken, filterMode, includeArchived]);
 
   useEffect(() => {
     if (isAuthenticated && accessToken && !authLoading) {
@@ -137,6 +143,15 @@ const AppContent = () => {
               View My Deviations
             </button>
 
+            {/* Archived deviations are only fetched on request */}
+            <button
+              onClick={() => setIncludeArchived(previous => !previous)}
+              className="nav-link"
+              style={{ backgroundColor: includeArchived ? '#017537' : 'rgba(255, 255, 255, 0.15)' }}
+            >
+              {includeArchived ? 'Hide Archived' : 'Show Archived'}
+            </button>
+
             {/* ORIGINAL "Add New Deviation" button (functional) */}
             <Link to="/deviations/new" className="nav-link">Add New Deviation</Link>
 
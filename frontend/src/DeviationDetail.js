@@ -1,6 +1,6 @@
 // deviation_tracker_app/frontend/src/DeviationDetail.js (FINALIZED - Optimized for no refresh on update, responsible users fix)
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, Link, useNavigate } from 'react-router-dom';
 import ActionForm from './ActionForm';
 import { useAuth } from './AuthContext';
@@ -25,6 +25,69 @@ const displayDate = (dateString) => {
   }
 };
 
+// Actions are loaded a page at a time (keyset on `order`), so large deviations open as fast as small ones.
+const ACTIONS_PAGE_SIZE = 100;
+
+// Live updates fetch just the actions that changed; past this many in one burst a single reload is cheaper.
+const LIVE_ACTION_FETCH_LIMIT = 10;
+
+const displayFileSize = (bytes) => {
+  if (bytes === null || bytes === undefined) return '';
+  if (bytes < 1024) return `${bytes} B`;
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(0)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+};
+
+// First-page thumbnail rendered by the backend (see deviations/previews.py) instead of the whole PDF.
+// The image needs the Authorization header, so it is fetched as a blob; its URL carries the file hash
+// (?v=), so the browser serves repeat views from its cache.
+function AttachmentThumbnail({ preview, accessToken }) {
+    const [imageUrl, setImageUrl] = useState(null);
+    const [failed, setFailed] = useState(false);
+
+    useEffect(() => {
+        if (!preview.url || !accessToken) {
+            return undefined;
+        }
+        let objectUrl = null;
+        let cancelled = false;
+        fetch(preview.url, { headers: { 'Authorization': `Bearer ${accessToken}` } })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                return response.blob();
+            })
+            .then(blob => {
+                if (cancelled) return;
+                objectUrl = URL.createObjectURL(blob);
+                setImageUrl(objectUrl);
+            })
+            .catch(err => {
+                console.error("Error loading attachment preview:", err);
+                if (!cancelled) setFailed(true);
+            });
+        return () => {
+            cancelled = true;
+            if (objectUrl) URL.revokeObjectURL(objectUrl);
+        };
+    }, [preview.url, accessToken]);
+
+    if (failed || !preview.url) {
+        return <div className="no-attachment-preview">Preview not available.</div>;
+    }
+    if (!imageUrl) {
+        return <div className="no-attachment-preview">Loading preview...</div>;
+    }
+    return (
+        <img
+            src={imageUrl}
+            alt="First page of the attachment"
+            className="image-preview thumbnail-preview"
+            width={preview.width || undefined}
+            height={preview.height || undefined}
+        />
+    );
+}
+
 function DeviationDetail({ onDataChanged }) {
     const { devNumber } = useParams();
     const [deviation, setDeviation] = useState(null);
@@ -34,9 +97,19 @@ function DeviationDetail({ onDataChanged }) {
     // This prevents full page reloads on action updates/status changes/reorders.
     const [showAddActionForm, setShowAddActionForm] = useState(false);
     const [editActionId, setEditActionId] = useState(null);
+    const [loadingMoreActions, setLoadingMoreActions] = useState(false);
+    const [showFullPdf, setShowFullPdf] = useState(false);
+    // The latest state for the live-update handler, which outlives renders
+    const deviationRef = useRef(null);
+    deviationRef.current = deviation;
     const navigate = useNavigate();
     const { accessToken, isAuthenticated } = useAuth();
 
+    // Back to the thumbnail when another deviation is opened
+    useEffect(() => {
+        setShowFullPdf(false);
+    }, [devNumber]);
+
     const calculateDeviationStatus = (actions) => {
         if (!actions || actions.length === 0) {
             return "Not Started";
@@ -60,6 +133,51 @@ function DeviationDetail({ onDataChanged }) {
         return "In Progress";
     };
 
+    // The status can only be recomputed locally when every action is loaded; otherwise keep the server's.
+    const nextDeviationStatus = (prevDeviation, updatedActions) => {
+        const total = prevDeviation.action_counts ? prevDeviation.action_counts.total : updatedActions.length;
+        return updatedActions.length >= total ? calculateDeviationStatus(updatedActions) : prevDeviation.deviation_status;
+    };
+
+    // Replaces the local copy with the server's, e.g. after a 409 (someone else edited it first).
+    const refetchDeviation = async () => {
+        try {
+            const response = await fetch(`/api/deviations/${devNumber}/?actions_limit=${ACTIONS_PAGE_SIZE}`, {
+                headers: { 'Authorization': `Bearer ${accessToken}` },
+            });
+            if (response.ok) {
+                setDeviation(await response.json());
+            }
+        } catch (error) {
+            console.error("Error reloading deviation:", error);
+        }
+    };
+
+    const loadMoreActions = async () => {
+        if (!deviation || !deviation.actions.length) return;
+        setLoadingMoreActions(true);
+        try {
+            const lastOrder = deviation.actions[deviation.actions.length - 1].order;
+            const response = await fetch(
+                `/api/deviations/${devNumber}/actions/?after=${lastOrder}&limit=${ACTIONS_PAGE_SIZE}`,
+                { headers: { 'Authorization': `Bearer ${accessToken}` } }
+            );
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const page = await response.json();
+            setDeviation(prevDeviation => ({
+                ...prevDeviation,
+                actions: [...prevDeviation.actions, ...page.results],
+            }));
+        } catch (error) {
+            console.error("Error loading more actions:", error);
+            alert(`Failed to load more actions: ${error.message}`);
+        } finally {
+            setLoadingMoreActions(false);
+        }
+    };
+
     // Main data fetching effect for the deviation details (runs only if devNumber, token, auth changes)
     useEffect(() => {
         if (!isAuthenticated || !accessToken) {
@@ -68,7 +186,7 @@ function DeviationDetail({ onDataChanged }) {
             return;
         }
 
-        fetch(`/api/deviations/${devNumber}/`, {
+        fetch(`/api/deviations/${devNumber}/?actions_limit=${ACTIONS_PAGE_SIZE}`, {
             headers: {
                 'Authorization': `Bearer ${accessToken}`,
             },
@@ -98,13 +216,165 @@ function DeviationDetail({ onDataChanged }) {
     // state is updated optimistically for actions, preventing full re-fetches.
     }, [devNumber, accessToken, isAuthenticated]);
 
+    // Live updates: the backend pushes a small event (Server-Sent Events, /api/events/) whenever this
+    // deviation or one of its actions changes, so edits made by other users show up without a reload.
+    // Events carry the object's version: the ones this page already holds (e.g. the echo of its own
+    // edits and reorders) are skipped, and a changed action is fetched on its own.
+    useEffect(() => {
+        if (!isAuthenticated || !accessToken || typeof window.EventSource === 'undefined') {
+            return undefined;
+        }
+
+        const headers = { 'Authorization': `Bearer ${accessToken}` };
+        let flushTimer = null;
+        let reloadAll = false;
+        let changedActions = new Map(); // action id -> latest event
+
+        const reloadDeviation = () => {
+            fetch(`/api/deviations/${devNumber}/?actions_limit=${ACTIONS_PAGE_SIZE}`, { headers })
+            .then(response => (response.ok ? response.json() : null))
+            .then(data => {
+                if (data) {
+                    setDeviation(data);
+                }
+            })
+            .catch(error => console.error("Error refreshing deviation after push event:", error));
+        };
+
+        const mergeAction = (event, action) => {
+            setDeviation(prevDeviation => {
+                if (!prevDeviation) return prevDeviation;
+                const actions = prevDeviation.actions;
+                const held = actions.some(existing => existing.id === action.id);
+                const allLoaded = !prevDeviation.action_counts || actions.length >= prevDeviation.action_counts.total;
+                const loadedUpTo = actions.length ? actions[actions.length - 1].order : 0;
+                if (!held && !allLoaded && action.order > loadedUpTo) {
+                    return prevDeviation; // Not on the loaded pages; "Load more" brings it in
+                }
+                const updatedActions = held
+                    ? actions.map(existing => (existing.id === action.id ? action : existing))
+                    : [...actions, action];
+                updatedActions.sort((a, b) => a.order - b.order);
+                const actionCounts = prevDeviation.action_counts && event.op === 'create' && !held
+                    ? { ...prevDeviation.action_counts, total: prevDeviation.action_counts.total + 1 }
+                    : prevDeviation.action_counts;
+                return {
+                    ...prevDeviation,
+                    actions: updatedActions,
+                    action_counts: actionCounts,
+                    deviation_status: nextDeviationStatus({ ...prevDeviation, action_counts: actionCounts }, updatedActions),
+                };
+            });
+        };
+
+        const removeAction = (actionId) => {
+            setDeviation(prevDeviation => {
+                if (!prevDeviation || !prevDeviation.actions.some(action => action.id === actionId)) {
+                    return prevDeviation; // Already gone (our own delete) or never loaded
+                }
+                const updatedActions = prevDeviation.actions.filter(action => action.id !== actionId);
+                const actionCounts = prevDeviation.action_counts
+                    ? { ...prevDeviation.action_counts, total: prevDeviation.action_counts.total - 1 }
+                    : prevDeviation.action_counts;
+                return {
+                    ...prevDeviation,
+                    actions: updatedActions,
+                    action_counts: actionCounts,
+                    deviation_status: nextDeviationStatus({ ...prevDeviation, action_counts: actionCounts }, updatedActions),
+                };
+            });
+        };
+
+        // Several events usually arrive together (e.g. a reorder), so handle them once they settle. Versions
+        // are compared then too, by when the response to our own write has been applied.
+        const flush = () => {
+            const current = deviationRef.current;
+            const events = [...changedActions.values()].filter(event => {
+                const held = current && current.actions.find(action => action.id === event.id);
+                return !(held && event.version != null && held.version >= event.version);
+            });
+            const fullReload = reloadAll || events.length > LIVE_ACTION_FETCH_LIMIT;
+            reloadAll = false;
+            changedActions = new Map();
+            if (fullReload) {
+                reloadDeviation();
+                return;
+            }
+            events.forEach(event => {
+                if (event.op === 'delete') {
+                    removeAction(event.id);
+                    return;
+                }
+                fetch(`/api/deviations/${devNumber}/actions/${event.id}/`, { headers })
+                .then(response => {
+                    if (response.status === 404) {
+                        removeAction(event.id); // Deleted since
+                        return null;
+                    }
+                    return response.ok ? response.json() : null;
+                })
+                .then(action => {
+                    if (action) {
+                        mergeAction(event, action);
+                    }
+                })
+                .catch(error => console.error("Error refreshing action after push event:", error));
+            });
+        };
+
+        const schedule = () => {
+            clearTimeout(flushTimer);
+            flushTimer = setTimeout(flush, 300);
+        };
+
+        const handleChange = (message) => {
+            let event;
+            try {
+                event = JSON.parse(message.data);
+            } catch (e) {
+                event = {};
+            }
+            if (event.model === 'action') {
+                changedActions.set(event.id, event);
+            } else {
+                const current = deviationRef.current;
+                const alreadyHeld = event.model === 'deviation' && event.op === 'update' && current
+                    && event.version != null && current.version >= event.version;
+                if (alreadyHeld) {
+                    return;
+                }
+                reloadAll = true;
+            }
+            schedule();
+        };
+
+        const handleResync = () => {
+            reloadAll = true;
+            schedule();
+        };
+
+        const source = new EventSource(
+            `/api/events/?deviations=${encodeURIComponent(devNumber)}&token=${encodeURIComponent(accessToken)}`
+        );
+        source.addEventListener('change', handleChange);
+        source.addEventListener('resync', handleResync);
+
+        return () => {
+            clearTimeout(flushTimer);
+            source.close();
+        };
+    // nextDeviationStatus only reads its arguments, so it does not need to be a dependency.
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [devNumber, accessToken, isAuthenticated]);
+
     const handleDeleteDeviation = async () => {
         if (!isAuthenticated || !accessToken) { alert("Not authenticated."); return; }
         if (window.confirm(`Are you sure you want to delete deviation ${devNumber}? This action cannot be undone.`)) {
             try {
                 const response = await fetch(`/api/deviations/${devNumber}/`, {
                     method: 'DELETE',
-                    headers: { 'Authorization': `Bearer ${accessToken}` }
+                    // Only if nobody changed it since we loaded it (409 otherwise)
+                    headers: { 'Authorization': `Bearer ${accessToken}`, 'If-Match': `"${deviation.version}"` }
                 });
 
                 if (!response.ok) {
@@ -138,6 +408,9 @@ function DeviationDetail({ onDataChanged }) {
                 updatedActions = prevDeviation.actions.map(action =>
                     action.id === submittedAction.id ? submittedAction : action
                 );
+            } else if (prevDeviation.action_counts && prevDeviation.actions.length < prevDeviation.action_counts.total) {
+                // New actions go last, so it shows up once "Load more" reaches the end of the list
+                updatedActions = [...prevDeviation.actions];
             } else {
                 // If it's a new action, add it to the list
                 updatedActions = [...prevDeviation.actions, submittedAction];
@@ -147,11 +420,15 @@ function DeviationDetail({ onDataChanged }) {
             updatedActions.sort((a, b) => a.order - b.order);
 
             // Recalculate deviation status based on updated actions
-            const newDeviationStatus = calculateDeviationStatus(updatedActions);
+            const newDeviationStatus = nextDeviationStatus(prevDeviation, updatedActions);
+            const actionCounts = prevDeviation.action_counts && !existsInList
+                ? { ...prevDeviation.action_counts, total: prevDeviation.action_counts.total + 1 }
+                : prevDeviation.action_counts;
 
             return {
                 ...prevDeviation,
                 actions: updatedActions,
+                action_counts: actionCounts,
                 deviation_status: newDeviationStatus // Update overall deviation status
             };
         });
@@ -181,10 +458,11 @@ function DeviationDetail({ onDataChanged }) {
     const handleDeleteAction = async (actionId, actionDescription) => {
         if (!isAuthenticated || !accessToken) { alert("Not authenticated."); return; }
         if (window.confirm(`Are you sure you want to delete action: "${actionDescription}"?`)) {
+            const action = deviation.actions.find(act => act.id === actionId);
             try {
                 const response = await fetch(`/api/deviations/${devNumber}/actions/${actionId}/`, {
                     method: 'DELETE',
-                    headers: { 'Authorization': `Bearer ${accessToken}` }
+                    headers: { 'Authorization': `Bearer ${accessToken}`, 'If-Match': `"${action.version}"` }
                 });
 
                 if (!response.ok) {
@@ -196,10 +474,14 @@ function DeviationDetail({ onDataChanged }) {
                 setDeviation(prevDeviation => {
                     if (!prevDeviation) return prevDeviation;
                     const updatedActions = prevDeviation.actions.filter(action => action.id !== actionId);
-                    const newDeviationStatus = calculateDeviationStatus(updatedActions);
+                    const actionCounts = prevDeviation.action_counts
+                        ? { ...prevDeviation.action_counts, total: prevDeviation.action_counts.total - 1 }
+                        : prevDeviation.action_counts;
+                    const newDeviationStatus = nextDeviationStatus({ ...prevDeviation, action_counts: actionCounts }, updatedActions);
                     return {
                         ...prevDeviation,
                         actions: updatedActions,
+                        action_counts: actionCounts,
                         deviation_status: newDeviationStatus
                     };
                 });
@@ -218,6 +500,7 @@ function DeviationDetail({ onDataChanged }) {
 
     const handleStatusChange = async (actionId, newStatus) => {
         if (!isAuthenticated || !accessToken) { alert("Not authenticated."); return; }
+        const baseVersion = deviation.actions.find(action => action.id === actionId).version;
 
         // Optimistically update the UI first
         setDeviation(prevDeviation => {
@@ -226,7 +509,7 @@ function DeviationDetail({ onDataChanged }) {
             const updatedActions = prevDeviation.actions.map(action =>
                 action.id === actionId ? { ...action, status: newStatus } : action
             );
-            const newDeviationStatus = calculateDeviationStatus(updatedActions);
+            const newDeviationStatus = nextDeviationStatus(prevDeviation, updatedActions);
 
             return {
                 ...prevDeviation,
@@ -241,16 +524,29 @@ function DeviationDetail({ onDataChanged }) {
                 method: 'PATCH',
                 headers: {
                     'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${accessToken}`
+                    'Authorization': `Bearer ${accessToken}`,
+                    'If-Match': `"${baseVersion}"`,
                 },
                 body: JSON.stringify({ status: newStatus }),
             });
 
+            if (response.status === 409) {
+                alert("Someone else changed this action in the meantime. Reloading the deviation.");
+                refetchDeviation();
+                return;
+            }
             if (!response.ok) {
                 const errorData = await response.json();
                 throw new Error(`HTTP error! Status: ${response.status}. Details: ${JSON.stringify(errorData)}`);
             }
 
+            const savedAction = await response.json();
+            setDeviation(prevDeviation => ({
+                ...prevDeviation,
+                actions: prevDeviation.actions.map(action =>
+                    action.id === actionId ? { ...action, version: savedAction.version } : action
+                )
+            }));
             console.log(`Action ${actionId} status updated to ${newStatus} (API confirmed).`);
             // No need to call `onDataChanged()` here as the DeviationDetail handles its own state.
         } catch (error) {
@@ -263,14 +559,69 @@ function DeviationDetail({ onDataChanged }) {
         }
     };
 
-    const renderAttachmentPreview = (attachmentUrl) => {
+    // One request for all of this deviation's actions assigned to the current user; the response carries
+    // the new versions and the deviation's recomputed status, so nothing needs to be refetched.
+    const handleMarkMyActionsDone = async () => {
+        if (!isAuthenticated || !accessToken) { alert("Not authenticated."); return; }
+        try {
+            const response = await fetch('/api/actions/bulk_status', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${accessToken}`
+                },
+                body: JSON.stringify({ status: 'Done', dev_number: devNumber, assigned_to_me: true }),
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}. Details: ${JSON.stringify(await response.json())}`);
+            }
+            const result = await response.json();
+            const versions = Object.fromEntries(result.actions.map(action => [action.id, action.version]));
+            const rollup = result.deviations.find(row => row.dev_number === devNumber);
+            setDeviation(prevDeviation => ({
+                ...prevDeviation,
+                actions: prevDeviation.actions.map(action =>
+                    action.id in versions ? { ...action, status: 'Done', version: versions[action.id] } : action
+                ),
+                ...(rollup ? {
+                    deviation_status: rollup.deviation_status,
+                    completion_percentage: rollup.completion_percentage,
+                    action_counts: rollup.action_counts,
+                } : {}),
+            }));
+            if (result.updated && onDataChanged) {
+                onDataChanged();
+            }
+        } catch (error) {
+            console.error("Error marking actions done:", error);
+            alert(`Failed to mark actions done: ${error.message}`);
+        }
+    };
+
+    const renderAttachmentPreview = (attachmentUrl, preview) => {
         if (!attachmentUrl) {
             return <div className="no-attachment-preview">No attachment to preview.</div>;
         }
 
         const lowerCaseUrl = attachmentUrl.toLowerCase();
 
-        if (lowerCaseUrl.endsWith('.pdf')) {
+        if (lowerCaseUrl.endsWith('.pdf') && !showFullPdf) {
+            // Thumbnail and page count only; the PDF itself is loaded on request
+            return (
+                <>
+                    {preview
+                        ? <AttachmentThumbnail preview={preview} accessToken={accessToken} />
+                        : <div className="no-attachment-preview">The preview is being generated.</div>}
+                    <p className="attachment-preview-info">
+                        {preview && preview.page_count ? `${preview.page_count} page${preview.page_count === 1 ? '' : 's'} · ` : ''}
+                        {preview ? displayFileSize(preview.file_size) : ''}
+                    </p>
+                    <button type="button" className="show-full-pdf-button" onClick={() => setShowFullPdf(true)}>
+                        Show full PDF
+                    </button>
+                </>
+            );
+        } else if (lowerCaseUrl.endsWith('.pdf')) {
             return (
                 <iframe
                     src={attachmentUrl}
@@ -318,10 +669,13 @@ function DeviationDetail({ onDataChanged }) {
         const [movedAction] = reorderedActions.splice(result.source.index, 1);
         reorderedActions.splice(result.destination.index, 0, movedAction);
 
-        // Prepare the payload for the backend with new 'order' values
+        // Prepare the payload for the backend: the loaded actions swap their existing 'order'
+        // values, so actions that are not loaded yet keep theirs.
+        const loadedOrders = deviation.actions.map(action => action.order).sort((a, b) => a - b);
         const newOrderPayload = reorderedActions.map((action, index) => ({
             id: action.id,
-            order: index + 1
+            order: loadedOrders[index],
+            version: action.version // The backend refuses the reorder if any of them changed meanwhile
         }));
 
         // Optimistically update the UI
@@ -329,7 +683,7 @@ function DeviationDetail({ onDataChanged }) {
             ...prevDeviation,
             actions: newOrderPayload.map(newAction => {
                 const originalAction = prevDeviation.actions.find(act => act.id === newAction.id);
-                return { ...originalAction, order: newAction.order };
+                return { ...originalAction, order: newAction.order, version: newAction.version + 1 };
             })
         }));
 
@@ -395,10 +749,15 @@ function DeviationDetail({ onDataChanged }) {
                     <Link to="/" className="back-link" onClick={onDataChanged}>
                         Back to All Deviations
                     </Link>
-                    <div className="deviation-actions-group">
-                        <Link to={`/deviations/${deviation.dev_number}/edit`} className="edit-link">Edit Deviation</Link>
-                        <button onClick={handleDeleteDeviation} className="delete-button">Delete Deviation</button>
-                    </div>
+                    {deviation.archived_at ? (
+                        // Archived deviations are read-only until restored (manage.py restore_deviations)
+                        <span className="archived-badge">Archived on {displayDate(deviation.archived_at)}</span>
+                    ) : (
+                        <div className="deviation-actions-group">
+                            <Link to={`/deviations/${deviation.dev_number}/edit`} className="edit-link">Edit Deviation</Link>
+                            <button onClick={handleDeleteDeviation} className="delete-button">Delete Deviation</button>
+                        </div>
+                    )}
                 </div>
 
                 <div className="detail-section">
@@ -433,19 +792,24 @@ function DeviationDetail({ onDataChanged }) {
 
                         <div className="attachment-preview-container">
                             <h4>File Preview</h4>
-                            {renderAttachmentPreview(deviation.attachment)}
+                            {renderAttachmentPreview(deviation.attachment, deviation.attachment_preview)}
                         </div>
                     </div>
                 </div>
 
                 <div className="detail-section">
                     <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '15px' }}>
-                        <h3>Actions ({deviation.actions ? deviation.actions.length : 0})</h3>
+                        <h3>Actions ({deviation.action_counts ? deviation.action_counts.total : (deviation.actions ? deviation.actions.length : 0)})</h3>
                         {/* Only show "Add" button if not currently editing an action */}
                         {editActionId === null && (
-                            <button onClick={() => setShowAddActionForm(!showAddActionForm)} className="add-action-button">
-                                {showAddActionForm ? 'Cancel Add Action' : 'Add New Action'}
-                            </button>
+                            <div>
+                                <button onClick={handleMarkMyActionsDone} className="add-action-button" style={{ marginRight: '10px' }}>
+                                    Mark My Actions Done
+                                </button>
+                                <button onClick={() => setShowAddActionForm(!showAddActionForm)} className="add-action-button">
+                                    {showAddActionForm ? 'Cancel Add Action' : 'Add New Action'}
+                                </button>
+                            </div>
                         )}
                     </div>
 
@@ -463,9 +827,8 @@ function DeviationDetail({ onDataChanged }) {
                                         {...provided.droppableProps}
                                         ref={provided.innerRef}
                                     >
-                                        {/* Sort actions by the 'order' field before mapping */}
+                                        {/* The API returns actions sorted by 'order' */}
                                         {deviation.actions
-                                            .sort((a, b) => a.order - b.order)
                                             .map((action, index) => (
                                                 <React.Fragment key={action.id}>
                                                     <Draggable
@@ -530,6 +893,13 @@ function DeviationDetail({ onDataChanged }) {
                                     </ul>
                                 )}
                             </Droppable>
+                            {deviation.action_counts && deviation.actions.length < deviation.action_counts.total && (
+                                <button onClick={loadMoreActions} disabled={loadingMoreActions} className="add-action-button">
+                                    {loadingMoreActions
+                                        ? 'Loading...'
+                                        : `Load more actions (${deviation.action_counts.total - deviation.actions.length} more)`}
+                                </button>
+                            )}
                         </DragDropContext>
                     ) : (
                         <p>No actions found for this deviation.</p>
@@ -185,6 +185,28 @@ function DeviationForm({ onDeviationCreatedOrUpdated }) {
     }
   };
 
+  // Reserves the next free DEV number for the form's year (this year if empty) instead of picking one by hand
+  const handleNextDevNumber = async () => {
+    try {
+      const response = await fetch('/api/deviation-numbers/next', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${accessToken}`,
+        },
+        body: JSON.stringify({ year: formData.year || null }),
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const data = await response.json();
+      setFormData(prevData => ({ ...prevData, dev_number: data.dev_number }));
+    } catch (error) {
+      console.error("Error allocating a DEV number:", error);
+      alert(`Failed to get the next DEV number: ${error.message}`);
+    }
+  };
+
   const handleSuggestionClick = (name, suggestedUser) => {
     setFormData(prevData => ({
       ...prevData,
@@ -341,6 +363,9 @@ function DeviationForm({ onDeviationCreatedOrUpdated }) {
               readOnly={isEditMode}
               style={isEditMode ? { backgroundColor: '#e9e9e9' } : {}}
             />
+            {!isEditMode && (
+              <button type="button" onClick={handleNextDevNumber}>Next number</button>
+            )}
           </div>
           <div className="form-group">
             <label>Primary Column:</label>
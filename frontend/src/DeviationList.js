@@ -78,6 +78,7 @@ function DeviationList({ deviations, loading, error, onDataChanged, filterMode }
                 <Link to={`/deviations/${deviation.dev_number}`}>
                   {displayValue(deviation.dev_number)}
                 </Link>
+                {deviation.archived_at && <span className="archived-badge">Archived</span>}
               </td>
               <td>{displayValue(deviation.year)}</td>
               <td>{displayValue(deviation.created_by)}</td>